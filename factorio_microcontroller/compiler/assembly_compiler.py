@@ -1,53 +1,81 @@
+import gc
 import json
-import re
 from dataclasses import dataclass
+from functools import cache
 
 import click
 from pathlib import Path
 
 from compiler.assembly_line import AssemblyLine, AssemblyToken
-from compiler.binary_line import BinaryLine
+from compiler.compile_cache import CompileCache
+from compiler.control_flow_optimizer import ControlFlowOptimizer
 from compiler.error_logger import ErrorLogger
+from compiler.function_inliner import FunctionInliner, DEFAULT_INLINE_SIZE
+from compiler.peephole_optimizer import PeepholeOptimizer
 from compiler.preprocessor import Preprocessor
 from compiler.reserved_identifiers import RESERVED_IDENTIFIERS, ReservedIdentifier, MAIN_FUNCTION_NAME
+from compiler.rom_image import RomImage, ROM_EXTENSION
 
 from compiler.token_type import TokenType
+from compiler.variable_allocator import VariableAllocator
 
 RESOURCE_FOLDER = Path(__file__).parent.parent.parent / "resources"
 
+OPCODE_BITS = 8
+LITERAL_MAX = (1 << 24) - 1
+
 
 @dataclass()
 class DisassemblerInfo:
     function_scopes: dict[str, list[AssemblyLine]]
     function_addresses: dict[str, int]
     variable_addresses: dict[str, dict[str, int]]
+    # the index of the instruction after each label, the labels are not in the function scopes
+    goto_map: dict[str, dict[str, int]]
 
 
 class AssemblyCompiler:
-    def __init__(self):
+    def __init__(self, compile_cache: CompileCache = None, optimize=False, inline_size=DEFAULT_INLINE_SIZE):
+        self.opcodes = AssemblyCompiler.load_opcode_table()
+        self.compile_cache = compile_cache
+        self.optimize = optimize
+        self.inline_size = inline_size
+        self.opcodes_key = CompileCache.get_key(self.opcodes)
+
+    @staticmethod
+    @cache
+    def load_opcode_table() -> dict:
         with open(RESOURCE_FOLDER / "opcodes.json") as opcodes:
-            opcodes = json.loads(opcodes.read())
-            self.opcodes = self.create_opcode_table(opcodes)
+            return AssemblyCompiler.create_opcode_table(json.loads(opcodes.read()))
 
-    def create_opcode_table(self, opcodes) -> dict:
+    @staticmethod
+    def create_opcode_table(opcodes) -> dict[str, int]:
         all_opcodes = dict()
         for opcode in opcodes:
             binary = opcodes[opcode]
             if len(binary) == 4:
                 for i in range(16):
                     binary = opcodes[opcode] + '{0:04b}'.format(i)
-                    all_opcodes[opcode + "," + str(i)] = binary
+                    all_opcodes[opcode + "," + str(i)] = int(binary, 2)
             else:
-                all_opcodes[opcode] = binary
+                all_opcodes[opcode] = int(binary, 2)
         return all_opcodes
 
     def compile(self, file_name) -> (str, DisassemblerInfo):
+        # the lines and tokens are many small objects without reference cycles, collecting them only costs time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.compile_file(file_name)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def compile_file(self, file_name) -> (str, DisassemblerInfo):
         with open(file_name) as f:
             raw_assembly_lines = f.read().splitlines()
 
-        assembly_lines = self.get_assembly_lines(raw_assembly_lines)
-        Preprocessor.preprocess(assembly_lines)
-        function_scopes = self.split_scopes(assembly_lines)
+        function_scopes, scope_keys = self.get_function_scopes(raw_assembly_lines)
 
         # remove FN and END lines
         for function_name in function_scopes.keys():
@@ -55,25 +83,158 @@ class AssemblyCompiler:
                 del function_scopes[function_name][0]
                 del function_scopes[function_name][-1]
 
-        goto_map = self.get_goto_map(function_scopes)
+        if self.optimize:
+            if self.compile_cache:
+                scope_keys = self.get_optimized_scope_keys(function_scopes, scope_keys)
+            FunctionInliner.inline(function_scopes, self.inline_size)
+            ControlFlowOptimizer.optimize(function_scopes)
+            PeepholeOptimizer.optimize(function_scopes)
+
+        # each pass goes over the lines once: symbols, then addresses, then the encoding
+        goto_map, variable_map = self.get_symbols(function_scopes)
+        if self.optimize:
+            shared_variables = VariableAllocator.allocate(function_scopes, goto_map, variable_map)
+            if self.compile_cache:
+                # the addresses of a function also depend on the CALLs in the other functions
+                scope_keys = {function_name: CompileCache.get_key(scope_key, shared_variables)
+                              for function_name, scope_key in scope_keys.items()}
         function_addresses = self.get_function_addresses(function_scopes)
-        variable_map = self.get_variables_map(function_scopes)
+        instructions = self.get_instructions(function_scopes, scope_keys, goto_map, function_addresses, variable_map)
 
-        binary_lines = self.get_binary_lines(function_scopes, goto_map, function_addresses, variable_map)
+        # the text binary is kept as a readable debug output next to the rom image
         binary_file_name = file_name[:-4] + '.bin'
         with open(binary_file_name, 'w') as f:
-            f.write('\n'.join(binary_line.binary for binary_line in binary_lines))
+            f.write('\n'.join(map('{0:032b}'.format, instructions)))
+
+        rom_file_name = file_name[:-4] + ROM_EXTENSION
+        RomImage.write(rom_file_name, instructions)
 
-        disassembler_info = DisassemblerInfo(function_scopes, function_addresses, variable_map)
-        return binary_file_name, disassembler_info
+        disassembler_info = DisassemblerInfo(function_scopes, function_addresses, variable_map, goto_map)
+        return rom_file_name, disassembler_info
 
-    def get_assembly_lines(self, raw_assembly_lines: list[str]) -> list[AssemblyLine]:
+    def get_optimized_scope_keys(self, function_scopes: dict[str, list[AssemblyLine]],
+                                 scope_keys: dict[str, str]) -> dict[str, str]:
+        # the optimizer inlines and jumps to the functions a function calls, so their lines are part of the key
+        referenced_functions = dict()
+        for function_name, assembly_lines in function_scopes.items():
+            referenced_functions[function_name] = {
+                assembly_line.assembly_token.arguments[0] for assembly_line in assembly_lines
+                if assembly_line.assembly_token.arguments and assembly_line.assembly_token.arguments[0] in function_scopes}
+
+        optimized_scope_keys = dict()
+        for function_name in function_scopes:
+            reachable_functions = set()
+            function_stack = [function_name]
+            while function_stack:
+                for referenced_function in referenced_functions[function_stack.pop()]:
+                    if referenced_function not in reachable_functions:
+                        reachable_functions.add(referenced_function)
+                        function_stack.append(referenced_function)
+
+            optimized_scope_keys[function_name] = CompileCache.get_key(
+                scope_keys[function_name], self.inline_size,
+                [scope_keys[reachable_function] for reachable_function in sorted(reachable_functions)])
+        return optimized_scope_keys
+
+    def get_cached(self, get_key, compute_value):
+        # the key is only computed when there is a cache
+        if self.compile_cache is None:
+            return compute_value()
+
+        key = get_key()
+        value = self.compile_cache.get(key)
+        if value is None:
+            value = compute_value()
+            self.compile_cache.put(key, value)
+        return value
+
+    @staticmethod
+    def get_segments(raw_assembly_lines: list[str]) -> list[tuple[int, int]]:
+        # split the file at the FN and END lines, every function is one segment and the lines between them are main
+        function_keyword = ReservedIdentifier.FUNCTION.value
+        function_end_keyword = ReservedIdentifier.FUNCTION_END.value
+        segments = []
+        start = 0
+        for index, raw_line in enumerate(raw_assembly_lines):
+            if function_keyword not in raw_line and function_end_keyword not in raw_line:
+                continue
+            words = raw_line.split('//', 1)[0].split(maxsplit=1)
+            keyword = words[0] if words else None
+            if keyword == function_keyword:
+                if index > start:
+                    segments.append((start, index))
+                start = index
+            elif keyword == function_end_keyword:
+                segments.append((start, index + 1))
+                start = index + 1
+
+        if start < len(raw_assembly_lines):
+            segments.append((start, len(raw_assembly_lines)))
+        return segments
+
+    def get_function_scopes(self, raw_assembly_lines: list[str]) -> (dict[str, list[AssemblyLine]], dict[str, str]):
+        function_scopes = {MAIN_FUNCTION_NAME: []}
+        segment_keys = {MAIN_FUNCTION_NAME: []}
+
+        defined_constants = dict()
+        for start, end in self.get_segments(raw_assembly_lines):
+            segment_key = None
+            if self.compile_cache:
+                # a segment only depends on its own lines and the constants defined before it
+                segment_key = CompileCache.get_key(self.opcodes_key, raw_assembly_lines[start:end],
+                                                   list(defined_constants.items()))
+            assembly_lines, defined_constants = self.preprocess_segment(raw_assembly_lines, start, end,
+                                                                        defined_constants, segment_key)
+
+            if assembly_lines and assembly_lines[0].assembly_token.keyword == ReservedIdentifier.FUNCTION.value:
+                function_line = assembly_lines[0]
+                if len(function_line.assembly_token.arguments) != 1:
+                    raise Exception(ErrorLogger.format_error("Syntax error", function_line.line, function_line))
+                function_name = function_line.assembly_token.arguments[0]
+                function_scopes[function_name] = assembly_lines
+                segment_keys[function_name] = [segment_key]
+            else:
+                function_scopes[MAIN_FUNCTION_NAME].extend(assembly_lines)
+                segment_keys[MAIN_FUNCTION_NAME].append(segment_key)
+
+        scope_keys = dict()
+        if self.compile_cache:
+            scope_keys = {function_name: CompileCache.get_key(keys) for function_name, keys in segment_keys.items()}
+        return function_scopes, scope_keys
+
+    def preprocess_segment(self, raw_assembly_lines: list[str], start, end, defined_constants: dict[str, str],
+                           segment_key) -> (list[AssemblyLine], dict[str, str]):
+        cached_segment = self.compile_cache.get(segment_key) if self.compile_cache else None
+        if cached_segment is None:
+            assembly_lines = self.get_assembly_lines(raw_assembly_lines[start:end], start)
+            defined_constants = Preprocessor.preprocess(assembly_lines, dict(defined_constants))
+            if self.compile_cache:
+                # only the tokens are cached, the lines are taken from the file so the segment can move
+                tokens = [(assembly_line.line_number - start, assembly_line.assembly_token.token_type,
+                           assembly_line.assembly_token.keyword, assembly_line.assembly_token.arguments)
+                          for assembly_line in assembly_lines]
+                self.compile_cache.put(segment_key, (tokens, defined_constants))
+            return assembly_lines, defined_constants
+
+        tokens, defined_constants = cached_segment
         assembly_lines = []
-        for line_number, raw_line in enumerate(raw_assembly_lines):
-            if not raw_line or re.match(r"^\s*\/\/", raw_line):
+        for line_offset, token_type, keyword, arguments in tokens:
+            raw_line = raw_assembly_lines[start + line_offset - 1]
+            assembly_lines.append(AssemblyLine(
+                raw_line=raw_line,
+                line_number=start + line_offset,
+                line=raw_line.split('//', 1)[0].strip(),
+                assembly_token=AssemblyToken(token_type, keyword, arguments),
+            ))
+        return assembly_lines, defined_constants
+
+    def get_assembly_lines(self, raw_assembly_lines: list[str], line_offset=0) -> list[AssemblyLine]:
+        assembly_lines = []
+        for line_number, raw_line in enumerate(raw_assembly_lines, start=line_offset):
+            line = raw_line.split('//', 1)[0].strip()
+            if not line:
                 continue
 
-            line = re.sub(r"\/\/.*$", '', raw_line).strip()
             try:
                 assembly_token = self.get_assembly_token(line)
             except ValueError:
@@ -94,7 +255,7 @@ class AssemblyCompiler:
         values = line.split()
         keyword = values[0]
 
-        if re.match(r"^#", keyword):
+        if keyword.startswith('#'):
             token_type = TokenType.PREPROCESSOR
         elif keyword in self.opcodes:
             token_type = TokenType.ASSEMBLY_INSTRUCTION
@@ -106,40 +267,34 @@ class AssemblyCompiler:
         arguments = values[1:]
         return AssemblyToken(token_type, keyword, arguments)
 
-    def split_scopes(self, assembly_lines: list[AssemblyLine]) -> dict[str, list[AssemblyLine]]:
-        function_scopes = {MAIN_FUNCTION_NAME: []}
-
-        current_scope = function_scopes[MAIN_FUNCTION_NAME]
-        for assembly_line in assembly_lines:
-            if assembly_line.assembly_token.keyword == ReservedIdentifier.FUNCTION.value:
-                if len(assembly_line.assembly_token.arguments) != 1:
-                    raise Exception(ErrorLogger.format_error("Syntax error", assembly_line.line, assembly_line))
-                function_name = assembly_line.assembly_token.arguments[0]
-                function_scopes[function_name] = []
-                current_scope = function_scopes[function_name]
-                current_scope.append(assembly_line)
-            elif assembly_line.assembly_token.keyword == ReservedIdentifier.FUNCTION_END.value:
-                current_scope.append(assembly_line)
-                current_scope = function_scopes[MAIN_FUNCTION_NAME]
-            else:
-                current_scope.append(assembly_line)
-
-        return function_scopes
-
-    def get_goto_map(self, function_scopes: dict[str, list[AssemblyLine]]):
+    def get_symbols(self, function_scopes: dict[str, list[AssemblyLine]]):
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
         goto_map = dict()
+        variables_map = dict()
         for function_name, assembly_lines in function_scopes.items():
             function_goto = dict()
-            count = 0
-            for assembly_line in assembly_lines[:]:
+            function_variables = dict()
+            instruction_lines = []
+            for assembly_line in assembly_lines:
                 token = assembly_line.assembly_token
-                if token.keyword == ReservedIdentifier.GOTO_LABEL.value:
-                    function_goto[token.arguments[0]] = count
-                    assembly_lines.remove(assembly_line)
-                else:
-                    count += 1
+                if token.keyword == label_keyword:
+                    function_goto[token.arguments[0]] = len(instruction_lines)
+                    continue
+
+                # a VAR with a number only sets the variable offset, the inliner and the allocator emit them for
+                # the frames of the callees. it used to declare a variable named by the number, use a name for that
+                if token.keyword == 'VAR' and token.arguments[0].isidentifier():
+                    variable_name = token.arguments[0]
+                    if variable_name in function_variables:
+                        raise Exception(ErrorLogger.format_error("Duplicate variable", variable_name, assembly_line))
+                    function_variables[variable_name] = len(function_variables) + 1
+                instruction_lines.append(assembly_line)
+
+            # the labels are removed in place, the scopes are shared with the disassembler info
+            assembly_lines[:] = instruction_lines
             goto_map[function_name] = function_goto
-        return goto_map
+            variables_map[function_name] = function_variables
+        return goto_map, variables_map
 
     def get_function_addresses(self, function_scopes: dict[str, list[AssemblyLine]]):
         function_addresses = dict()
@@ -152,81 +307,95 @@ class AssemblyCompiler:
             current_address += len(assembly_lines)
         return function_addresses
 
-    def get_variables_map(self, function_scopes: dict[str, list[AssemblyLine]]):
-        variables_map = dict()
-        for function_name, assembly_lines in function_scopes.items():
-            function_variables = dict()
-            address = 1
-            for assembly_line in assembly_lines:
-                token = assembly_line.assembly_token
-                if token.keyword == 'VAR':
-                    variable_name = token.arguments[0]
-                    if variable_name in function_variables:
-                        raise Exception(ErrorLogger.format_error("Duplicate variable", variable_name, assembly_line))
-                    function_variables[variable_name] = address
-                    address += 1
-            variables_map[function_name] = function_variables
-        return variables_map
-
-    def get_binary_lines(self, function_scopes, goto_map, function_addresses, variable_map) -> list[BinaryLine]:
-        binary_map = dict()
+    def get_instructions(self, function_scopes, scope_keys, goto_map, function_addresses, variable_map) -> list[int]:
+        instruction_map = dict()
         for function_name, assembly_lines in function_scopes.items():
-            function_binary = []
-            for assembly_line in assembly_lines:
-                instruction_binary = self.opcodes[assembly_line.assembly_token.keyword]
-                literal = self.get_literal(assembly_line, function_addresses[function_name], function_addresses,
-                                           goto_map[function_name], variable_map[function_name])
-                binary_line = BinaryLine(literal + instruction_binary, assembly_line)
-                function_binary.append(binary_line)
-            binary_map[function_name] = function_binary
-
-        all_binary_lines = [binary_line for binary_line in binary_map[MAIN_FUNCTION_NAME]]
+            function_address = function_addresses[function_name]
+            instruction_map[function_name] = self.get_cached(
+                lambda: self.get_instruction_key(scope_keys[function_name], assembly_lines, function_address,
+                                                 function_addresses, variable_map[function_name]),
+                lambda: self.get_function_instructions(assembly_lines, function_address, function_addresses,
+                                                       goto_map[function_name], variable_map[function_name]))
+
+        all_instructions = instruction_map.pop(MAIN_FUNCTION_NAME)
         # add halt between program memory and function memory
-        all_binary_lines.append(BinaryLine('{0:032b}'.format(0), None))
+        all_instructions.append(0)
 
-        for function_name, binary_lines in binary_map.items():
-            if function_name == MAIN_FUNCTION_NAME:
-                continue
-            for binary_line in binary_lines:
-                all_binary_lines.append(binary_line)
+        for instructions in instruction_map.values():
+            all_instructions.extend(instructions)
+
+        return all_instructions
 
-        return all_binary_lines
+    def get_instruction_key(self, scope_key, assembly_lines: list[AssemblyLine], function_address, function_addresses,
+                            variables) -> str:
+        # a function is only encoded again when its lines or the addresses it references change
+        has_goto = False
+        referenced_functions = set()
+        for assembly_line in assembly_lines:
+            token = assembly_line.assembly_token
+            if token.keyword == 'GOTO':
+                has_goto = True
+            if token.arguments and token.arguments[0] not in variables and token.arguments[0] in function_addresses:
+                referenced_functions.add(token.arguments[0])
+
+        referenced_addresses = [(function_name, function_addresses[function_name])
+                                for function_name in sorted(referenced_functions)]
+        return CompileCache.get_key(scope_key, self.optimize, function_address if has_goto else None,
+                                    referenced_addresses)
+
+    def get_function_instructions(self, assembly_lines: list[AssemblyLine], function_address, function_addresses,
+                                  goto_map, variables) -> list[int]:
+        opcodes = self.opcodes
+        return [(self.get_literal(assembly_line, function_address, function_addresses, goto_map, variables)
+                 << OPCODE_BITS) | opcodes[assembly_line.assembly_token.keyword]
+                for assembly_line in assembly_lines]
 
     def get_literal(self, assembly_line: AssemblyLine, function_address, function_addresses, goto_map,
-                    variables) -> str:
+                    variables) -> int:
         token = assembly_line.assembly_token
         if not token.arguments:
-            return '{0:024b}'.format(0)
+            return 0
+
+        argument = token.arguments[0]
 
         if token.keyword == 'GOTO':
-            label = token.arguments[0]
-            if label in goto_map:
-                literal = goto_map[label] + function_address
-                return '{0:024b}'.format(literal)
+            if argument in goto_map:
+                return goto_map[argument] + function_address
+            # a tail call of the optimizer jumps to the start of a function
+            elif argument in function_addresses:
+                return function_addresses[argument]
             else:
-                raise Exception(ErrorLogger.format_error("GOTO label does not exist", label, assembly_line))
-
-        argument = token.arguments[0]
+                raise Exception(ErrorLogger.format_error("GOTO label does not exist", argument, assembly_line))
 
         if argument in variables:
-            return '{0:024b}'.format(variables[argument])
+            return variables[argument]
         if argument in function_addresses:
-            return '{0:024b}'.format(function_addresses[argument])
+            return function_addresses[argument]
 
-        if re.match(r"^0b", argument):
-            return '{0:024b}'.format(int(argument.replace('0b', ''), 2))
-        if re.match(r"^0x", argument):
-            return '{0:024b}'.format(int(argument, 16))
-        if re.match(r"\d*", argument):
-            return '{0:024b}'.format(int(argument))
+        try:
+            if argument.startswith('0b'):
+                literal = int(argument[2:], 2)
+            elif argument.startswith('0x'):
+                literal = int(argument, 16)
+            else:
+                literal = int(argument)
+        except ValueError:
+            raise Exception(ErrorLogger.format_error("Error with literal", argument, assembly_line))
 
-        raise Exception(ErrorLogger.format_error("Error with literal", argument, assembly_line))
+        if not 0 <= literal <= LITERAL_MAX:
+            raise Exception(ErrorLogger.format_error("Literal does not fit in 24 bits", argument, assembly_line))
+        return literal
 
 
 @click.command()
 @click.option('--assembly-file', '-a', help='Assembly file')
-def main(assembly_file):
-    assembly_compiler = AssemblyCompiler()
+@click.option('--cache', 'use_cache', is_flag=True,
+              help='Only compile the functions that changed since the last cached compile')
+@click.option('--optimize', '-O', is_flag=True, help='Remove redundant instructions and jumps with the optimizer passes')
+@click.option('--inline-size', type=int, show_default=True, default=DEFAULT_INLINE_SIZE,
+              help='Inline the leaf functions up to this many instructions when optimizing')
+def main(assembly_file, use_cache, optimize, inline_size):
+    assembly_compiler = AssemblyCompiler(CompileCache() if use_cache else None, optimize, inline_size)
     assembly_compiler.compile(assembly_file)
 
 
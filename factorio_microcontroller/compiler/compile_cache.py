@@ -0,0 +1,41 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+DEFAULT_CACHE_FOLDER = Path(__file__).parent.parent.parent / ".compile_cache"
+# part of every key, so entries of an older compiler are never used
+CACHE_VERSION = 3
+
+
+class CompileCache:
+    def __init__(self, cache_folder=DEFAULT_CACHE_FOLDER):
+        self.cache_folder = Path(cache_folder)
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(*parts) -> str:
+        key_hash = hashlib.sha1(str(CACHE_VERSION).encode())
+        for part in parts:
+            key_hash.update(b'\0' + repr(part).encode())
+        return key_hash.hexdigest()
+
+    def get(self, key):
+        try:
+            with open(self.cache_folder / key, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        # written to a temporary file first, so a compile running in parallel never reads a partial entry
+        temp_file = self.cache_folder / (key + "." + str(os.getpid()) + ".tmp")
+        with open(temp_file, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, self.cache_folder / key)
@@ -0,0 +1,138 @@
+from compiler.assembly_line import AssemblyLine
+from compiler.peephole_optimizer import PeepholeOptimizer
+from compiler.reserved_identifiers import ReservedIdentifier, MAIN_FUNCTION_NAME
+
+JUMP_OPERATIONS = ["GOTO", "RET", "RETLW", "RETFW"]
+# the instructions with an F argument besides the ones that end with F
+F_OPERATIONS = ["MOVFW", "RETFW"]
+
+
+class ControlFlowOptimizer:
+    @staticmethod
+    def optimize(function_scopes: dict[str, list[AssemblyLine]]) -> int:
+        # the lines are changed in place like the peephole optimizer, so the disassembler info stays correct
+        line_count = sum(len(assembly_lines) for assembly_lines in function_scopes.values())
+
+        frame_free_functions = ControlFlowOptimizer.get_frame_free_functions(function_scopes)
+        for function_name, assembly_lines in function_scopes.items():
+            if function_name != MAIN_FUNCTION_NAME:
+                ControlFlowOptimizer.replace_tail_calls(assembly_lines, frame_free_functions)
+            ControlFlowOptimizer.thread_jumps(assembly_lines)
+            ControlFlowOptimizer.remove_unused_labels(assembly_lines)
+            ControlFlowOptimizer.remove_unreachable_lines(assembly_lines)
+
+        return line_count - sum(len(assembly_lines) for assembly_lines in function_scopes.values())
+
+    @staticmethod
+    def get_frame_free_functions(function_scopes: dict[str, list[AssemblyLine]]) -> set[str]:
+        # a GOTO to a function keeps the frame of the caller, the arguments are written to the frame of the callee
+        # so only functions that never use the frame, also in the functions they call, can be jumped to
+        called_functions = dict()
+        frame_free_functions = set()
+        for function_name, assembly_lines in function_scopes.items():
+            if function_name == MAIN_FUNCTION_NAME:
+                continue
+            called_functions[function_name] = set()
+            uses_frame = False
+            for assembly_line in assembly_lines:
+                token = assembly_line.assembly_token
+                if ControlFlowOptimizer.is_f_operation(token.keyword) or token.keyword == "VAR":
+                    uses_frame = True
+                    break
+                if token.keyword in ("CALL", "GOTO") and token.arguments[0] in function_scopes:
+                    called_functions[function_name].add(token.arguments[0])
+            if not uses_frame:
+                frame_free_functions.add(function_name)
+
+        removed = True
+        while removed:
+            removed = False
+            for function_name in list(frame_free_functions):
+                if not called_functions[function_name] <= frame_free_functions:
+                    frame_free_functions.remove(function_name)
+                    removed = True
+        return frame_free_functions
+
+    @staticmethod
+    def is_f_operation(keyword) -> bool:
+        return keyword.split(',')[0].endswith('F') or keyword in F_OPERATIONS
+
+    @staticmethod
+    def replace_tail_calls(assembly_lines: list[AssemblyLine], frame_free_functions: set[str]):
+        # CALL f, RET returns the W of f, a GOTO to f returns from f to the caller with the same W
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        for line_index, assembly_line in enumerate(assembly_lines):
+            token = assembly_line.assembly_token
+            if token.keyword != "CALL" or token.arguments[0] not in frame_free_functions:
+                continue
+
+            for next_line in assembly_lines[line_index + 1:]:
+                if next_line.assembly_token.keyword != label_keyword:
+                    if next_line.assembly_token.keyword == "RET":
+                        assembly_lines[line_index] = PeepholeOptimizer.replace_token(assembly_line, "GOTO",
+                                                                                     token.arguments[0])
+                    break
+
+    @staticmethod
+    def thread_jumps(assembly_lines: list[AssemblyLine]):
+        # a GOTO to a label where the next instruction is a GOTO goes to the target of that GOTO
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        label_jumps = dict()
+        labels = []
+        for assembly_line in assembly_lines:
+            token = assembly_line.assembly_token
+            if token.keyword == label_keyword:
+                labels.append(token.arguments[0])
+                continue
+            if token.keyword == "GOTO":
+                for label in labels:
+                    label_jumps[label] = token.arguments[0]
+            labels = []
+
+        for line_index, assembly_line in enumerate(assembly_lines):
+            token = assembly_line.assembly_token
+            if token.keyword != "GOTO" or token.arguments[0] not in label_jumps:
+                continue
+
+            target = token.arguments[0]
+            visited_targets = set()
+            while target in label_jumps and target not in visited_targets:
+                visited_targets.add(target)
+                target = label_jumps[target]
+            # an endless loop of jumps is left as it is
+            if target in label_jumps:
+                continue
+            assembly_lines[line_index] = PeepholeOptimizer.replace_token(assembly_line, "GOTO", target)
+
+    @staticmethod
+    def remove_unused_labels(assembly_lines: list[AssemblyLine]):
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        used_labels = {assembly_line.assembly_token.arguments[0] for assembly_line in assembly_lines
+                       if assembly_line.assembly_token.keyword == "GOTO"}
+        assembly_lines[:] = [assembly_line for assembly_line in assembly_lines
+                             if assembly_line.assembly_token.keyword != label_keyword or
+                             assembly_line.assembly_token.arguments[0] in used_labels]
+
+    @staticmethod
+    def remove_unreachable_lines(assembly_lines: list[AssemblyLine]):
+        # after a jump that can not be skipped nothing runs until the next label
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        protected_indexes, _ = PeepholeOptimizer.get_skip_blocks(assembly_lines)
+
+        reachable_lines = []
+        reachable = True
+        instruction_index = -1
+        for assembly_line in assembly_lines:
+            token = assembly_line.assembly_token
+            if token.keyword == label_keyword:
+                reachable = True
+                reachable_lines.append(assembly_line)
+                continue
+
+            instruction_index += 1
+            # the variables are kept, they are still needed for the addresses
+            if reachable or token.keyword == "VAR":
+                reachable_lines.append(assembly_line)
+            if token.keyword in JUMP_OPERATIONS and instruction_index not in protected_indexes:
+                reachable = False
+        assembly_lines[:] = reachable_lines
@@ -0,0 +1,185 @@
+from compiler.assembly_line import AssemblyLine
+from compiler.control_flow_optimizer import ControlFlowOptimizer, JUMP_OPERATIONS
+from compiler.peephole_optimizer import PeepholeOptimizer
+from compiler.reserved_identifiers import ReservedIdentifier, MAIN_FUNCTION_NAME
+
+# functions with at most this many instructions are inlined
+DEFAULT_INLINE_SIZE = 8
+RETURN_OPERATIONS = ["RET", "RETLW", "RETFW"]
+
+
+class FunctionInliner:
+    @staticmethod
+    def inline(function_scopes: dict[str, list[AssemblyLine]], inline_size=DEFAULT_INLINE_SIZE) -> int:
+        inline_functions = {function_name: assembly_lines for function_name, assembly_lines in function_scopes.items()
+                            if function_name != MAIN_FUNCTION_NAME and
+                            FunctionInliner.can_inline(assembly_lines, function_scopes, inline_size)}
+
+        inlined_count = 0
+        for function_name, assembly_lines in function_scopes.items():
+            # an inlined function does not call any function
+            if function_name not in inline_functions:
+                inlined_count += FunctionInliner.inline_calls(function_name, assembly_lines, inline_functions)
+
+        # the inlined functions that are not used anymore are removed
+        referenced_names = {assembly_line.assembly_token.arguments[0] for assembly_lines in function_scopes.values()
+                            for assembly_line in assembly_lines if assembly_line.assembly_token.arguments}
+        for function_name in inline_functions:
+            if function_name not in referenced_names:
+                del function_scopes[function_name]
+        return inlined_count
+
+    @staticmethod
+    def can_inline(assembly_lines: list[AssemblyLine], function_scopes: dict[str, list[AssemblyLine]],
+                   inline_size) -> bool:
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        instruction_lines = [assembly_line for assembly_line in assembly_lines
+                             if assembly_line.assembly_token.keyword != label_keyword]
+        if not instruction_lines or len(instruction_lines) > inline_size:
+            return False
+        # the last instruction has to leave the function, otherwise it runs into the next function
+        if instruction_lines[-1].assembly_token.keyword not in JUMP_OPERATIONS:
+            return False
+
+        labels = {assembly_line.assembly_token.arguments[0] for assembly_line in assembly_lines
+                  if assembly_line.assembly_token.keyword == label_keyword}
+        protected_indexes, _ = PeepholeOptimizer.get_skip_blocks(assembly_lines)
+        # a skip past the end lands in the next function
+        if protected_indexes and max(protected_indexes) >= len(instruction_lines):
+            return False
+        for instruction_index, assembly_line in enumerate(instruction_lines):
+            token = assembly_line.assembly_token
+            # only leaf functions, and MOVLF writes relative to the frame of the function
+            if token.keyword in ("CALL", "MOVLF"):
+                return False
+            if token.keyword == "GOTO" and token.arguments[0] not in labels and token.arguments[0] in function_scopes:
+                return False
+            # a skipped return can only be replaced with one GOTO
+            if token.keyword in ("RETLW", "RETFW") and instruction_index in protected_indexes:
+                return False
+        return True
+
+    @staticmethod
+    def inline_calls(function_name, assembly_lines: list[AssemblyLine],
+                     inline_functions: dict[str, list[AssemblyLine]]) -> int:
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        protected_indexes, _ = PeepholeOptimizer.get_skip_blocks(assembly_lines)
+
+        # the variables of the callee start after the variable offset of the CALL, it is known until a label or CALL
+        variable_offset = 0 if function_name == MAIN_FUNCTION_NAME else None
+        variable_count = 0
+        inlined_count = 0
+        inlined_lines = []
+        instruction_index = -1
+        for assembly_line in assembly_lines:
+            token = assembly_line.assembly_token
+            if token.keyword == label_keyword:
+                variable_offset = None
+                inlined_lines.append(assembly_line)
+                continue
+
+            instruction_index += 1
+            if token.keyword == "VAR":
+                if token.arguments[0].isidentifier():
+                    variable_count += 1
+                    variable = variable_count
+                else:
+                    variable = PeepholeOptimizer.get_number(token.arguments[0])
+                variable_offset = None if instruction_index in protected_indexes else variable
+
+            elif token.keyword == "CALL":
+                callee_lines = inline_functions.get(token.arguments[0])
+                uses_frame = callee_lines is not None and any(
+                    ControlFlowOptimizer.is_f_operation(callee_line.assembly_token.keyword)
+                    for callee_line in callee_lines)
+                if (callee_lines is None or instruction_index in protected_indexes or
+                        (uses_frame and variable_offset is None)):
+                    variable_offset = None
+                else:
+                    label_prefix = token.arguments[0] + "_INLINE_" + str(inlined_count)
+                    inlined_lines += FunctionInliner.get_inlined_lines(assembly_line, callee_lines, variable_offset,
+                                                                       label_prefix)
+                    inlined_count += 1
+                    # the VAR lines of the callee set the variable offset like they do in the CALL
+                    if any(callee_line.assembly_token.keyword == "VAR" for callee_line in callee_lines):
+                        variable_offset = None
+                    continue
+
+            inlined_lines.append(assembly_line)
+
+        assembly_lines[:] = inlined_lines
+        return inlined_count
+
+    @staticmethod
+    def get_inlined_lines(call_line: AssemblyLine, callee_lines: list[AssemblyLine], variable_offset,
+                          label_prefix) -> list[AssemblyLine]:
+        # the variables of the callee are the same addresses in the frame of the caller as they are with the CALL
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        callee_variables = dict()
+        for callee_line in callee_lines:
+            token = callee_line.assembly_token
+            if token.keyword == "VAR" and token.arguments[0].isidentifier():
+                callee_variables[token.arguments[0]] = len(callee_variables) + 1
+
+        instruction_lines = [callee_line for callee_line in callee_lines
+                             if callee_line.assembly_token.keyword != label_keyword]
+        protected_indexes, _ = PeepholeOptimizer.get_skip_blocks(callee_lines)
+        return_label = label_prefix
+        has_return_jump = False
+
+        inlined_lines = []
+        instruction_index = -1
+        for callee_line in callee_lines:
+            token = callee_line.assembly_token
+            keyword = token.keyword
+            if keyword == label_keyword:
+                inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, keyword,
+                                                                     label_prefix + "_" + token.arguments[0]))
+                continue
+
+            instruction_index += 1
+            if keyword == "GOTO":
+                inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, keyword,
+                                                                     label_prefix + "_" + token.arguments[0]))
+                continue
+
+            is_last = instruction_index == len(instruction_lines) - 1
+            if keyword in RETURN_OPERATIONS:
+                if keyword == "RETLW":
+                    inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, "MOVLW", token.arguments[0]))
+                elif keyword == "RETFW":
+                    argument = FunctionInliner.get_frame_argument(token.arguments[0], callee_variables,
+                                                                  variable_offset)
+                    inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, "MOVFW", argument))
+
+                # a return that is skipped stays one instruction
+                if not is_last or (keyword == "RET" and instruction_index in protected_indexes):
+                    inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, "GOTO", return_label))
+                    has_return_jump = True
+                continue
+
+            if not token.arguments:
+                inlined_lines.append(callee_line)
+            elif keyword == "VAR":
+                # the variable is declared by the caller, only the variable offset is kept
+                argument = str(callee_variables.get(token.arguments[0], token.arguments[0]))
+                inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, keyword, argument))
+            elif ControlFlowOptimizer.is_f_operation(keyword):
+                argument = FunctionInliner.get_frame_argument(token.arguments[0], callee_variables, variable_offset)
+                inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, keyword, argument))
+            elif token.arguments[0] in callee_variables:
+                argument = str(callee_variables[token.arguments[0]])
+                inlined_lines.append(PeepholeOptimizer.replace_token(callee_line, keyword, argument))
+            else:
+                inlined_lines.append(callee_line)
+
+        if has_return_jump:
+            inlined_lines.append(PeepholeOptimizer.replace_token(call_line, label_keyword, return_label))
+        return inlined_lines
+
+    @staticmethod
+    def get_frame_argument(argument, callee_variables: dict[str, int], variable_offset) -> str:
+        if argument in callee_variables:
+            return str(variable_offset + callee_variables[argument])
+        address = PeepholeOptimizer.get_number(argument)
+        return argument if address is None else str(variable_offset + address)
@@ -0,0 +1,238 @@
+import operator
+import re
+
+from compiler.assembly_line import AssemblyLine, AssemblyToken
+from compiler.reserved_identifiers import RESERVED_IDENTIFIERS, ReservedIdentifier
+from compiler.token_type import TokenType
+
+LITERAL_MAX = (1 << 24) - 1
+SKIP_PATTERN = re.compile(r"(GRTWF|GRTWL|LESSWF|LESSWL|EQWF|EQWL),(\d+)")
+
+# W op literal, folded when W holds a known literal
+LITERAL_OPERATIONS = {
+    "ADDWL,w": operator.add,
+    "SUBWL,w": operator.sub,
+    "MULWL,w": operator.mul,
+    "DIVWL,w": lambda a, b: int(a / b),
+    "MODWL,w": operator.mod,
+    "ANDWL,w": operator.and_,
+    "ORWL,w": operator.or_,
+    "ROLWL,w": operator.lshift,
+    "RORWL,w": operator.rshift,
+}
+# W op F where the order does not matter, the literal form is used when W already equals F
+COMMUTATIVE_OPERATIONS = {
+    "ADDWF,w": "ADDWL,w",
+    "MULWF,w": "MULWL,w",
+    "ANDWF,w": "ANDWL,w",
+    "ORWF,w": "ORWL,w",
+}
+# instructions that only write the F argument
+F_WRITE_OPERATIONS = [
+    "ADDWF,f", "SUBWF,f", "MULWF,f", "DIVWF,f", "MODWF,f", "ANDWF,f", "ORWF,f",
+    "ROLF,f", "RORF,f", "INCRF", "DECRF", "RINF,1", "RINF,2",
+]
+# instructions that read neither W nor F for their value and keep both unchanged
+STATE_KEEPING_OPERATIONS = [
+    "VAR", "PULSE", "WOUTL,1", "WOUTL,2", "WOUTF,1", "WOUTF,2", "WOUTW,1", "WOUTW,2",
+    "IGRENDER", "IGDRAWPL", "IGDRAWPF", "IGCLEAR", "IGDRAWVL", "IGDRAWVF", "IGDRAWHL", "IGDRAWHF",
+    "IGDRAWRL", "IGDRAWRF", "IGSETFL", "IGSETFF", "IGSAVE", "IGLOAD",
+]
+CONTROL_OPERATIONS = ["CALL", "GOTO", "RET", "RETLW", "RETFW", "HALT"]
+
+
+class RegisterState:
+    def __init__(self):
+        # the literal W holds and the variables that hold the same value as W
+        self.w_literal = None
+        self.w_variables = set()
+
+    def copy(self):
+        register_state = RegisterState()
+        register_state.w_literal = self.w_literal
+        register_state.w_variables = set(self.w_variables)
+        return register_state
+
+
+class PeepholeOptimizer:
+    @staticmethod
+    def optimize(function_scopes: dict[str, list[AssemblyLine]]) -> int:
+        # the lines are removed in place, so the disassembler info only has the lines that are still compiled
+        removed_count = 0
+        for assembly_lines in function_scopes.values():
+            while True:
+                optimized_lines = PeepholeOptimizer.optimize_lines(assembly_lines)
+                if len(optimized_lines) == len(assembly_lines):
+                    break
+                removed_count += len(assembly_lines) - len(optimized_lines)
+                assembly_lines[:] = optimized_lines
+        return removed_count
+
+    @staticmethod
+    def optimize_lines(assembly_lines: list[AssemblyLine]) -> list[AssemblyLine]:
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+        protected_indexes, block_starts = PeepholeOptimizer.get_skip_blocks(assembly_lines)
+
+        optimized_lines = []
+        register_state = RegisterState()
+        # the state before the last kept instruction, it is still valid when that instruction is removed again
+        previous_state = None
+        instruction_index = -1
+        for line_index, assembly_line in enumerate(assembly_lines):
+            token = assembly_line.assembly_token
+            if token.keyword == label_keyword:
+                register_state = RegisterState()
+                previous_state = None
+                optimized_lines.append(assembly_line)
+                continue
+
+            instruction_index += 1
+            if instruction_index in block_starts:
+                register_state = RegisterState()
+                previous_state = None
+
+            if instruction_index in protected_indexes:
+                PeepholeOptimizer.update_state(token, register_state)
+                previous_state = None
+                optimized_lines.append(assembly_line)
+                continue
+
+            if PeepholeOptimizer.is_removable(assembly_lines, line_index, register_state):
+                continue
+
+            argument = token.arguments[0] if token.arguments else None
+            last_line = optimized_lines[-1] if optimized_lines and previous_state is not None else None
+            if token.keyword in LITERAL_OPERATIONS and register_state.w_literal is not None:
+                literal = PeepholeOptimizer.fold_literal(token.keyword, register_state.w_literal, argument)
+                if literal is not None:
+                    # MOVLW a, ADDWL,w b is MOVLW a + b, the first MOVLW is removed when it is the last instruction
+                    assembly_line = PeepholeOptimizer.replace_token(assembly_line, "MOVLW", literal)
+                    token = assembly_line.assembly_token
+                    if last_line is not None and last_line.assembly_token.keyword == "MOVLW":
+                        optimized_lines.pop()
+                        register_state = previous_state
+
+            elif (token.keyword in COMMUTATIVE_OPERATIONS and last_line is not None and
+                  last_line.assembly_token.keyword == "MOVLW" and argument in previous_state.w_variables):
+                # W equals F before the MOVLW, so MOVLW a, ADDWF,w f is ADDWL,w a
+                assembly_line = PeepholeOptimizer.replace_token(assembly_line, COMMUTATIVE_OPERATIONS[token.keyword],
+                                                                last_line.assembly_token.arguments[0])
+                token = assembly_line.assembly_token
+                optimized_lines.pop()
+                register_state = previous_state
+
+            previous_state = register_state.copy()
+            PeepholeOptimizer.update_state(token, register_state)
+            optimized_lines.append(assembly_line)
+        return optimized_lines
+
+    @staticmethod
+    def get_skip_blocks(assembly_lines: list[AssemblyLine]) -> (set[int], set[int]):
+        # the instructions a conditional can skip keep their place, where it lands a new block starts
+        protected_indexes = set()
+        block_starts = set()
+        instruction_index = -1
+        for assembly_line in assembly_lines:
+            token = assembly_line.assembly_token
+            if token.token_type != TokenType.ASSEMBLY_INSTRUCTION:
+                continue
+            instruction_index += 1
+
+            skip_match = SKIP_PATTERN.fullmatch(token.keyword)
+            if skip_match:
+                skip_count = int(skip_match.group(2))
+                protected_indexes.update(range(instruction_index + 1, instruction_index + skip_count + 2))
+                block_starts.add(instruction_index + 1)
+                block_starts.add(instruction_index + skip_count + 2)
+            elif token.keyword in CONTROL_OPERATIONS:
+                block_starts.add(instruction_index + 1)
+        return protected_indexes, block_starts
+
+    @staticmethod
+    def is_removable(assembly_lines: list[AssemblyLine], line_index, register_state: RegisterState) -> bool:
+        token = assembly_lines[line_index].assembly_token
+        argument = token.arguments[0] if token.arguments else None
+        if token.keyword == "NOP":
+            return True
+        if token.keyword == "MOVLW":
+            return argument == register_state.w_literal
+        if token.keyword in ("MOVWF", "MOVFW"):
+            return argument in register_state.w_variables
+        if token.keyword == "GOTO":
+            # a jump to one of the labels right after it
+            for next_line in assembly_lines[line_index + 1:]:
+                next_token = next_line.assembly_token
+                if next_token.keyword != ReservedIdentifier.GOTO_LABEL.value:
+                    break
+                if next_token.arguments[0] == argument:
+                    return True
+        return False
+
+    @staticmethod
+    def update_state(token: AssemblyToken, register_state: RegisterState):
+        keyword = token.keyword
+        argument = token.arguments[0] if token.arguments else None
+        if keyword == "MOVWF" or keyword in F_WRITE_OPERATIONS:
+            # a numeric address can be any of the variables
+            if argument.isidentifier():
+                register_state.w_variables = {variable for variable in register_state.w_variables
+                                              if variable.isidentifier()}
+            else:
+                register_state.w_variables = set()
+
+        if keyword == "MOVLW":
+            register_state.w_literal = argument
+            register_state.w_variables = set()
+        elif keyword == "MOVWF":
+            register_state.w_variables.add(argument)
+        elif keyword == "MOVFW":
+            register_state.w_literal = None
+            register_state.w_variables = {argument}
+        elif keyword == "MOVLF":
+            # the address is in W, any variable can change
+            register_state.w_variables = set()
+        elif keyword in F_WRITE_OPERATIONS:
+            register_state.w_variables.discard(argument)
+        elif keyword in STATE_KEEPING_OPERATIONS or SKIP_PATTERN.fullmatch(keyword):
+            pass
+        else:
+            register_state.w_literal = None
+            register_state.w_variables = set()
+
+    @staticmethod
+    def fold_literal(keyword, w_literal, argument) -> str | None:
+        value_a = PeepholeOptimizer.get_number(w_literal)
+        value_b = PeepholeOptimizer.get_number(argument)
+        if value_a is None or value_b is None:
+            return None
+        if keyword in ("DIVWL,w", "MODWL,w") and value_b == 0:
+            return None
+
+        literal = LITERAL_OPERATIONS[keyword](value_a, value_b)
+        # only literals the MOVLW can hold, the ALU result can be negative or wider
+        if not 0 <= literal <= LITERAL_MAX:
+            return None
+        return str(literal)
+
+    @staticmethod
+    def get_number(argument) -> int | None:
+        try:
+            if argument.startswith('0b'):
+                return int(argument[2:], 2)
+            elif argument.startswith('0x'):
+                return int(argument, 16)
+            else:
+                return int(argument)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def replace_token(assembly_line: AssemblyLine, keyword, argument) -> AssemblyLine:
+        # a new line, the tokens can be shared with the compile cache
+        token_type = TokenType.RESERVED_IDENTIFIER if keyword in RESERVED_IDENTIFIERS else TokenType.ASSEMBLY_INSTRUCTION
+        return AssemblyLine(
+            raw_line=assembly_line.raw_line,
+            line_number=assembly_line.line_number,
+            line=keyword + " " + argument,
+            assembly_token=AssemblyToken(token_type, keyword, [argument]),
+        )
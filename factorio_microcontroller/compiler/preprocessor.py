@@ -1,22 +1,61 @@
+import ast
+import operator
 import re
+from functools import cache
 
 from compiler.assembly_line import AssemblyLine, AssemblyToken
 from compiler.error_logger import ErrorLogger
 from compiler.token_type import TokenType
 
+IDENTIFIER_PATTERN = re.compile(r"\w+")
+LETTER_PATTERN = re.compile(r"[A-Za-z]")
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Invert: operator.invert,
+}
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
 
 class Preprocessor:
     @staticmethod
-    def preprocess(assembly_lines: list[AssemblyLine]):
-        defined_constants = dict()
-        for assembly_line in assembly_lines[:]:
+    def preprocess(assembly_lines: list[AssemblyLine], defined_constants: dict[str, str] = None) -> dict[str, str]:
+        # the constants can be carried over, so a file can be preprocessed in parts
+        defined_constants = dict() if defined_constants is None else defined_constants
+        # generated code repeats the same arguments, they only change when a constant is defined
+        replaced_arguments = dict()
+        preprocessed_lines = []
+        for assembly_line in assembly_lines:
             token = assembly_line.assembly_token
-            Preprocessor.replace_constants(defined_constants, token)
+            if defined_constants:
+                Preprocessor.replace_constants(defined_constants, token, replaced_arguments)
 
             if token.token_type == TokenType.PREPROCESSOR:
                 value = token.arguments[1]
 
-                if re.match(r"^EVPY", token.arguments[1]):
+                if token.arguments[1].startswith("EVPY"):
                     eval_argument = ''.join(token.arguments[1:])
                     try:
                         value = Preprocessor.eval_py_literal(eval_argument)
@@ -27,9 +66,10 @@ class Preprocessor:
                     raise Exception("Syntax error: " + assembly_line.line)
 
                 defined_constants[token.arguments[0]] = str(value)
-                assembly_lines.remove(assembly_line)
+                replaced_arguments.clear()
+                continue
 
-            elif token.arguments and re.match(r"^EVPY", token.arguments[0]):
+            elif token.arguments and token.arguments[0].startswith("EVPY"):
                 eval_argument = ''.join(token.arguments)
                 try:
                     value = Preprocessor.eval_py_literal(eval_argument)
@@ -38,20 +78,60 @@ class Preprocessor:
                 else:
                     token.arguments = [value]
 
+            preprocessed_lines.append(assembly_line)
+
+        # the preprocessor lines are removed in place
+        assembly_lines[:] = preprocessed_lines
+        return defined_constants
+
     @staticmethod
-    def replace_constants(defined_constants: dict[str, str], token: AssemblyToken):
-        for i, argument in enumerate(token.arguments):
-            for constant in defined_constants.keys():
-                if constant == argument:
-                    token.arguments[i] = defined_constants[constant]
-                elif re.search(r"(^|\W)" + constant + r"(\W|$)", argument):
-                    token.arguments[i] = argument.replace(constant, defined_constants[constant])
+    def replace_constants(defined_constants: dict[str, str], token: AssemblyToken,
+                          replaced_arguments: dict[str, str] = None):
+        replaced_arguments = dict() if replaced_arguments is None else replaced_arguments
+        arguments = token.arguments
+        for i, argument in enumerate(arguments):
+            replaced_argument = replaced_arguments.get(argument)
+            if replaced_argument is None:
+                replaced_argument = Preprocessor.replace_argument(defined_constants, argument)
+                replaced_arguments[argument] = replaced_argument
+            arguments[i] = replaced_argument
 
     @staticmethod
+    def replace_argument(defined_constants: dict[str, str], argument) -> str:
+        if argument in defined_constants:
+            return defined_constants[argument]
+        if argument.isidentifier() or argument.isdigit():
+            return argument
+
+        # every identifier is looked up once, so the cost does not grow with the defined constants
+        return IDENTIFIER_PATTERN.sub(lambda match: defined_constants.get(match.group(), match.group()), argument)
+
+    @staticmethod
+    @cache
     def eval_py_literal(eval_argument) -> str:
         eval_py = eval_argument.replace('EVPY', '')
-        if re.match(r".*[A-Za-z]", eval_py):
+        if LETTER_PATTERN.search(eval_py):
             raise ValueError
         else:
-            literal = int(eval(eval_py, {}))
+            literal = int(Preprocessor.fold_constant(ast.parse(eval_py, mode='eval').body))
             return str(literal)
+
+    @staticmethod
+    def fold_constant(node: ast.AST):
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return node.value
+        elif isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            return BINARY_OPERATORS[type(node.op)](Preprocessor.fold_constant(node.left),
+                                                   Preprocessor.fold_constant(node.right))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return UNARY_OPERATORS[type(node.op)](Preprocessor.fold_constant(node.operand))
+        elif isinstance(node, ast.Compare) and all(type(op) in COMPARE_OPERATORS for op in node.ops):
+            left = Preprocessor.fold_constant(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = Preprocessor.fold_constant(comparator)
+                if not COMPARE_OPERATORS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        else:
+            raise ValueError
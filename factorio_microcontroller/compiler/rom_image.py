@@ -0,0 +1,63 @@
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+ROM_EXTENSION = ".rom"
+ROM_MAGIC = b"FMCROM"
+ROM_VERSION = 1
+# magic, version and instruction count, followed by one little endian 32 bit word per instruction
+HEADER_STRUCT = struct.Struct("<6sHI")
+WORD_DTYPE = np.dtype("<u4")
+
+
+class RomImage:
+    @staticmethod
+    def write(file_name, instructions: list[int]):
+        words = array('I', instructions)
+        if sys.byteorder == 'big':
+            words.byteswap()
+
+        with open(file_name, 'wb') as f:
+            f.write(HEADER_STRUCT.pack(ROM_MAGIC, ROM_VERSION, len(words)))
+            f.write(words.tobytes())
+
+    @staticmethod
+    def is_rom_file(file_name) -> bool:
+        with open(file_name, 'rb') as f:
+            return f.read(len(ROM_MAGIC)) == ROM_MAGIC
+
+    @staticmethod
+    def read_header(file_name) -> int:
+        with open(file_name, 'rb') as f:
+            magic, version, instruction_count = HEADER_STRUCT.unpack(f.read(HEADER_STRUCT.size))
+        if magic != ROM_MAGIC or version != ROM_VERSION:
+            raise Exception("Unsupported rom image: " + str(file_name))
+        return instruction_count
+
+    @staticmethod
+    def read(file_name) -> list[int]:
+        instruction_count = RomImage.read_header(file_name)
+        words = array('I')
+        with open(file_name, 'rb') as f:
+            f.seek(HEADER_STRUCT.size)
+            words.frombytes(f.read(instruction_count * words.itemsize))
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words.tolist()
+
+    @staticmethod
+    def memmap(file_name) -> np.ndarray:
+        instruction_count = RomImage.read_header(file_name)
+        if instruction_count == 0:
+            return np.empty(0, dtype=WORD_DTYPE)
+        return np.memmap(file_name, dtype=WORD_DTYPE, mode='r', offset=HEADER_STRUCT.size, shape=(instruction_count,))
+
+    @staticmethod
+    def load_instructions(file_name) -> list[int]:
+        # the text format of '0' and '1' characters is still read, it is the debug output of the compiler
+        if RomImage.is_rom_file(file_name):
+            return RomImage.read(file_name)
+        with open(file_name) as f:
+            return [int(line, 2) for line in f.read().splitlines() if line]
@@ -0,0 +1,204 @@
+from compiler.assembly_line import AssemblyLine
+from compiler.control_flow_optimizer import ControlFlowOptimizer
+from compiler.peephole_optimizer import PeepholeOptimizer, SKIP_PATTERN
+from compiler.reserved_identifiers import MAIN_FUNCTION_NAME
+
+# the variable offset of a function before its first VAR is the one of the caller
+ENTRY_OFFSET = "entry"
+# after a CALL the variable offset is the one of the last VAR in the callee
+CALL_OFFSET = "call"
+UNKNOWN_OFFSET = "unknown"
+
+DEF_OPERATIONS = ["MOVWF", "RINF,1", "RINF,2"]
+RETURN_OPERATIONS = ["RET", "RETLW", "RETFW"]
+
+
+class VariableAllocator:
+    @staticmethod
+    def allocate(function_scopes: dict[str, list[AssemblyLine]], goto_map: dict[str, dict[str, int]],
+                 variable_map: dict[str, dict[str, int]]) -> bool:
+        # variables that are not live at the same time share an address, every VAR sets the frame size as offset
+        # the lines and variable map are changed in place, so the disassembler info has the shared addresses
+        function_offsets = dict()
+        for function_name, assembly_lines in function_scopes.items():
+            successors = VariableAllocator.get_successors(assembly_lines, goto_map[function_name])
+            variable_offsets = VariableAllocator.get_variable_offsets(function_name, assembly_lines, successors,
+                                                                      variable_map[function_name])
+            # the frame of a CALL with the offset of another function would move with the frame size of that function
+            for assembly_line, variable_offset in zip(assembly_lines, variable_offsets):
+                if assembly_line.assembly_token.keyword == "CALL" and variable_offset is not None and \
+                        not isinstance(variable_offset, int):
+                    return False
+            function_offsets[function_name] = (successors, variable_offsets)
+
+        for function_name, assembly_lines in function_scopes.items():
+            successors, variable_offsets = function_offsets[function_name]
+            variables = variable_map[function_name]
+            frame_variables = VariableAllocator.get_frame_variables(assembly_lines, variable_offsets, variables)
+            if frame_variables is None:
+                continue
+
+            addresses = VariableAllocator.get_addresses(assembly_lines, successors, frame_variables, variables)
+            frame_size = max(addresses.values(), default=0)
+            for line_index, assembly_line in enumerate(assembly_lines):
+                token = assembly_line.assembly_token
+                if token.keyword == "VAR":
+                    argument = str(frame_size)
+                elif token.arguments and ControlFlowOptimizer.is_f_operation(token.keyword):
+                    argument = VariableAllocator.get_frame_argument(token.arguments[0], variable_offsets[line_index],
+                                                                    variables, addresses, frame_size)
+                else:
+                    continue
+                assembly_lines[line_index] = PeepholeOptimizer.replace_token(assembly_line, token.keyword, argument)
+            variables.update(addresses)
+        return True
+
+    @staticmethod
+    def get_successors(assembly_lines: list[AssemblyLine], function_goto: dict[str, int]) -> list[list[int]]:
+        # the labels are already removed, the goto map has the index of the instruction after each label
+        successors = []
+        line_count = len(assembly_lines)
+        for line_index, assembly_line in enumerate(assembly_lines):
+            token = assembly_line.assembly_token
+            skip_match = SKIP_PATTERN.fullmatch(token.keyword)
+            if skip_match:
+                next_indexes = [line_index + 1, line_index + int(skip_match.group(2)) + 2]
+            elif token.keyword == "GOTO":
+                # a GOTO to a function is a tail call, it returns for this function
+                next_indexes = [function_goto[token.arguments[0]]] if token.arguments[0] in function_goto else []
+            elif token.keyword in RETURN_OPERATIONS:
+                next_indexes = []
+            else:
+                next_indexes = [line_index + 1]
+            successors.append([next_index for next_index in next_indexes if next_index < line_count])
+        return successors
+
+    @staticmethod
+    def get_variable_offsets(function_name, assembly_lines: list[AssemblyLine], successors: list[list[int]],
+                             variables: dict[str, int]) -> list:
+        # the variable offset before each instruction, an int when it is the same on every path
+        variable_offsets = [None] * len(assembly_lines)
+        if not assembly_lines:
+            return variable_offsets
+        variable_offsets[0] = 0 if function_name == MAIN_FUNCTION_NAME else ENTRY_OFFSET
+
+        line_stack = [0]
+        while line_stack:
+            line_index = line_stack.pop()
+            token = assembly_lines[line_index].assembly_token
+            variable_offset = variable_offsets[line_index]
+            if token.keyword == "VAR":
+                argument = token.arguments[0]
+                variable_offset = variables[argument] if argument in variables else PeepholeOptimizer.get_number(argument)
+            elif token.keyword == "CALL":
+                variable_offset = CALL_OFFSET
+
+            for next_index in successors[line_index]:
+                next_offset = variable_offsets[next_index]
+                if next_offset is None:
+                    variable_offsets[next_index] = variable_offset
+                elif next_offset != variable_offset and next_offset != UNKNOWN_OFFSET:
+                    variable_offsets[next_index] = UNKNOWN_OFFSET
+                else:
+                    continue
+                line_stack.append(next_index)
+        return variable_offsets
+
+    @staticmethod
+    def get_frame_variables(assembly_lines: list[AssemblyLine], variable_offsets: list,
+                            variables: dict[str, int]) -> list[list[str]] | None:
+        # the variable each instruction addresses, None when an address can not be followed
+        variable_names = {address: variable_name for variable_name, address in variables.items()}
+        frame_variables = []
+        for assembly_line, variable_offset in zip(assembly_lines, variable_offsets):
+            token = assembly_line.assembly_token
+            argument = token.arguments[0] if token.arguments else None
+            if token.keyword == "MOVLF" or (token.keyword == "VAR" and argument not in variables):
+                return None
+            if token.keyword == "VAR" or not ControlFlowOptimizer.is_f_operation(token.keyword):
+                # a variable as a literal is its address
+                if argument in variables and token.keyword != "VAR":
+                    return None
+                frame_variables.append([])
+            elif argument in variables:
+                frame_variables.append([argument])
+            elif variable_offset is None:
+                # never runs
+                frame_variables.append([])
+            else:
+                address = PeepholeOptimizer.get_number(argument)
+                if address is None or not isinstance(variable_offset, int):
+                    return None
+                if address > variable_offset:
+                    # the frame of the next CALL
+                    frame_variables.append([])
+                elif address in variable_names:
+                    frame_variables.append([variable_names[address]])
+                else:
+                    return None
+        return frame_variables
+
+    @staticmethod
+    def get_addresses(assembly_lines: list[AssemblyLine], successors: list[list[int]],
+                      frame_variables: list[list[str]], variables: dict[str, int]) -> dict[str, int]:
+        live_in = [set() for _ in assembly_lines]
+        changed = True
+        while changed:
+            changed = False
+            for line_index in reversed(range(len(assembly_lines))):
+                live_variables = set()
+                for next_index in successors[line_index]:
+                    live_variables |= live_in[next_index]
+                keyword = assembly_lines[line_index].assembly_token.keyword
+                if keyword in DEF_OPERATIONS:
+                    live_variables -= set(frame_variables[line_index])
+                else:
+                    live_variables |= set(frame_variables[line_index])
+                if live_variables != live_in[line_index]:
+                    live_in[line_index] = live_variables
+                    changed = True
+
+        # a variable interferes with the variables that are live where it is written
+        interference = {variable_name: set() for variable_name in variables}
+        for line_index, assembly_line in enumerate(assembly_lines):
+            if not VariableAllocator.is_write(assembly_line.assembly_token.keyword):
+                continue
+            live_out = set()
+            for next_index in successors[line_index]:
+                live_out |= live_in[next_index]
+            for variable_name in frame_variables[line_index]:
+                for live_variable in live_out - {variable_name}:
+                    interference[variable_name].add(live_variable)
+                    interference[live_variable].add(variable_name)
+
+        # the variables that are read before they are written are arguments, they keep their address
+        entry_variables = live_in[0] if assembly_lines else set()
+        addresses = {variable_name: variables[variable_name] for variable_name in entry_variables}
+        for variable_name in variables:
+            if variable_name in addresses:
+                continue
+            used_addresses = {addresses[other_variable] for other_variable in interference[variable_name]
+                              if other_variable in addresses}
+            address = 1
+            while address in used_addresses:
+                address += 1
+            addresses[variable_name] = address
+        return addresses
+
+    @staticmethod
+    def is_write(keyword) -> bool:
+        return keyword in DEF_OPERATIONS or keyword.endswith(",f") or keyword in ("INCRF", "DECRF")
+
+    @staticmethod
+    def get_frame_argument(argument, variable_offset, variables: dict[str, int], addresses: dict[str, int],
+                           frame_size) -> str:
+        if argument in addresses:
+            return str(addresses[argument])
+        address = PeepholeOptimizer.get_number(argument)
+        if address is None or not isinstance(variable_offset, int):
+            return argument
+        if address > variable_offset:
+            # before the first VAR of main the frame of a CALL starts at 0
+            return str(address - variable_offset + (frame_size if variable_offset else 0))
+        variable_names = {variable_address: variable_name for variable_name, variable_address in variables.items()}
+        return str(addresses[variable_names[address]])
@@ -2,21 +2,44 @@ import click
 import pyperclip
 
 from compiler.assembly_compiler import AssemblyCompiler
-from scripts.program_to_rom_blueprint import Program2ROM
+from compiler.compile_cache import CompileCache
+from compiler.function_inliner import DEFAULT_INLINE_SIZE
+from program_builder import ProgramBuilder
+from scripts.program_to_rom_blueprint import Program2ROM, ROM_MANIFEST_EXTENSION, DEFAULT_SIGNAL_MAP_FILE
 
 
 @click.command()
 @click.option('--assembly', '-a', help='Name of the assembly file')
+@click.option('--build', '-B', 'build_path',
+              help='Build the rom image and blueprint of every program in this folder or json manifest')
+@click.option('--workers', '-w', type=int, default=None, help='Number of build worker processes')
 @click.option('--clipboard', '-c', help='Copy blueprint to the clipboard', is_flag=True)
-def main(assembly, clipboard):
-    compiler = AssemblyCompiler()
-    binary_file = assembly[:-4] + '.bin'
-    compiler.compile(assembly)
+@click.option('--delta', '-d', is_flag=True,
+              help='Only the ROM blocks that changed since the last blueprint of the program')
+@click.option('--cache', 'use_cache', is_flag=True,
+              help='Only compile the functions that changed since the last cached compile')
+@click.option('--optimize', '-O', is_flag=True, help='Remove redundant instructions and jumps with the optimizer passes')
+@click.option('--inline-size', type=int, show_default=True, default=DEFAULT_INLINE_SIZE,
+              help='Inline the leaf functions up to this many instructions when optimizing')
+@click.option('--signal-map', '-s', 'signal_map_file', default=str(DEFAULT_SIGNAL_MAP_FILE),
+              help='Signal map of the ROM blocks, the ROM map has to be built with the same one')
+def main(assembly, build_path, workers, clipboard, delta, use_cache, optimize, inline_size, signal_map_file):
+    if build_path:
+        results = ProgramBuilder(optimize, inline_size, use_cache, workers, signal_map_file).build(build_path)
+        ProgramBuilder.print_results(results)
+        if any(result.error is not None for result in results):
+            raise SystemExit(1)
+        return
 
-    binary2rom = Program2ROM()
+    compiler = AssemblyCompiler(CompileCache() if use_cache else None, optimize, inline_size)
+    binary_file, _ = compiler.compile(assembly)
+
+    binary2rom = Program2ROM(signal_map_file=signal_map_file)
     program = binary2rom.convert_file_to_base10_list(binary_file)
-    program_rom_blueprint = binary2rom.get_rom_blueprint(program)
-    if clipboard:
+    program_rom_blueprint = binary2rom.get_manifest_blueprint(program, binary_file[:-4] + ROM_MANIFEST_EXTENSION, delta)
+    if program_rom_blueprint is None:
+        print('ROM unchanged since the last blueprint')
+    elif clipboard:
         pyperclip.copy(program_rom_blueprint)
         print('Program blueprint copied to clipboard')
     else:
@@ -0,0 +1,127 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from compiler.assembly_compiler import AssemblyCompiler, RESOURCE_FOLDER
+from compiler.compile_cache import CompileCache
+from compiler.function_inliner import DEFAULT_INLINE_SIZE
+from compiler.rom_image import ROM_EXTENSION
+from scripts.program_to_rom_blueprint import Program2ROM, DEFAULT_SIGNAL_MAP_FILE
+
+ASSEMBLY_EXTENSION = ".txt"
+BLUEPRINT_EXTENSION = ".blueprint"
+# the key of the last build of each program, in the folder of the programs or the manifest
+BUILD_STATE_FILE = ".build_state.json"
+# a change in any of these or the signal map rebuilds every program
+RESOURCE_FILES = ["opcodes.json", "blueprint_strings.json"]
+
+
+@dataclass()
+class BuildResult:
+    assembly_file: str
+    blueprint_file: str
+    skipped: bool
+    error: str | None = None
+
+
+class ProgramBuilder:
+    # created once per worker process by the pool initializer, so every worker reads the resources once
+    assembly_compiler: AssemblyCompiler = None
+    program_to_rom: Program2ROM = None
+
+    def __init__(self, optimize=False, inline_size=DEFAULT_INLINE_SIZE, use_cache=False, max_workers=None,
+                 signal_map_file=DEFAULT_SIGNAL_MAP_FILE):
+        self.optimize = optimize
+        self.inline_size = inline_size
+        self.use_cache = use_cache
+        self.max_workers = max_workers
+        self.signal_map_file = signal_map_file
+
+    @staticmethod
+    def get_assembly_files(build_path) -> (Path, list[Path]):
+        # a folder builds all the programs in it, a json manifest lists the programs relative to the manifest
+        build_path = Path(build_path)
+        if build_path.is_dir():
+            return build_path, sorted(build_path.glob("*" + ASSEMBLY_EXTENSION))
+
+        with open(build_path) as f:
+            manifest = json.load(f)
+        return build_path.parent, [build_path.parent / program for program in manifest]
+
+    def get_resource_key(self) -> str:
+        resource_hashes = []
+        for resource_file in [RESOURCE_FOLDER / resource_file for resource_file in RESOURCE_FILES] + [self.signal_map_file]:
+            with open(resource_file, 'rb') as f:
+                resource_hashes.append(CompileCache.get_key(f.read()))
+        return CompileCache.get_key(resource_hashes, self.optimize, self.inline_size)
+
+    def build(self, build_path) -> list[BuildResult]:
+        build_folder, assembly_files = ProgramBuilder.get_assembly_files(build_path)
+        state_file = build_folder / BUILD_STATE_FILE
+        build_state = dict()
+        if state_file.exists():
+            with open(state_file) as f:
+                build_state = json.load(f)
+
+        resource_key = self.get_resource_key()
+        build_keys = dict()
+        results = []
+        for assembly_file in assembly_files:
+            with open(assembly_file, 'rb') as f:
+                build_keys[str(assembly_file)] = CompileCache.get_key(resource_key, f.read())
+            blueprint_file = str(assembly_file)[:-4] + BLUEPRINT_EXTENSION
+            # the outputs are only skipped when they are still there
+            skipped = (build_state.get(os.path.relpath(assembly_file, build_folder)) == build_keys[str(assembly_file)]
+                       and os.path.exists(blueprint_file) and os.path.exists(str(assembly_file)[:-4] + ROM_EXTENSION))
+            results.append(BuildResult(str(assembly_file), blueprint_file, skipped))
+
+        built_results = [result for result in results if not result.skipped]
+        if built_results:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=ProgramBuilder.init_worker,
+                                     initargs=(self.optimize, self.inline_size, self.use_cache,
+                                               self.signal_map_file)) as executor:
+                futures = [executor.submit(ProgramBuilder.build_program, result.assembly_file, result.blueprint_file)
+                           for result in built_results]
+                for result, future in zip(built_results, futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        result.error = str(e)
+
+        for result in results:
+            # a failed program may have left new outputs next to old ones, so it is always built again
+            if result.error is None:
+                build_state[os.path.relpath(result.assembly_file, build_folder)] = build_keys[result.assembly_file]
+            else:
+                build_state.pop(os.path.relpath(result.assembly_file, build_folder), None)
+        with open(state_file, 'w') as f:
+            json.dump(build_state, f, indent=4)
+        return results
+
+    @staticmethod
+    def init_worker(optimize, inline_size, use_cache, signal_map_file):
+        ProgramBuilder.assembly_compiler = AssemblyCompiler(CompileCache() if use_cache else None, optimize,
+                                                            inline_size)
+        ProgramBuilder.program_to_rom = Program2ROM(signal_map_file=signal_map_file)
+
+    @staticmethod
+    def build_program(assembly_file, blueprint_file):
+        rom_file, _ = ProgramBuilder.assembly_compiler.compile(assembly_file)
+        program = ProgramBuilder.program_to_rom.convert_file_to_base10_list(rom_file)
+        with open(blueprint_file, 'w') as f:
+            f.write(ProgramBuilder.program_to_rom.get_rom_blueprint(program))
+
+    @staticmethod
+    def print_results(results: list[BuildResult]):
+        for result in results:
+            if result.error is not None:
+                print("Failed " + result.assembly_file + ": " + result.error)
+            elif result.skipped:
+                print("Unchanged " + result.assembly_file)
+            else:
+                print("Built " + result.blueprint_file)
+        print(str(sum(not result.skipped and result.error is None for result in results)) + " built, " +
+              str(sum(result.skipped for result in results)) + " unchanged, " +
+              str(sum(result.error is not None for result in results)) + " failed.")
@@ -0,0 +1,71 @@
+import json
+import zlib
+from base64 import b64decode, b64encode
+
+BLUEPRINT_VERSION = '0'
+DEFAULT_COMPRESSION_LEVEL = 9
+# the json is compressed and the string decoded in parts of about this size, a multiple of 4 for base64
+CHUNK_SIZE = 1 << 16
+# the items of a list are encoded this many at a time, a few entities are about a chunk of json
+LIST_PART_SIZE = 32
+
+JSON_ENCODER = json.JSONEncoder(check_circular=False, separators=(',', ':'))
+
+
+class BlueprintCodec:
+    @staticmethod
+    def encode(blueprint_dict, compression_level=DEFAULT_COMPRESSION_LEVEL) -> str:
+        # the json is compressed while it is written, so the full json and compressed data are never in memory
+        compressor = zlib.compressobj(compression_level)
+        encoded_parts = [BLUEPRINT_VERSION]
+        compressed_data = b''
+        json_parts = []
+        json_size = 0
+        for json_part in BlueprintCodec.get_json_parts(blueprint_dict):
+            json_parts.append(json_part)
+            json_size += len(json_part)
+            if json_size >= CHUNK_SIZE:
+                compressed_data += compressor.compress(''.join(json_parts).encode('utf-8'))
+                compressed_data = BlueprintCodec.encode_base64(compressed_data, encoded_parts)
+                json_parts = []
+                json_size = 0
+
+        compressed_data += compressor.compress(''.join(json_parts).encode('utf-8')) + compressor.flush()
+        encoded_parts.append(b64encode(compressed_data).decode('ascii'))
+        return ''.join(encoded_parts)
+
+    @staticmethod
+    def get_json_parts(value):
+        # the objects are written key by key and the lists in parts, every part in one call of the fast encoder
+        if isinstance(value, dict):
+            separator = '{'
+            for key, item in value.items():
+                yield separator + JSON_ENCODER.encode(str(key)) + ':'
+                yield from BlueprintCodec.get_json_parts(item)
+                separator = ','
+            yield '{}' if separator == '{' else '}'
+        elif isinstance(value, list):
+            separator = '['
+            for start in range(0, len(value), LIST_PART_SIZE):
+                yield separator + JSON_ENCODER.encode(value[start:start + LIST_PART_SIZE])[1:-1]
+                separator = ','
+            yield '[]' if separator == '[' else ']'
+        else:
+            yield JSON_ENCODER.encode(value)
+
+    @staticmethod
+    def encode_base64(data: bytes, encoded_parts: list[str]) -> bytes:
+        # base64 encodes groups of 3 bytes, the rest is encoded with the next data
+        aligned_size = len(data) - len(data) % 3
+        encoded_parts.append(b64encode(data[:aligned_size]).decode('ascii'))
+        return data[aligned_size:]
+
+    @staticmethod
+    def decode(blueprint_string) -> dict:
+        blueprint_string = blueprint_string.strip()
+        decompressor = zlib.decompressobj()
+        json_parts = []
+        for start in range(len(BLUEPRINT_VERSION), len(blueprint_string), CHUNK_SIZE):
+            json_parts.append(decompressor.decompress(b64decode(blueprint_string[start:start + CHUNK_SIZE])))
+        json_parts.append(decompressor.flush())
+        return json.loads(b''.join(json_parts))
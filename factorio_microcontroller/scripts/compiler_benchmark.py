@@ -0,0 +1,78 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+# run as a script only the scripts folder is on the path, the packages are in the folder above it
+sys.path.append(str(Path(__file__).parent.parent))
+from compiler.assembly_compiler import AssemblyCompiler  # noqa: E402
+from compiler.compile_cache import CompileCache  # noqa: E402
+
+SCREEN_WIDTH = 36
+SCREEN_HEIGHT = 32
+
+
+class CompilerBenchmark:
+    @staticmethod
+    def get_playback_program(line_count, frame_lines) -> list[str]:
+        # the shape of generated image and animation playback code, a function of draw calls per frame
+        draw_line_count = sum(3 if i % 3 == 2 else 1 for i in range(frame_lines))
+        frame_count = max(1, line_count // (draw_line_count + 6))
+        lines = ["#define WIDTH " + str(SCREEN_WIDTH), "#define HEIGHT " + str(SCREEN_HEIGHT),
+                 "VAR frame", "LABEL LOOP"]
+        lines += ["CALL frame_" + str(frame) for frame in range(frame_count)]
+        lines += ["INCRF frame", "GOTO LOOP"]
+
+        for frame in range(frame_count):
+            lines += ["FN frame_" + str(frame), "VAR pixel", "IGCLEAR"]
+            for i in range(frame_lines):
+                x = (frame + i) % SCREEN_WIDTH
+                y = (frame * 7 + i) % SCREEN_HEIGHT
+                if i % 3 == 0:
+                    lines.append("IGDRAWPL EVPY((" + str(x) + " << 6) | " + str(y) + ")")
+                elif i % 3 == 1:
+                    lines.append("IGDRAWRL EVPY((" + str(x) + " << 18) | (" + str(y) +
+                                 " << 12) | ((WIDTH - 1) << 6) | (HEIGHT - 1))")
+                else:
+                    lines.append("MOVLW " + str((x << 6) | y))
+                    lines.append("MOVWF pixel")
+                    lines.append("IGDRAWPF pixel")
+            lines += ["IGRENDER", "RET", "END"]
+        return lines
+
+    @staticmethod
+    def run(line_count, frame_lines, repeat, use_cache) -> list[float]:
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "benchmark.txt"
+            lines = CompilerBenchmark.get_playback_program(line_count, frame_lines)
+            with open(assembly_file, 'w') as f:
+                f.write('\n'.join(lines))
+            print("Compiling " + str(len(lines)) + " lines.")
+
+            compile_cache = CompileCache(Path(temp_folder) / "cache") if use_cache else None
+            compile_times = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                AssemblyCompiler(compile_cache).compile(str(assembly_file))
+                compile_times.append(time.perf_counter() - start_time)
+            return compile_times
+
+
+@click.command()
+@click.option('--lines', '-l', 'line_count', type=int, show_default=True, default=200_000,
+              help="Lines of the generated program")
+@click.option('--frame-lines', type=int, show_default=True, default=500, help="Draw instructions per frame function")
+@click.option('--repeat', '-r', type=int, show_default=True, default=3, help="Number of compiles")
+@click.option('--cache', 'use_cache', is_flag=True, show_default=True, default=False,
+              help="Compile with a new compile cache, every compile after the first is cached")
+def main(line_count, frame_lines, repeat, use_cache):
+    compile_times = CompilerBenchmark.run(line_count, frame_lines, repeat, use_cache)
+    for compile_time in compile_times:
+        print("Compiled in " + str(round(compile_time, 3)) + " seconds.")
+    print("Best: " + str(round(min(compile_times), 3)) + " seconds.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,36 @@
 import json
+import sys
+from pathlib import Path
+
 from slpp import slpp as lua
 
+# run as a script only the scripts folder is on the path, the packages are in the folder above it
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.blueprint_codec import BlueprintCodec  # noqa: E402
+
+# each, anything and everything can not be set in a constant combinator
+SPECIAL_SIGNALS = ['signal-each', 'signal-anything', 'signal-everything', 'signal-unknown']
+
+
+def get_blueprint_signals(value, signals: set):
+    # every signal the combinators of the cpu compare, calculate with or hold
+    if isinstance(value, dict):
+        if set(value.keys()) == {'type', 'name'}:
+            signals.add(value['name'])
+        for item in value.values():
+            get_blueprint_signals(item, signals)
+    elif isinstance(value, list):
+        for item in value:
+            get_blueprint_signals(item, signals)
+    return signals
+
+
 with open('../resources/raw.txt', 'r') as file:
     raw_data = file.read()
 
 data = lua.decode(raw_data)
 
 signals = []
-#TODO can also add fluids here maybe?
 for item in data['item']:
     if 'flags' in data['item'][item] and data['item'][item]['flags'][0] == 'hidden':
         continue
@@ -21,3 +44,19 @@ for item in data['item']:
 file_name = "../resources/signal_map.json"
 with open(file_name, "w", newline="\n") as f:
     json.dump(signals, f, indent=4)
+
+# the signals used by the cpu blueprint are reserved, the docs only list the main ones
+with open('../blueprint.txt', 'r') as file:
+    reserved_signals = get_blueprint_signals(BlueprintCodec.decode(file.read())['blueprint']['entities'], set())
+
+# the extended map starts with the item map, so the rom addresses of the item signals stay the same
+extended_signals = list(signals)
+for signal_type, prototype_type in [('fluid', 'fluid'), ('virtual', 'virtual-signal')]:
+    for name in sorted(data[prototype_type]):
+        if data[prototype_type][name].get('hidden') or name in reserved_signals or name in SPECIAL_SIGNALS:
+            continue
+        extended_signals.append({'name': name, 'type': signal_type})
+
+file_name = "../resources/signal_map_extended.json"
+with open(file_name, "w", newline="\n") as f:
+    json.dump(extended_signals, f, indent=4)
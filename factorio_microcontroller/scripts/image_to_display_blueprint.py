@@ -1,20 +1,28 @@
 import math
-import zlib
 import json
 import copy
-from base64 import b64decode, b64encode
+import sys
+from pathlib import Path
+
 import click
 import pyperclip
 from PIL import Image
 import numpy as np
 from PIL import Image, ImageSequence
 
+# run as a script only the scripts folder is on the path, the packages are in the folder above it
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.blueprint_codec import BlueprintCodec, DEFAULT_COMPRESSION_LEVEL  # noqa: E402
+
 
 max_signal_per_comb = 20
+default_signal_map_file = "../resources/signal_map.json"
 
 
 class Img2Bp:
-    def __init__(self):
+    def __init__(self, compression_level=DEFAULT_COMPRESSION_LEVEL, signal_map_file=default_signal_map_file):
+        self.compression_level = compression_level
+        self.signal_map_file = signal_map_file
         blueprint_string = self.load_blueprint_strings()
         self.display_tileable = blueprint_string['display_tileable']
         self.lamp_bp = blueprint_string['lamp']
@@ -27,29 +35,21 @@ class Img2Bp:
             blueprint_json = json.load(f)
         return blueprint_json
 
-    def decode_blueprint(self, blueprint_string):
-        raw_json = zlib.decompress(b64decode(blueprint_string.encode('ascii')[1:]))
-        return json.loads(raw_json)
-
-    def encode_dict(self, blueprint_dict):
-        data = json.dumps(blueprint_dict).encode('utf-8')
-        return '0' + b64encode(zlib.compress(data)).decode('ascii')
-
     def create_custom_bp(self):
         bp = '0eNq9mm2O2yAQQO/Cb7MKY5w4kXqSahVhPElQbexivGq0ygF6i56tJylO2tUuKqpQNf4Tidh8PY2HB/Yra7oZR2esZ4dXZvRgJ3b4/Momc7aqW/7z1xHZgRmPPSuYVf1SmnrVdbxT/chuBTO2xW/sIG7PBUPrjTf4aOVeuB7t3Dfowg1/q1+wcZhClcEuvYVmeF0/VQW7sgPsn6rQfBiUd0N3bPCiXszglvu0cXo2/hiutW+VT8ZN/viPoav2RVmNLf/dBHv0MHm1MBBLoR+VU37piH1aLs8Tho66wYVZeTfjo4ZFvXQ8LT2J5cdh+37WJpTgVnwoy9vz7fbuvz9kIJdMTUFG67mfu/vMKaGIBIQyE0IpKCA4b7oO3ZX72TmkDQ8Zhcc2QUbmktmQkDH+0qM3mgcGjbErBMpHPGUCT5WLp6TAM03YN52xZ94rfTEWOZDS2UZ06gSdbS4dWIeOIKVTRnSqBJ1dLp2KgE6jvA8phxRIHQERmwSROpeIXCdeSlI8VYRnl6Czz6Wzo4sX3n8Bjl9nM/ZhlLSpeBOHDyQAiU0uoS0hoXXo7CI4+xSbXAMuKQy4wc5z0/ezDWNbK35iExYpFRa5LlzWJIxUqESKZB8TSXmxyBVjSSHGzWCCFtMGSezDIiXEIteIJYURN+bMsQsTc8GJx6FDWjqxDouUD4tcIZYUQtzMzqLjvbHLKt66sK2i5RMLsUgZschVYgl0fIyd0HnqJyvWYZHyYZErxJJCiPUFe6NVx8dOUa9MsRhDSoxFrhlLCjPWYVTOnOYzcbaJhVikjFjkKrGkUOJQQzv0tFAgtmBIWTDkWrDckkBRxDk3Nl+RUl/IVV+5p4mSKczwPjHuhmYgPv6NrReSB8C51itrKjwBxGoHfLEDQ8qBIdeBK0HCZxzDkj044jQTezCkPBhyPbja0GHRqiFWYIgVGFIKDLkKXFEosHZzizxsnHijnEPaXAyx/0LKfyHXfyugi5pgeNSrdiy/kJJfyJXfikJ+WzPpi3Jn5C2eMGwPVjqjgdiEy5QJQ64JVxQm3KI27ZJ31lmsIDZiSBkx5BpxRWHEbycTp7DRVJr2GStjMy5TZlzmmnG1pYSD9ry8XFjOQmmjJzZlSJlymWvK1Z4M0GCXt71/+1BiE+H5+f3Hf0ZQMmBy1biqKQNmtfMsiOW4fMjxc/EY2uHdtzsFe0E33ecDtZC7PexkuZX7kNJvvwCF7U9e'
-        lamps = self.decode_blueprint(bp)
+        lamps = BlueprintCodec.decode(bp)
         signal_map = self.load_signal_map()
 
         for count, entity in enumerate(lamps['blueprint']['entities']):
             entity['control_behavior']['circuit_condition']['constant'] = 0
             entity['control_behavior']['circuit_condition']['comparator'] = '≠'
 
-        print(self.encode_dict(lamps))
+        print(BlueprintCodec.encode(lamps, self.compression_level))
 
     def create_display_bp(self, width, height):
         #TODO this uses a blueprint of a array of light already wired, so this doesnt work
-        display_json = self.decode_blueprint('')
-        lamp_json = self.decode_blueprint(self.lamp_bp)
+        display_json = BlueprintCodec.decode('')
+        lamp_json = BlueprintCodec.decode(self.lamp_bp)
         signal_map = self.load_signal_map()
         lamp_control_behavior_template = lamp_json['blueprint']['entities'][1]['control_behavior']
 
@@ -63,11 +63,10 @@ class Img2Bp:
             entity['control_behavior'] = copy.deepcopy(lamp_control_behavior_template)
             entity['control_behavior']['circuit_condition']['first_signal'] = signal_map[linear_index]
 
-        return self.encode_dict(display_json)
+        return BlueprintCodec.encode(display_json, self.compression_level)
 
     def load_signal_map(self): #TODO make this a class var?
-        json_file = "../resources/signal_map.json"
-        with open(json_file) as f:
+        with open(self.signal_map_file) as f:
             signal_map = json.load(f)
         return signal_map
 
@@ -85,7 +84,7 @@ class Img2Bp:
     # this just make the rom, not the display
     def convert_image_to_rom_bp(self, image_name, width, height):
         np_img_flat = self.load_binary_image(image_name, width, height).flatten()
-        rom_blueprint_template = self.decode_blueprint(self.constant_comb_blueprint)
+        rom_blueprint_template = BlueprintCodec.decode(self.constant_comb_blueprint)
         constant_comb_entity_template = copy.deepcopy(rom_blueprint_template['blueprint']['entities'][0])
         signal_template = copy.deepcopy(constant_comb_entity_template['control_behavior']['filters'][0])
         rom_blueprint_template['blueprint']['entities'].clear()
@@ -125,20 +124,20 @@ class Img2Bp:
             else:
                 combinator['connections'] = {'1': {'red': [{'entity_id': idx}, {'entity_id': idx + 2}]}}
 
-        return self.encode_dict(rom_blueprint)
+        return BlueprintCodec.encode(rom_blueprint, self.compression_level)
 
     def convert_image_using_tilable(self, image_name, size_x, size_y):
         np_img = self.load_binary_image(image_name, 18 * size_x, 18 * size_y)
         Image.fromarray(np_img).show()
 
-        rom_blueprint_template = self.decode_blueprint(self.constant_comb_blueprint)
+        rom_blueprint_template = BlueprintCodec.decode(self.constant_comb_blueprint)
         constant_comb_entity_template = copy.deepcopy(rom_blueprint_template['blueprint']['entities'][0])
         signal_template = copy.deepcopy(constant_comb_entity_template['control_behavior']['filters'][0])
         rom_blueprint_template['blueprint']['entities'].clear()
 
         signal_map = self.load_signal_map()
 
-        display_template = self.decode_blueprint(self.display_tileable)
+        display_template = BlueprintCodec.decode(self.display_tileable)
 
         display_entities_size = len(display_template['blueprint']['entities']) + 1
         # allocate entity numbers for the constant combinators
@@ -236,7 +235,7 @@ class Img2Bp:
                 # append the display tile entities to the final blueprint
                 display_bp_final['blueprint']['entities'] += display_tile
 
-        return self.encode_dict(display_bp_final)
+        return BlueprintCodec.encode(display_bp_final, self.compression_level)
 
     def create_LCD_rom_bp(self, gif_name):
         lcd_width = 36
@@ -251,11 +250,11 @@ class Img2Bp:
 
         signal_map = self.load_signal_map()
         #TODO make this simpler/refactor repeated code
-        rom_blueprint_template = self.decode_blueprint(self.constant_comb_blueprint)
+        rom_blueprint_template = BlueprintCodec.decode(self.constant_comb_blueprint)
         constant_comb_entity_template = copy.deepcopy(rom_blueprint_template['blueprint']['entities'][0])
         signal_template = copy.deepcopy(constant_comb_entity_template['control_behavior']['filters'][0])
 
-        lcd_rom_template = self.decode_blueprint(self.lcd_rom)
+        lcd_rom_template = BlueprintCodec.decode(self.lcd_rom)
         final_rom = copy.deepcopy(lcd_rom_template)
         final_rom['blueprint']['entities'].clear()
 
@@ -314,7 +313,7 @@ class Img2Bp:
             # skip over next comb
             constant_comb_entity_id += 1
 
-        return self.encode_dict(final_rom)
+        return BlueprintCodec.encode(final_rom, self.compression_level)
 
 
 @click.command()
@@ -323,8 +322,12 @@ class Img2Bp:
 @click.option('--width', '-w', help='Width of the image blueprint', default=10)
 @click.option('--height', '-h', help='Height of the image blueprint',  default=10)
 @click.option('--clipboard', '-c', help='Copy blueprint to the clipboard', is_flag=True)
-def main(img, gif, width, height, clipboard):
-    img_2_bp = Img2Bp()
+@click.option('--compression-level', '-z', type=click.IntRange(0, 9), show_default=True,
+              default=DEFAULT_COMPRESSION_LEVEL, help='Zlib level of the blueprint string')
+@click.option('--signal-map', '-s', 'signal_map_file', default=default_signal_map_file,
+              help='Signal map of the pixels, the extended map has more signals per ROM block')
+def main(img, gif, width, height, clipboard, compression_level, signal_map_file):
+    img_2_bp = Img2Bp(compression_level, signal_map_file)
     #img_2_bp.create_custom_bp()
 
     blueprint = ''
@@ -1,39 +1,93 @@
-import zlib
 import json
 import copy
-from base64 import b64decode, b64encode
+import math
+import sys
 from pathlib import Path
 
 import click
 import pyperclip
 
+# run as a script only the scripts folder is on the path, the packages are in the folder above it
+sys.path.append(str(Path(__file__).parent.parent))
+from compiler.compile_cache import CompileCache  # noqa: E402
+from compiler.rom_image import RomImage  # noqa: E402
+from scripts.blueprint_codec import BlueprintCodec, DEFAULT_COMPRESSION_LEVEL  # noqa: E402
+
 RESOURCE_FOLDER = Path(__file__).parent.parent.parent / "resources"
 
 MAX_CONSTANT_COMB_SIGNALS = 20
 BITS = 32
+# the rom blocks of the last blueprint of a program, next to the program
+ROM_MANIFEST_EXTENSION = ".manifest.json"
+DEFAULT_SIGNAL_MAP_FILE = RESOURCE_FOLDER / "signal_map.json"
+# the items, fluids and virtual signals that are not used by the cpu
+EXTENDED_SIGNAL_MAP_FILE = RESOURCE_FOLDER / "signal_map_extended.json"
+CPU_BLUEPRINT_FILE = RESOURCE_FOLDER.parent / "blueprint.txt"
+# the rom block size the address decoder of the cpu blueprint is built for, the size of the default signal map
+CPU_BLOCK_SIZE = 137
+# the substation below the rom map of the cpu leaves room for two more constant combinators
+MAX_CPU_ROM_MAP_COMBINATORS = 9
 
 
 class Program2ROM:
-    def __init__(self):
+    def __init__(self, compression_level=DEFAULT_COMPRESSION_LEVEL, signal_map_file=DEFAULT_SIGNAL_MAP_FILE):
+        self.compression_level = compression_level
         self.blueprint_strings = self.load_json(RESOURCE_FOLDER / "blueprint_strings.json")
-        self.signal_map = self.load_json(RESOURCE_FOLDER / "signal_map.json")
+        self.signal_map = self.load_json(signal_map_file)
         self.signal_map_max = len(self.signal_map)
 
         constant_comb_blueprint = self.blueprint_strings['constant_combinator']
 
-        self.rom_blueprint_template = self.decode_blueprint(constant_comb_blueprint)
+        self.rom_blueprint_template = BlueprintCodec.decode(constant_comb_blueprint)
         self.constant_comb_entity_template = copy.deepcopy(self.rom_blueprint_template['blueprint']['entities'][0])
         self.signal_template = copy.deepcopy(self.constant_comb_entity_template['control_behavior']['filters'][0])
 
         self.rom_blueprint_template['blueprint']['entities'].clear()
         self.constant_comb_entity_template['control_behavior']['filters'].clear()
 
+        # the rom template is only decoded once, every rom block is built from its entities
+        self.rom_template = BlueprintCodec.decode(self.blueprint_strings["rom_template"])
+        self.rom_entity_templates = self.get_rom_entity_templates(
+            math.ceil(self.signal_map_max / MAX_CONSTANT_COMB_SIGNALS))
+        # the signal, filter index and constant combinator of every rom address in a block
+        self.signal_table = [
+            ({'type': signal['type'], 'name': signal['name']}, (i % MAX_CONSTANT_COMB_SIGNALS) + 1,
+             i // MAX_CONSTANT_COMB_SIGNALS)
+            for i, signal in enumerate(self.signal_map)]
+
+    def get_rom_entity_templates(self, constant_comb_count):
+        rom_entities = self.rom_template["blueprint"]["entities"]
+        for entity in rom_entities[:-1]:
+            entity['control_behavior']['filters'].clear()
+
+        # a wider signal map needs more constant combinators, they are added to the end of the chain
+        extra_count = constant_comb_count - (len(rom_entities) - 1)
+        if extra_count <= 0:
+            return rom_entities
+        return (rom_entities[:-1] + [Program2ROM.get_moved_entity(rom_entities[-2], i) for i in range(1, extra_count + 1)]
+                + [Program2ROM.get_moved_entity(rom_entities[-1], extra_count)])
+
+    @staticmethod
+    def get_moved_entity(entity, offset):
+        moved_entity = copy.deepcopy(entity)
+        moved_entity['entity_number'] += offset
+        moved_entity['position']['y'] += offset
+        for connection in moved_entity['connections'].values():
+            for wire in connection.values():
+                for wire_connection in wire:
+                    wire_connection['entity_id'] += offset
+        return moved_entity
+
     def load_json(self, json_file):
         with open(json_file) as f:
             json_dict = json.load(f)
         return json_dict
 
     def convert_file_to_base10_list(self, file_name):
+        # rom images already hold the words, the signals are their signed 32 bit values
+        if RomImage.is_rom_file(file_name):
+            return RomImage.memmap(file_name).view('<i4').tolist()
+
         program = []
         with open(file_name) as file:
             for line in file:
@@ -44,53 +98,88 @@ class Program2ROM:
 
         return program
 
-    def decode_blueprint(self, blueprint_string):
-        raw_json = zlib.decompress(b64decode(blueprint_string.encode('ascii')[1:]))
-        return json.loads(raw_json)
-
-    def encode_dict(self, blueprint_dict):
-        data = json.dumps(blueprint_dict).encode('utf-8')
-        return '0' + b64encode(zlib.compress(data)).decode('ascii')
-
     def get_rom_blueprint(self, decimal_program) -> str:
-        program_split = [decimal_program[i:i + self.signal_map_max]
-                         for i in range(0, len(decimal_program), self.signal_map_max)]
-
-        rom_blueprint = self.decode_blueprint(self.blueprint_strings["rom_template"])
-        rom_blueprint["blueprint"]["entities"].clear()
-
-        for i, decimal_lines in enumerate(program_split):
-            rom_entities = self.get_rom_entities(decimal_lines)
-            self.update_entities(rom_entities, i)
-            rom_blueprint["blueprint"]["entities"] += rom_entities
-
-        return self.encode_dict(rom_blueprint)
-
-    def update_entities(self, entities, offset):
-        id_offset = offset * len(entities)
-        for entity in entities:
-            entity["position"]["x"] -= offset
-            entity["entity_number"] += id_offset
-
-            for _, connection in entity["connections"].items():
-                for __, color in connection.items():
-                    for number in color:
-                        number["entity_id"] += id_offset
-
-    def get_rom_entities(self, decimal_lines) -> list:
-        rom_map_entities = self.decode_blueprint(self.blueprint_strings["rom_template"])["blueprint"]["entities"]
-        for entity in rom_map_entities[:-1]:
-            entity['control_behavior']['filters'].clear()
-
+        return self.get_blocks_blueprint(list(enumerate(self.get_rom_blocks(decimal_program))))
+
+    def get_rom_delta_blueprint(self, decimal_program, rom_manifest: dict) -> str | None:
+        # only the blocks that changed since the manifest, the blocks the program does not use anymore are cleared
+        previous_hashes = rom_manifest.get("block_hashes", []) if rom_manifest.get("block_size") == self.signal_map_max \
+            else []
+        rom_blocks = self.get_rom_blocks(decimal_program)
+        changed_blocks = [(offset, rom_block) for offset, rom_block in enumerate(rom_blocks)
+                          if offset >= len(previous_hashes) or previous_hashes[offset] != CompileCache.get_key(rom_block)]
+        changed_blocks += [(offset, []) for offset in range(len(rom_blocks), len(previous_hashes))]
+        if not changed_blocks:
+            return None
+
+        label = "ROM blocks " + ", ".join(str(offset) for offset, _ in changed_blocks)
+        return self.get_blocks_blueprint(changed_blocks, label)
+
+    def get_manifest_blueprint(self, decimal_program, manifest_file, delta=False) -> str | None:
+        # the manifest has the blocks of the last blueprint, so a delta has the changes to the rom in the game
+        if delta:
+            blueprint = self.get_rom_delta_blueprint(decimal_program, Program2ROM.load_rom_manifest(manifest_file))
+        else:
+            blueprint = self.get_rom_blueprint(decimal_program)
+        Program2ROM.write_rom_manifest(manifest_file, self.get_rom_manifest(decimal_program))
+        return blueprint
+
+    def get_rom_manifest(self, decimal_program) -> dict:
+        return {
+            "block_size": self.signal_map_max,
+            "block_hashes": [CompileCache.get_key(rom_block) for rom_block in self.get_rom_blocks(decimal_program)],
+        }
+
+    @staticmethod
+    def load_rom_manifest(manifest_file) -> dict:
+        try:
+            with open(manifest_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+
+    @staticmethod
+    def write_rom_manifest(manifest_file, rom_manifest: dict):
+        with open(manifest_file, 'w') as f:
+            json.dump(rom_manifest, f, indent=4)
+
+    def get_rom_blocks(self, decimal_program) -> list[list[int]]:
+        return [decimal_program[i:i + self.signal_map_max] for i in range(0, len(decimal_program), self.signal_map_max)]
+
+    def get_blocks_blueprint(self, rom_blocks: list[tuple[int, list[int]]], label=None) -> str:
+        # every block is at the position of its offset in the rom, the entities are numbered in blueprint order
+        rom_entities = []
+        for blueprint_index, (offset, decimal_lines) in enumerate(rom_blocks):
+            rom_entities += self.get_rom_entities(decimal_lines, offset, blueprint_index)
+
+        rom_blueprint = {"blueprint": dict(self.rom_template["blueprint"], entities=rom_entities)}
+        if label:
+            rom_blueprint["blueprint"]["label"] = label
+        return BlueprintCodec.encode(rom_blueprint, self.compression_level)
+
+    def get_rom_entities(self, decimal_lines, offset=0, blueprint_index=None) -> list:
+        # new dicts only where a block differs from the template, the rest is shared with the template
+        id_offset = (offset if blueprint_index is None else blueprint_index) * len(self.rom_entity_templates)
+        rom_entities = []
+        for entity_template in self.rom_entity_templates:
+            entity = dict(entity_template)
+            entity["entity_number"] = entity_template["entity_number"] + id_offset
+            entity["position"] = dict(entity_template["position"], x=entity_template["position"]["x"] - offset)
+            entity["connections"] = {
+                circuit: {color: [dict(number, entity_id=number["entity_id"] + id_offset) for number in numbers]
+                          for color, numbers in connection.items()}
+                for circuit, connection in entity_template["connections"].items()}
+            entity["control_behavior"] = dict(entity_template["control_behavior"],
+                                              filters=list(entity_template["control_behavior"]["filters"]))
+            rom_entities.append(entity)
+
+        signal_table = self.signal_table
         for i, line in enumerate(decimal_lines):
-            signal = copy.deepcopy(self.signal_template)
-            signal['signal']['type'] = self.signal_map[i]['type']
-            signal['signal']['name'] = self.signal_map[i]['name']
-            signal['count'] = line
-            signal['index'] = (i % MAX_CONSTANT_COMB_SIGNALS) + 1
-            rom_map_entities[i // MAX_CONSTANT_COMB_SIGNALS]['control_behavior']['filters'].append(signal)
+            signal, index, entity_index = signal_table[i]
+            rom_entities[entity_index]['control_behavior']['filters'].append(
+                {'signal': signal, 'count': line, 'index': index})
 
-        return rom_map_entities
+        return rom_entities
 
     def create_rom_map_blueprint(self):
         constant_comb_idx = -1
@@ -115,16 +204,105 @@ class Program2ROM:
 
             signal_comb_idx += 1
 
-        return self.encode_dict(rom_map)
+        return BlueprintCodec.encode(rom_map, self.compression_level)
+
+    def create_cpu_blueprint(self):
+        # the cpu blueprint with the address decoder and rom map of the signal map
+        with open(CPU_BLUEPRINT_FILE) as f:
+            cpu_blueprint = BlueprintCodec.decode(f.read())
+        entities = cpu_blueprint['blueprint']['entities']
+        self.update_cpu_address_decoder(entities)
+        self.update_cpu_rom_map(entities)
+        return BlueprintCodec.encode(cpu_blueprint, self.compression_level)
+
+    def update_cpu_address_decoder(self, entities):
+        # the program counter is split in the block, divided by the block size, and the signal, the remainder
+        decoder_count = 0
+        for entity in entities:
+            control_behavior = entity.get('control_behavior', {})
+            arithmetic_conditions = control_behavior.get('arithmetic_conditions', {})
+            if arithmetic_conditions.get('operation') in ['/', '%'] and \
+                    arithmetic_conditions.get('second_constant') == CPU_BLOCK_SIZE:
+                arithmetic_conditions['second_constant'] = self.signal_map_max
+                decoder_count += 1
+            for signal in control_behavior.get('filters', []):
+                if signal['signal']['name'] == 'signal-A' and signal['count'] == CPU_BLOCK_SIZE - 1:
+                    signal['count'] = self.signal_map_max - 1
+                    decoder_count += 1
+
+        if decoder_count != 3:
+            raise Exception("Address decoder not found in the CPU blueprint: " + str(CPU_BLUEPRINT_FILE))
+
+    def update_cpu_rom_map(self, entities):
+        constant_comb_count = math.ceil(self.signal_map_max / MAX_CONSTANT_COMB_SIGNALS)
+        if constant_comb_count > MAX_CPU_ROM_MAP_COMBINATORS:
+            raise Exception("The ROM map of the CPU blueprint has room for " +
+                            str(MAX_CPU_ROM_MAP_COMBINATORS * MAX_CONSTANT_COMB_SIGNALS) + " signals, the signal map has "
+                            + str(self.signal_map_max))
+
+        rom_map = self.get_cpu_rom_map_entities(entities)
+        for _ in range(constant_comb_count - len(rom_map)):
+            # the added constant combinators continue the chain below the last one
+            last_entity = rom_map[-1]
+            entity = copy.deepcopy(last_entity)
+            entity['entity_number'] = max(entity['entity_number'] for entity in entities) + 1
+            entity['position']['y'] += 1
+            entity['connections'] = {'1': {'red': [{'entity_id': last_entity['entity_number']}]}}
+            last_entity['connections']['1']['red'].append({'entity_id': entity['entity_number']})
+            entities.append(entity)
+            rom_map.append(entity)
+
+        for entity in rom_map:
+            entity['control_behavior']['filters'] = []
+        for i, signal in enumerate(self.signal_map):
+            rom_map[i // MAX_CONSTANT_COMB_SIGNALS]['control_behavior']['filters'].append(
+                {'signal': {'type': signal['type'], 'name': signal['name']}, 'count': i + 1,
+                 'index': (i % MAX_CONSTANT_COMB_SIGNALS) + 1})
+
+    @staticmethod
+    def get_cpu_rom_map_entities(entities) -> list:
+        # the rom map is the chain of constant combinators that holds the last address of a block
+        entity_map = {entity['entity_number']: entity for entity in entities}
+        rom_map = []
+        entity_ids = [entity['entity_number'] for entity in entities if entity['name'] == 'constant-combinator' and
+                      any(signal['count'] == CPU_BLOCK_SIZE
+                          for signal in entity.get('control_behavior', {}).get('filters', []))]
+        while entity_ids:
+            entity = entity_map[entity_ids.pop()]
+            if entity in rom_map or entity['name'] != 'constant-combinator':
+                continue
+            rom_map.append(entity)
+            entity_ids += [connection['entity_id'] for connection in entity['connections']['1']['red']]
+
+        if len(rom_map) * MAX_CONSTANT_COMB_SIGNALS < CPU_BLOCK_SIZE:
+            raise Exception("ROM map not found in the CPU blueprint: " + str(CPU_BLUEPRINT_FILE))
+        # the constant combinators are in the order of their addresses
+        return sorted(rom_map, key=lambda rom_map_entity: min(
+            signal['count'] for signal in rom_map_entity['control_behavior']['filters']))
 
 
 @click.command()
-@click.option('--bin_file', '-b', help='Name of file containing the program in binary')
+@click.option('--bin_file', '-b', help='Name of the rom image or text binary file of the program')
 @click.option('--rom_map', '-m', help='Generate the rom map blueprint', is_flag=True)
+@click.option('--cpu', 'cpu', is_flag=True,
+              help='Generate the CPU blueprint with the address decoder and rom map of the signal map')
 @click.option('--clipboard', '-c', help='Copy blueprint to the clipboard', is_flag=True)
-def main(bin_file, rom_map, clipboard):
-    binary2rom = Program2ROM()
-    if rom_map:
+@click.option('--delta', '-d', is_flag=True,
+              help='Only the ROM blocks that changed since the last blueprint of the program')
+@click.option('--compression-level', '-z', type=click.IntRange(0, 9), show_default=True,
+              default=DEFAULT_COMPRESSION_LEVEL, help='Zlib level of the blueprint string')
+@click.option('--signal-map', '-s', 'signal_map_file', default=str(DEFAULT_SIGNAL_MAP_FILE),
+              help='Signal map of the ROM blocks, the ROM map has to be built with the same one')
+def main(bin_file, rom_map, cpu, clipboard, delta, compression_level, signal_map_file):
+    binary2rom = Program2ROM(compression_level, signal_map_file)
+    if cpu:
+        cpu_blueprint = binary2rom.create_cpu_blueprint()
+        if clipboard:
+            pyperclip.copy(cpu_blueprint)
+            print('CPU blueprint copied to clipboard')
+        else:
+            print(cpu_blueprint)
+    elif rom_map:
         rom_map_blueprint = binary2rom.create_rom_map_blueprint()
         if clipboard:
             pyperclip.copy(rom_map_blueprint)
@@ -133,8 +311,10 @@ def main(bin_file, rom_map, clipboard):
             print(rom_map_blueprint)
     elif bin_file:
         program = binary2rom.convert_file_to_base10_list(bin_file)
-        program_rom_blueprint = binary2rom.get_rom_blueprint(program)
-        if clipboard:
+        program_rom_blueprint = binary2rom.get_manifest_blueprint(program, bin_file[:-4] + ROM_MANIFEST_EXTENSION, delta)
+        if program_rom_blueprint is None:
+            print('ROM unchanged since the last blueprint')
+        elif clipboard:
             pyperclip.copy(program_rom_blueprint)
             print('Program blueprint copied to clipboard')
         else:
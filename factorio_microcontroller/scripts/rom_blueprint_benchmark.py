@@ -0,0 +1,51 @@
+import random
+import sys
+import time
+from pathlib import Path
+
+import click
+
+# run as a script only the scripts folder is on the path, the packages are in the folder above it
+sys.path.append(str(Path(__file__).parent.parent))
+from scripts.blueprint_codec import DEFAULT_COMPRESSION_LEVEL  # noqa: E402
+from scripts.program_to_rom_blueprint import Program2ROM  # noqa: E402
+
+BITS = 32
+
+
+class RomBlueprintBenchmark:
+    @staticmethod
+    def get_program(instruction_count) -> list[int]:
+        # image data and lookup tables are mostly full 32 bit words
+        program_random = random.Random(instruction_count)
+        return [program_random.randint(-(1 << (BITS - 1)), (1 << (BITS - 1)) - 1) for _ in range(instruction_count)]
+
+    @staticmethod
+    def run(instruction_count, repeat, compression_level=DEFAULT_COMPRESSION_LEVEL) -> (list[float], int):
+        program_to_rom = Program2ROM(compression_level)
+        program = RomBlueprintBenchmark.get_program(instruction_count)
+
+        blueprint_times = []
+        blueprint_length = 0
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            blueprint_length = len(program_to_rom.get_rom_blueprint(program))
+            blueprint_times.append(time.perf_counter() - start_time)
+        return blueprint_times, blueprint_length
+
+
+@click.command()
+@click.option('--instructions', '-i', 'instruction_counts', type=int, multiple=True,
+              default=[10_000, 100_000], show_default=True, help="Instructions of the generated program")
+@click.option('--repeat', '-r', type=int, show_default=True, default=3, help="Number of blueprints per program")
+@click.option('--compression-level', '-z', type=click.IntRange(0, 9), show_default=True,
+              default=DEFAULT_COMPRESSION_LEVEL, help="Zlib level of the blueprint string")
+def main(instruction_counts, repeat, compression_level):
+    for instruction_count in instruction_counts:
+        blueprint_times, blueprint_length = RomBlueprintBenchmark.run(instruction_count, repeat, compression_level)
+        print(str(instruction_count) + " instructions, blueprint of " + str(blueprint_length) + " characters.")
+        print("Best: " + str(round(min(blueprint_times), 3)) + " seconds.")
+
+
+if __name__ == '__main__':
+    main()
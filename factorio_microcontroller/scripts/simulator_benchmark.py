@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import click
+
+# run as a script only the scripts folder is on the path, the packages are in the folder above it
+sys.path.append(str(Path(__file__).parent.parent))
+from compiler.assembly_compiler import AssemblyCompiler  # noqa: E402
+from simulator.factorio_microcontroller_sim import (FactorioMicrocontrollerSim, INTERPRETER_ENGINE,  # noqa: E402
+                                                    BLOCK_ENGINE)
+from simulator.input_sim import InputSim  # noqa: E402
+
+PROGRAMS_FOLDER = Path(__file__).parent.parent.parent / "programs"
+
+
+class SimulatorBenchmark:
+    @staticmethod
+    def run_engine(binary_file, input_config, engine, repeat) -> (list[float], tuple):
+        run_times = []
+        final_state = None
+        for _ in range(repeat):
+            simulator = FactorioMicrocontrollerSim(binary_file, input_config=input_config)
+            simulator.quiet = True
+            start_time = time.perf_counter()
+            try:
+                simulator.run(verbose=False, enable_igpu_sim=False, engine=engine)
+            except TimeoutError:
+                pass
+            run_times.append(time.perf_counter() - start_time)
+
+            state = simulator.microcontroller_state
+            final_state = (simulator.cycle_count, state.program_counter, state.w_register, list(state.f_memory),
+                           list(state.output_registers), list(state.igpu_state.screen_buffer))
+        return run_times, final_state
+
+    @staticmethod
+    def run(assembly_file, input_config_file, repeat) -> dict:
+        input_config = InputSim.load_config(input_config_file) if input_config_file else None
+        binary_file, _ = AssemblyCompiler().compile(str(assembly_file))
+        try:
+            results = {engine: SimulatorBenchmark.run_engine(binary_file, input_config, engine, repeat)
+                       for engine in [INTERPRETER_ENGINE, BLOCK_ENGINE]}
+        finally:
+            os.remove(binary_file)
+            os.remove(binary_file[:-4] + '.bin')
+
+        # a faster engine is only useful when it ends in the same state
+        if results[INTERPRETER_ENGINE][1] != results[BLOCK_ENGINE][1]:
+            raise Exception("The " + BLOCK_ENGINE + " engine does not match the " + INTERPRETER_ENGINE +
+                            " engine on " + str(assembly_file))
+        return results
+
+
+@click.command()
+@click.option('--assembly', '-a', 'assembly_files', multiple=True, show_default=True,
+              default=[str(PROGRAMS_FOLDER / "pong.txt")], help="Assembly files of the programs")
+@click.option('--input-config', '-c', help="Json file with the input source of each input channel")
+@click.option('--repeat', '-r', type=int, show_default=True, default=5, help="Number of runs per engine")
+def main(assembly_files, input_config, repeat):
+    for assembly_file in assembly_files:
+        results = SimulatorBenchmark.run(assembly_file, input_config, repeat)
+        cycle_count = results[INTERPRETER_ENGINE][1][0]
+        print(str(assembly_file) + ", " + str(cycle_count) + " cycles.")
+        for engine, (run_times, _) in results.items():
+            print(engine + ": " + str(round(min(run_times), 4)) + " seconds, " +
+                  str(round(cycle_count / min(run_times))) + " cycles per second.")
+        print("Speedup: " + str(round(min(results[INTERPRETER_ENGINE][0]) / min(results[BLOCK_ENGINE][0]), 2)) + "x")
+
+
+if __name__ == '__main__':
+    main()
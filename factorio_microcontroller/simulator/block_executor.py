@@ -0,0 +1,230 @@
+import operator
+
+from simulator.decoded_instruction import DecodedInstruction
+from simulator.instruction_executor import (divide, modulo, increment, decrement,
+                                            rotate_left_once, rotate_right_once, INT32_OFFSET, UINT32_MASK)
+from simulator.microcontroller_state import MicrocontrollerState
+
+ALU_EXPRESSIONS = {
+    operator.add: "{a} + {b}",
+    operator.sub: "{a} - {b}",
+    operator.mul: "{a} * {b}",
+    divide: "(int({a} / {b}) if {b} else 0)",
+    modulo: "(int({a} % {b}) if {b} else 0)",
+    increment: "{b} + 1",
+    decrement: "{b} - 1",
+    rotate_left_once: "{b} << 1",
+    rotate_right_once: "{b} >> 1",
+    operator.lshift: "{a} << {b}",
+    operator.rshift: "{a} >> {b}",
+    operator.and_: "{a} & {b}",
+    operator.or_: "{a} | {b}",
+}
+
+CONDITION_EXPRESSIONS = {
+    operator.gt: ">",
+    operator.lt: "<",
+    operator.eq: "==",
+}
+
+BRANCHING_HANDLERS = [
+    "execute_halt", "execute_conditional_operation", "execute_call", "execute_goto", "execute_return",
+]
+
+# the screen only changes on render, ending the block there keeps the igpu frame timestamps exact
+BLOCK_END_HANDLERS = BRANCHING_HANDLERS + ["execute_render"]
+
+
+class BlockExecutor:
+    def __init__(self, decoded_instructions: list[DecodedInstruction], input_streams):
+        self.decoded_instructions = decoded_instructions
+        self.input_streams = input_streams
+        self.blocks = dict()
+        self.max_block_cycles = self.get_max_block_cycles()
+
+        self.translate_blocks(self.get_entry_points())
+
+    def execute(self, state: MicrocontrollerState, cycle_count: int) -> (int, bool):
+        return self.get_block(state.program_counter)(state, cycle_count)
+
+    def get_block(self, program_counter):
+        if program_counter not in self.blocks:
+            self.translate_blocks([program_counter])
+        return self.blocks[program_counter]
+
+    def execute_instruction(self, state: MicrocontrollerState, cycle_count: int) -> (int, bool):
+        # one interpreted instruction, with the same result as a block of one cycle
+        instruction = self.decoded_instructions[state.program_counter - 1]
+        state.input_values[0] = self.input_streams[0][cycle_count]
+        state.input_values[1] = self.input_streams[1][cycle_count]
+        return 1, instruction.handler(instruction, state)
+
+    def get_max_block_cycles(self) -> int:
+        # the longest run of instructions up to a block end, no block from any entry point is longer
+        max_block_cycles = 0
+        block_cycles = 0
+        for instruction in self.decoded_instructions:
+            block_cycles += 1
+            max_block_cycles = max(max_block_cycles, block_cycles)
+            if instruction.handler.__name__ in BLOCK_END_HANDLERS:
+                block_cycles = 0
+        return max_block_cycles
+
+    def get_entry_points(self) -> list[int]:
+        entry_points = {1}
+        for address, instruction in enumerate(self.decoded_instructions, start=1):
+            handler_name = instruction.handler.__name__
+            if handler_name in ["execute_goto", "execute_call"]:
+                entry_points.add(instruction.literal)
+            if handler_name == "execute_conditional_operation":
+                entry_points.add(address + instruction.skip_count + 2)
+            if handler_name in BLOCK_END_HANDLERS:
+                entry_points.add(address + 1)
+
+        return sorted(address for address in entry_points if 0 < address <= len(self.decoded_instructions))
+
+    def get_block_instructions(self, program_counter) -> list[DecodedInstruction]:
+        block_instructions = []
+        address = program_counter
+        while address - 1 < len(self.decoded_instructions):
+            instruction = self.decoded_instructions[address - 1]
+            block_instructions.append(instruction)
+            if instruction.handler.__name__ in BLOCK_END_HANDLERS:
+                break
+            address += 1
+
+        if not block_instructions:
+            raise IndexError("Program counter out of range: " + str(program_counter))
+        return block_instructions
+
+    def translate_blocks(self, program_counters: list[int]):
+        # compiling is expensive per call, so all blocks are compiled as one module
+        namespace = {"input_1": self.input_streams[0], "input_2": self.input_streams[1]}
+        lines = []
+        for program_counter in program_counters:
+            lines += self.translate_block(program_counter, namespace)
+
+        exec(compile('\n'.join(lines), "<blocks>", "exec"), namespace)
+        for program_counter in program_counters:
+            self.blocks[program_counter] = namespace["block_" + str(program_counter)]
+
+    def translate_block(self, program_counter, namespace) -> list[str]:
+        block_instructions = self.get_block_instructions(program_counter)
+
+        lines = [
+            "def block_" + str(program_counter) + "(state, cycle):",
+            "    f = state.f_memory",
+            "    base = state.frame_base",
+            "    w = state.w_register",
+        ]
+        exit_lines = [
+            "    state.w_register = w",
+            "    state.program_counter = " + str(program_counter + len(block_instructions)),
+            "    return " + str(len(block_instructions)) + ", False",
+        ]
+
+        for offset, instruction in enumerate(block_instructions):
+            address = program_counter + offset
+            lines.append("    # " + str(address) + ": " + instruction.opcode + " " + str(instruction.literal))
+            translate = getattr(self, "translate_" + instruction.handler.__name__[len("execute_"):], None)
+            if translate is None:
+                lines += self.translate_handler_call(instruction, address, namespace)
+            elif instruction.handler.__name__ in BRANCHING_HANDLERS:
+                exit_lines = ["    " + line for line in translate(instruction, address, offset + 1)]
+            else:
+                lines += ["    " + line for line in translate(instruction, address, offset + 1)]
+
+        return lines + exit_lines
+
+    @staticmethod
+    def get_load_expression(instruction: DecodedInstruction):
+        if instruction.load == 'F':
+            return "f[base + " + str(instruction.literal) + "]"
+        elif instruction.load == 'W':
+            return "w"
+        return str(instruction.literal)
+
+    @staticmethod
+    def get_store_lines(instruction: DecodedInstruction, expression):
+        if instruction.store == 'F':
+            return ["f[base + " + str(instruction.literal) + "] = " + expression]
+        return ["w = " + expression]
+
+    def translate_handler_call(self, instruction: DecodedInstruction, address, namespace):
+        # only the igpu handlers are called directly, they do not use the W register
+        handler_name = "handler_" + str(address)
+        instruction_name = "instruction_" + str(address)
+        namespace[handler_name] = instruction.handler
+        namespace[instruction_name] = instruction
+        return ["    " + handler_name + "(" + instruction_name + ", state)"]
+
+    def translate_halt(self, instruction: DecodedInstruction, address, cycles):
+        if instruction.literal == 1:
+            return ["state.w_register = w",
+                    "state.program_counter = " + str(address + 1),
+                    "return " + str(cycles) + ", False"]
+        return ["state.w_register = w",
+                "state.program_counter = " + str(address),
+                "return " + str(cycles) + ", True"]
+
+    def translate_other_operation(self, instruction: DecodedInstruction, address, cycles):
+        return []
+
+    def translate_output_operation(self, instruction: DecodedInstruction, address, cycles):
+        return ["state.output_registers[" + str(instruction.io_index) + "] = " +
+                self.get_load_expression(instruction)]
+
+    def translate_input_operation(self, instruction: DecodedInstruction, address, cycles):
+        cycle = "cycle + " + str(cycles - 1)
+        return ["state.input_values[0] = input_1[" + cycle + "]",
+                "state.input_values[1] = input_2[" + cycle + "]"] + \
+            self.get_store_lines(instruction, "state.input_values[" + str(instruction.io_index) + "]")
+
+    def translate_conditional_operation(self, instruction: DecodedInstruction, address, cycles):
+        condition = "w " + CONDITION_EXPRESSIONS[instruction.operation] + " " + self.get_load_expression(instruction)
+        return ["state.w_register = w",
+                "if " + condition + ":",
+                "    state.program_counter = " + str(address + 1),
+                "else:",
+                "    state.program_counter = " + str(address + instruction.skip_count + 2),
+                "return " + str(cycles) + ", False"]
+
+    def translate_call(self, instruction: DecodedInstruction, address, cycles):
+        return ["state.w_register = w",
+                "state.function_call_stack.append(" + str(address + 1) + ")",
+                "state.push_scope()",
+                "state.program_counter = " + str(instruction.literal),
+                "return " + str(cycles) + ", False"]
+
+    def translate_goto(self, instruction: DecodedInstruction, address, cycles):
+        return ["state.w_register = w",
+                "state.program_counter = " + str(instruction.literal),
+                "return " + str(cycles) + ", False"]
+
+    def translate_return(self, instruction: DecodedInstruction, address, cycles):
+        return ["state.w_register = " + self.get_load_expression(instruction),
+                "state.program_counter = state.function_call_stack.pop()",
+                "state.pop_scope()",
+                "return " + str(cycles) + ", False"]
+
+    def translate_var(self, instruction: DecodedInstruction, address, cycles):
+        return ["state.variable_offset = " + str(instruction.literal)]
+
+    def translate_move_literal_to_w(self, instruction: DecodedInstruction, address, cycles):
+        return ["w = " + str(instruction.literal)]
+
+    def translate_move_w_to_f(self, instruction: DecodedInstruction, address, cycles):
+        return ["f[base + " + str(instruction.literal) + "] = w"]
+
+    def translate_move_f_to_w(self, instruction: DecodedInstruction, address, cycles):
+        return ["w = f[base + " + str(instruction.literal) + "]"]
+
+    def translate_move_literal_to_f(self, instruction: DecodedInstruction, address, cycles):
+        return ["f[base + w] = " + str(instruction.literal)]
+
+    def translate_alu_operation(self, instruction: DecodedInstruction, address, cycles):
+        expression = ALU_EXPRESSIONS[instruction.operation].format(a="w", b=self.get_load_expression(instruction))
+        # wrapped to signed 32 bits inline like wrap_int32, a function call per alu instruction is slower
+        expression = "(((" + expression + ") + " + str(INT32_OFFSET) + ") & " + str(UINT32_MASK) + ") - " + \
+            str(INT32_OFFSET)
+        return self.get_store_lines(instruction, expression)
@@ -1,2 +1,8 @@
 MEMORY_SIZE = 500
 SCREEN_SIZE = 36
+SCREEN_HEIGHT = 32
+
+CPU_CLOCK_PERIOD = 0.4/0.6
+# game speed the timing estimates assume, each instruction takes two clock cycles
+GAME_SPEED = 64
+INSTRUCTION_DURATION = CPU_CLOCK_PERIOD * 2 / GAME_SPEED
@@ -0,0 +1,119 @@
+from dataclasses import dataclass, replace
+from functools import wraps
+
+from compiler.assembly_line import AssemblyLine
+from simulator.constants import INSTRUCTION_DURATION
+from simulator.decoded_instruction import DecodedInstruction
+from simulator.source_index import SourceIndex
+
+
+@dataclass()
+class FunctionProfile:
+    name: str
+    inclusive_cycles: int = 0
+    exclusive_cycles: int = 0
+    call_count: int = 0
+
+
+@dataclass()
+class LineProfile:
+    address: int
+    function: str
+    assembly_line: AssemblyLine
+    cycles: int
+
+
+class CycleProfiler:
+    def __init__(self, source_index: SourceIndex):
+        self.source_index = source_index
+        self.decoded_instructions: list[DecodedInstruction] = []
+        # cycles per (function call stack, rom address), every report is derived from these
+        self.stack_cycles: dict[tuple[tuple[int, ...], int], int] = dict()
+
+    def wrap_instructions(self, decoded_instructions: list[DecodedInstruction]) -> list[DecodedInstruction]:
+        # the profiled handlers replace the originals, so the sim itself does not change when profiling is off
+        self.decoded_instructions = decoded_instructions
+        return [replace(instruction, handler=self.get_profiled_handler(instruction.handler, address))
+                for address, instruction in enumerate(decoded_instructions, start=1)]
+
+    def get_profiled_handler(self, handler, address):
+        stack_cycles = self.stack_cycles
+
+        @wraps(handler)
+        def profiled_handler(instruction: DecodedInstruction, state):
+            key = (tuple(state.function_call_stack), address)
+            stack_cycles[key] = stack_cycles.get(key, 0) + 1
+            return handler(instruction, state)
+
+        return profiled_handler
+
+    def get_total_cycles(self):
+        return sum(self.stack_cycles.values())
+
+    def get_frames(self, function_call_stack, address) -> list[str]:
+        # every return address directly follows the CALL in the calling function
+        frames = [self.source_index.get_function(return_address - 1) for return_address in function_call_stack]
+        frames.append(self.source_index.get_function(address))
+        return frames
+
+    def get_function_profiles(self) -> list[FunctionProfile]:
+        function_profiles: dict[str, FunctionProfile] = dict()
+        for (function_call_stack, address), cycles in self.stack_cycles.items():
+            frames = self.get_frames(function_call_stack, address)
+            # recursive functions are only counted once per cycle
+            for frame in set(frames):
+                function_profiles.setdefault(frame, FunctionProfile(frame)).inclusive_cycles += cycles
+            function_profiles[frames[-1]].exclusive_cycles += cycles
+
+            instruction = self.decoded_instructions[address - 1]
+            if instruction.handler.__name__ == "execute_call":
+                callee = self.source_index.get_function(instruction.literal)
+                function_profiles.setdefault(callee, FunctionProfile(callee)).call_count += cycles
+
+        return sorted(function_profiles.values(), key=lambda profile: profile.inclusive_cycles, reverse=True)
+
+    def get_line_profiles(self) -> list[LineProfile]:
+        address_cycles: dict[int, int] = dict()
+        for (_, address), cycles in self.stack_cycles.items():
+            address_cycles[address] = address_cycles.get(address, 0) + cycles
+
+        line_profiles = [LineProfile(address, self.source_index.get_function(address),
+                                     self.source_index.get_assembly_line(address), cycles)
+                         for address, cycles in address_cycles.items()]
+        return sorted(line_profiles, key=lambda profile: profile.cycles, reverse=True)
+
+    def get_collapsed_stacks(self) -> list[str]:
+        collapsed_stacks: dict[str, int] = dict()
+        for (function_call_stack, address), cycles in self.stack_cycles.items():
+            stack = ';'.join(self.get_frames(function_call_stack, address))
+            collapsed_stacks[stack] = collapsed_stacks.get(stack, 0) + cycles
+
+        return [stack + " " + str(cycles) for stack, cycles in sorted(collapsed_stacks.items())]
+
+    def write_collapsed_stacks(self, file_name):
+        with open(file_name, 'w') as f:
+            f.write('\n'.join(self.get_collapsed_stacks()) + '\n')
+
+    def print_report(self, line_count=10):
+        total_cycles = self.get_total_cycles()
+        if total_cycles == 0:
+            return
+
+        print("\nProfiled " + str(total_cycles) + " cycles, " +
+              str(round(total_cycles * INSTRUCTION_DURATION, 1)) + " seconds in game.")
+        print("\nFunction: inclusive cycles, exclusive cycles, calls")
+        for profile in self.get_function_profiles():
+            print(profile.name + ": " +
+                  self.get_cycles_text(profile.inclusive_cycles, total_cycles) + ", " +
+                  self.get_cycles_text(profile.exclusive_cycles, total_cycles) + ", " +
+                  str(profile.call_count))
+
+        print("\nHottest lines: cycles, function, line")
+        for profile in self.get_line_profiles()[:line_count]:
+            line = profile.assembly_line
+            print(self.get_cycles_text(profile.cycles, total_cycles) + ", " + profile.function + ", " +
+                  str(line.line_number) + ". " + line.line)
+
+    @staticmethod
+    def get_cycles_text(cycles, total_cycles):
+        return str(cycles) + " (" + str(round(100 * cycles / total_cycles, 1)) + "%)"
@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass()
+class DecodedInstruction:
+    opcode: str
+    literal: int
+
+    handler: Callable | None = None
+    operation: Callable | None = None
+    load: str = 'L'
+    store: str = 'W'
+    skip_count: int = 0
+    io_index: int = 0
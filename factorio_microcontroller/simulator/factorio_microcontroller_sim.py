@@ -1,101 +1,181 @@
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 
 import click
 
 from compiler.assembly_compiler import AssemblyCompiler, DisassemblerInfo
-from compiler.assembly_line import AssemblyLine
-from compiler.reserved_identifiers import MAIN_FUNCTION_NAME
-from simulator.context_state import ContextState
-from simulator.igpu_sim import IGPUSim
-from simulator.input_sim import InputSim
+from compiler.compile_cache import CompileCache
+from compiler.function_inliner import DEFAULT_INLINE_SIZE
+from compiler.rom_image import RomImage
+from simulator.block_executor import BlockExecutor
+from simulator.constants import CPU_CLOCK_PERIOD, GAME_SPEED
+from simulator.cycle_profiler import CycleProfiler
+from simulator.decoded_instruction import DecodedInstruction
+from simulator.igpu_sim import IGPUSim, FrameHasher
+from simulator.input_sim import InputSim, DEFAULT_INPUT_CONFIG
 from simulator.instruction_decoder import InstructionDecoder
 from simulator.instruction_executor import InstructionExecutor
+from simulator.lockstep_sim import LockstepSim
 from simulator.microcontroller_state import MicrocontrollerState
+from simulator.source_index import SourceIndex
+from simulator.trace_recorder import TraceRecorder
 
-CPU_CLOCK_PERIOD = 0.4/0.6
 CYCLE_TIMEOUT = 50_000
 
+INTERPRETER_ENGINE = "interpreter"
+BLOCK_ENGINE = "block"
+# steps all jobs of a batch at once with numpy, only for batches
+LOCKSTEP_ENGINE = "lockstep"
+ENGINES = [INTERPRETER_ENGINE, BLOCK_ENGINE, LOCKSTEP_ENGINE]
+
+DEFAULT_INPUT_SLOPE = DEFAULT_INPUT_CONFIG["1"]["slope"]
+DEFAULT_INPUT_INITIAL = DEFAULT_INPUT_CONFIG["1"]["initial"]
+
 
 class FactorioMicrocontrollerSim:
-    def __init__(self, file_name, disassembler_info: DisassemblerInfo = None):
+    def __init__(self, file_name, disassembler_info: DisassemblerInfo = None, input_config: dict = None):
         self.disassembler_info = disassembler_info
-        self.binary = self.load_binary(file_name)
+        self.source_index = SourceIndex(disassembler_info) if disassembler_info else None
+        # batch workers get an already decoded program, so there is no binary to load
+        self.binary = self.load_binary(file_name) if file_name else None
+        self.input_config = input_config or dict()
 
         self.instruction_executor = InstructionExecutor()
         self.igpu_sim = IGPUSim()
+        self.cycle_profiler = CycleProfiler(self.source_index) if self.source_index else None
+        self.trace_recorder: TraceRecorder | None = None
+        self.microcontroller_state = None
+        self.cycle_count = 0
+        self.quiet = False
+
+    @staticmethod
+    def load_binary(file_name) -> list[int]:
+        return RomImage.load_instructions(file_name)
 
-    def load_binary(self, file_name):
-        with open(file_name) as f:
-            return f.read().splitlines()
+    def get_input_streams(self, decoded_instructions):
+        # a block can run past the timeout by at most its length
+        return InputSim.get_input_streams(self.input_config, CYCLE_TIMEOUT + len(decoded_instructions))
 
-    def run(self, verbose, enable_igpu_sim):
-        decoded_instructions = InstructionDecoder.decode_all_instructions(self.binary)
-        final_state = self.simulate(decoded_instructions, verbose, enable_igpu_sim)
+    def run(self, verbose, enable_igpu_sim, engine=INTERPRETER_ENGINE, profile=False):
+        if engine == LOCKSTEP_ENGINE:
+            raise ValueError("The " + LOCKSTEP_ENGINE + " engine only runs batches.")
+        decoded_instructions = InstructionDecoder.decode_all_instructions(self.binary, self.instruction_executor)
+        if engine == BLOCK_ENGINE:
+            if verbose or profile or self.trace_recorder:
+                raise ValueError("Verbose output, profiling and tracing are only supported by the " +
+                                 INTERPRETER_ENGINE + " engine.")
+            final_state = self.simulate_blocks(decoded_instructions, enable_igpu_sim)
+        elif profile or self.trace_recorder:
+            if profile and self.cycle_profiler is None:
+                raise ValueError("Profiling needs the disassembler info of the assembly file.")
+            if self.trace_recorder:
+                decoded_instructions = self.trace_recorder.wrap_instructions(decoded_instructions)
+                self.trace_recorder.open()
+            if profile:
+                decoded_instructions = self.cycle_profiler.wrap_instructions(decoded_instructions)
+
+            # the profile and trace are still written for programs that do not halt
+            try:
+                final_state = self.simulate(decoded_instructions, verbose, enable_igpu_sim)
+            finally:
+                if self.trace_recorder:
+                    self.trace_recorder.close()
+                if profile:
+                    self.cycle_profiler.print_report()
+        else:
+            final_state = self.simulate(decoded_instructions, verbose, enable_igpu_sim)
 
         if enable_igpu_sim:
-            self.igpu_sim.run()
+            self.igpu_sim.run(self.cycle_count)
 
         return final_state
 
     def simulate(self, decoded_instructions, verbose, enable_igpu_sim):
         microcontroller_state = MicrocontrollerState()
+        self.microcontroller_state = microcontroller_state
+        input_values = microcontroller_state.input_values
+        input_1, input_2 = self.get_input_streams(decoded_instructions)
+        igpu_state = microcontroller_state.igpu_state
+        screen_buffer = igpu_state.screen_buffer
+        if enable_igpu_sim:
+            self.igpu_sim.add_frame(0, screen_buffer)
         cycle_count = 0
         while True:
-            opcode, literal = decoded_instructions[microcontroller_state.program_counter - 1]
-
-            # TODO maybe a json config with the input mock type and data (linear, random, exponential)
-            microcontroller_state.input_values[0] = InputSim.get_linear_input(cycle_count, 2, 0)
-
-            if self.disassembler_info:
-                scopes, assembly_line = self.get_assembly_line_and_scope(microcontroller_state)
-                is_halt = self.instruction_executor.execute(opcode, literal, microcontroller_state)
-                variables = self.get_variables(microcontroller_state, scopes[-1])
-                microcontroller_state.context_state = ContextState(
-                    assembly_line=assembly_line,
-                    scope='->'.join(scopes),
-                    variables=variables
-                )
-            else:
-                is_halt = self.instruction_executor.execute(opcode, literal, microcontroller_state)
+            program_counter = microcontroller_state.program_counter
+            instruction = decoded_instructions[program_counter - 1]
+
+            input_values[0] = input_1[cycle_count]
+            input_values[1] = input_2[cycle_count]
+
+            # the scopes are taken before CALL or RET changes the call stack
+            if verbose and self.source_index:
+                scopes = self.source_index.get_scopes(microcontroller_state, program_counter)
 
-            if enable_igpu_sim:
-                self.igpu_sim.add_state(deepcopy(microcontroller_state.igpu_state))
+            is_halt = instruction.handler(instruction, microcontroller_state)
+
+            # the screen buffer is only replaced on render
+            if enable_igpu_sim and igpu_state.screen_buffer is not screen_buffer:
+                screen_buffer = igpu_state.screen_buffer
+                self.igpu_sim.add_frame(cycle_count, screen_buffer)
 
             cycle_count += 1
             if cycle_count >= CYCLE_TIMEOUT:
+                self.cycle_count = cycle_count
                 raise TimeoutError("Program did not halt after " + str(CYCLE_TIMEOUT) + " cycles.")
 
             if verbose:
-                self.print_verbose(opcode, literal, cycle_count, microcontroller_state)
+                if self.source_index:
+                    microcontroller_state.context_state = self.source_index.get_context_state(microcontroller_state,
+                                                                                              program_counter, scopes)
+                self.print_verbose(instruction.opcode, instruction.literal, cycle_count, microcontroller_state)
 
             if is_halt:
-                print("\nHalted after " + str(cycle_count) + " cycles.")
-                print("Would take " + str(round((cycle_count * CPU_CLOCK_PERIOD * 2) / 64)) + " seconds to complete.")
+                self.cycle_count = cycle_count
+                if not self.quiet:
+                    self.print_halt(cycle_count)
                 return microcontroller_state
 
-    def get_assembly_line_and_scope(self, microcontroller_state: MicrocontrollerState) -> (list[str], AssemblyLine):
-        current_scope = MAIN_FUNCTION_NAME
-        scopes = [current_scope]
-        for address in microcontroller_state.function_call_stack:
-            line_number = address - self.disassembler_info.function_addresses[current_scope] - 1
-            next_scope = self.disassembler_info.function_scopes[current_scope][line_number].assembly_token.arguments[0]
-            scopes.append(next_scope)
-            current_scope = next_scope
-
-        current_scope = scopes[-1]
-        scope_line_number = (microcontroller_state.program_counter -
-                             self.disassembler_info.function_addresses[current_scope])
-        try:
-            assembly_line = self.disassembler_info.function_scopes[current_scope][scope_line_number]
-        except IndexError:
-            assembly_line = AssemblyLine("", -1, "", None)
-        return scopes, assembly_line
+    def simulate_blocks(self, decoded_instructions, enable_igpu_sim):
+        microcontroller_state = MicrocontrollerState()
+        self.microcontroller_state = microcontroller_state
+        block_executor = BlockExecutor(decoded_instructions, self.get_input_streams(decoded_instructions))
+        blocks = block_executor.blocks
+        igpu_state = microcontroller_state.igpu_state
+        screen_buffer = igpu_state.screen_buffer
+        if enable_igpu_sim:
+            self.igpu_sim.add_frame(0, screen_buffer)
+        cycle_count = 0
+        # a block can not run past the timeout, the last cycles before it are interpreted one at a time
+        block_cycle_limit = CYCLE_TIMEOUT - block_executor.max_block_cycles
+        while True:
+            if cycle_count <= block_cycle_limit:
+                block = blocks.get(microcontroller_state.program_counter)
+                if block is None:
+                    block = block_executor.get_block(microcontroller_state.program_counter)
+            else:
+                block = block_executor.execute_instruction
+            executed_cycles, is_halt = block(microcontroller_state, cycle_count)
+            cycle_count += executed_cycles
 
-    def get_variables(self, microcontroller_state: MicrocontrollerState, current_scope) -> dict[str, int]:
-        variables = dict()
-        for variable_name, address in self.disassembler_info.variable_addresses[current_scope].items():
-            variables[variable_name] = microcontroller_state.read_f_memory(address)
-        return variables
+            # render always ends a block, so the screen only changes on the last cycle
+            if enable_igpu_sim and igpu_state.screen_buffer is not screen_buffer:
+                screen_buffer = igpu_state.screen_buffer
+                self.igpu_sim.add_frame(cycle_count - 1, screen_buffer)
+
+            if cycle_count >= CYCLE_TIMEOUT:
+                self.cycle_count = cycle_count
+                raise TimeoutError("Program did not halt after " + str(CYCLE_TIMEOUT) + " cycles.")
+
+            if is_halt:
+                self.cycle_count = cycle_count
+                if not self.quiet:
+                    self.print_halt(cycle_count)
+                return microcontroller_state
+
+    @staticmethod
+    def print_halt(cycle_count):
+        print("\nHalted after " + str(cycle_count) + " cycles.")
+        print("Would take " + str(round((cycle_count * CPU_CLOCK_PERIOD * 2) / GAME_SPEED)) + " seconds to complete.")
 
     @staticmethod
     def print_verbose(opcode, literal, cycle_count, microcontroller_state):
@@ -115,26 +195,177 @@ class FactorioMicrocontrollerSim:
                   ", " + str(microcontroller_state.w_register))
             print("Current memory snapshot: " +
                   str(microcontroller_state.f_memory[
-                      microcontroller_state.variable_scope_stack[-1] + 1:
-                      microcontroller_state.variable_scope_stack[-1] + 10]))
+                      microcontroller_state.frame_base + 1:
+                      microcontroller_state.frame_base + 10].tolist()))
             print("Screen buffer: " + str(microcontroller_state.igpu_state.screen_buffer))
 
 
+@dataclass()
+class BatchJob:
+    binary_file: str
+    # the linear input on channel 1, without a slope channel 1 comes from the input config
+    input_slope: int | None = DEFAULT_INPUT_SLOPE
+    input_initial: int = DEFAULT_INPUT_INITIAL
+    input_config: dict | None = None
+
+    def get_input_config(self) -> dict:
+        input_config = dict(self.input_config or dict())
+        if self.input_slope is not None:
+            input_config["1"] = InputSim.get_linear_config(self.input_slope, self.input_initial)
+        return input_config
+
+
+@dataclass()
+class BatchResult:
+    job: BatchJob
+    output_registers: list[int]
+    cycle_count: int
+    halted: bool
+    frame_hash: str | None = None
+
+
+class BatchSim:
+    # filled once per worker process by the pool initializer
+    decoded_programs: dict[str, list[DecodedInstruction]] = {}
+
+    def __init__(self, engine=INTERPRETER_ENGINE, enable_frame_hash=False, max_workers=None):
+        self.engine = engine
+        self.enable_frame_hash = enable_frame_hash
+        self.max_workers = max_workers
+
+    def run(self, jobs: list[BatchJob]) -> list[BatchResult]:
+        # every program is decoded once here and shipped to each worker, instead of once per job
+        instruction_executor = InstructionExecutor()
+        decoded_programs = dict()
+        for job in jobs:
+            if job.binary_file not in decoded_programs:
+                binary = FactorioMicrocontrollerSim.load_binary(job.binary_file)
+                decoded_programs[job.binary_file] = InstructionDecoder.decode_all_instructions(
+                    binary, instruction_executor)
+
+        if self.engine == LOCKSTEP_ENGINE:
+            return self.run_lockstep(jobs, decoded_programs)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=BatchSim.init_worker,
+                                 initargs=(decoded_programs,)) as executor:
+            return list(executor.map(self.run_job, jobs))
+
+    def run_lockstep(self, jobs: list[BatchJob], decoded_programs) -> list[BatchResult]:
+        if self.enable_frame_hash:
+            raise ValueError("Frame hashes are not supported by the " + LOCKSTEP_ENGINE + " engine.")
+        if any(job.input_config or job.input_slope is None for job in jobs):
+            raise ValueError("The " + LOCKSTEP_ENGINE + " engine only supports linear input slopes.")
+
+        results: list[BatchResult | None] = [None] * len(jobs)
+        for binary_file, decoded_instructions in decoded_programs.items():
+            job_indexes = [index for index, job in enumerate(jobs) if job.binary_file == binary_file]
+            lockstep_sim = LockstepSim(decoded_instructions,
+                                       [jobs[index].input_slope for index in job_indexes],
+                                       [jobs[index].input_initial for index in job_indexes]).run(CYCLE_TIMEOUT)
+
+            for instance, index in enumerate(job_indexes):
+                results[index] = BatchResult(
+                    job=jobs[index],
+                    output_registers=lockstep_sim.output_registers[instance].tolist(),
+                    cycle_count=int(lockstep_sim.cycle_count[instance]),
+                    halted=bool(lockstep_sim.halted[instance]),
+                )
+        return results
+
+    @staticmethod
+    def init_worker(decoded_programs):
+        BatchSim.decoded_programs = decoded_programs
+
+    def run_job(self, job: BatchJob) -> BatchResult:
+        sim = FactorioMicrocontrollerSim(None, input_config=job.get_input_config())
+        sim.quiet = True
+        if self.enable_frame_hash:
+            sim.igpu_sim = FrameHasher()
+
+        decoded_instructions = BatchSim.decoded_programs[job.binary_file]
+        # programs like input_rate never halt, the state at the timeout is still a result
+        halted = True
+        try:
+            if self.engine == BLOCK_ENGINE:
+                sim.simulate_blocks(decoded_instructions, self.enable_frame_hash)
+            else:
+                sim.simulate(decoded_instructions, False, self.enable_frame_hash)
+        except TimeoutError:
+            halted = False
+
+        return BatchResult(
+            job=job,
+            output_registers=list(sim.microcontroller_state.output_registers),
+            cycle_count=sim.cycle_count,
+            halted=halted,
+            frame_hash=sim.igpu_sim.hexdigest() if self.enable_frame_hash else None,
+        )
+
+    @staticmethod
+    def print_results(results: list[BatchResult]):
+        for result in results:
+            print(str(result.job.binary_file) + ", slope: " + str(result.job.input_slope) +
+                  ", initial: " + str(result.job.input_initial) +
+                  ", outputs: " + str(result.output_registers) +
+                  ", cycles: " + str(result.cycle_count) + ("" if result.halted else " (timeout)") +
+                  (", frames: " + result.frame_hash if result.frame_hash else ""))
+
+
 @click.command()
 @click.option('--binary', '-b', help='Name of the binary file')
 @click.option('--assembly', '-a', help='Name of the assembly file')
 @click.option('--verbose', '-v', is_flag=True, show_default=True, default=False, help="Print out state information")
 @click.option('--enable-igpu-sim', '-g', is_flag=True, show_default=True, default=False, help="Enable igpu sim")
-def main(binary, assembly, verbose, enable_igpu_sim):
+@click.option('--engine', '-e', type=click.Choice(ENGINES), show_default=True, default=INTERPRETER_ENGINE,
+              help="Execution engine, the block engine does not support verbose output, the lockstep engine only runs batches")
+@click.option('--input-slope', '-s', type=int, multiple=True,
+              help="Run a batch with one job per linear input slope, the igpu sim is replaced by frame hashes")
+@click.option('--input-initial', '-i', type=int, show_default=True, default=DEFAULT_INPUT_INITIAL,
+              help="Initial value of the linear input")
+@click.option('--input-config', '-c', help="Json file with the input source of each input channel")
+@click.option('--workers', '-w', type=int, default=None, help="Number of batch worker processes")
+@click.option('--profile', '-p', is_flag=True, show_default=True, default=False,
+              help="Report the cycles per function and the hottest lines, needs the assembly file")
+@click.option('--collapsed-stacks', help="Write the profile as collapsed stacks for flamegraph tools to this file")
+@click.option('--trace', '-t', help="Record a binary execution trace to this file")
+@click.option('--trace-sample', type=int, show_default=True, default=1, help="Record every nth cycle of the trace")
+@click.option('--trace-start', type=int, show_default=True, default=0, help="First cycle of the trace")
+@click.option('--trace-end', type=int, default=None, help="Cycle the trace stops at")
+@click.option('--cache', 'use_cache', is_flag=True, show_default=True, default=False,
+              help="Only compile the functions of the assembly file that changed since the last cached compile")
+@click.option('--optimize', '-O', is_flag=True, show_default=True, default=False,
+              help="Remove redundant instructions and jumps of the assembly file with the optimizer passes")
+@click.option('--inline-size', type=int, show_default=True, default=DEFAULT_INLINE_SIZE,
+              help="Inline the leaf functions up to this many instructions when optimizing")
+def main(binary, assembly, verbose, enable_igpu_sim, engine, input_slope, input_initial, input_config, workers,
+         profile, collapsed_stacks, trace, trace_sample, trace_start, trace_end, use_cache, optimize, inline_size):
+    if (profile or collapsed_stacks) and (binary or not assembly):
+        raise click.UsageError("Profiling needs the disassembler info, use --assembly instead of --binary.")
+
+    input_config = InputSim.load_config(input_config) if input_config else None
     if binary:
         binary_file_name = binary
-        factorio_microcontroller_sim = FactorioMicrocontrollerSim(binary_file_name)
+        factorio_microcontroller_sim = FactorioMicrocontrollerSim(binary_file_name, input_config=input_config)
     else:
-        compiler = AssemblyCompiler()
+        compiler = AssemblyCompiler(CompileCache() if use_cache else None, optimize, inline_size)
         binary_file_name, disassembler_info = compiler.compile(assembly)
-        factorio_microcontroller_sim = FactorioMicrocontrollerSim(binary_file_name, disassembler_info)
+        factorio_microcontroller_sim = FactorioMicrocontrollerSim(binary_file_name, disassembler_info, input_config)
+
+    if input_slope:
+        jobs = [BatchJob(binary_file_name, slope, input_initial, input_config) for slope in input_slope]
+        BatchSim.print_results(BatchSim(engine, enable_igpu_sim, workers).run(jobs))
+        return
+
+    if trace:
+        factorio_microcontroller_sim.trace_recorder = TraceRecorder(trace, trace_sample, trace_start, trace_end)
 
-    factorio_microcontroller_sim.run(verbose, enable_igpu_sim)
+    profile = profile or bool(collapsed_stacks)
+    try:
+        factorio_microcontroller_sim.run(verbose, enable_igpu_sim, engine, profile)
+    finally:
+        # the profiler is missing when run failed before it was created, that error is the one to report
+        if collapsed_stacks and factorio_microcontroller_sim.cycle_profiler:
+            factorio_microcontroller_sim.cycle_profiler.write_collapsed_stacks(collapsed_stacks)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 
 from simulator.constants import SCREEN_SIZE
+from simulator.decoded_instruction import DecodedInstruction
 from simulator.microcontroller_state import MicrocontrollerState
 
 
@@ -14,37 +15,91 @@ class InputArgs:
 
 class IGPUInstructionExecutor:
     @staticmethod
-    def execute_operation(opcode: str, literal: int, state: MicrocontrollerState):
-        active_buffer = state.igpu_state.buffer1 if state.igpu_state.status_flag % 2 == 0 else state.igpu_state.buffer2
-        input_value = state.read_f_memory(literal) if opcode[-1] == 'F' else literal
-        input_args = IGPUInstructionExecutor.get_input_args(input_value)
+    def decode_operation(instruction: DecodedInstruction):
+        opcode = instruction.opcode
+        instruction.load = 'F' if opcode[-1] == 'F' else 'L'
 
         if 'IGRENDER' in opcode:
-            state.igpu_state.screen_buffer = [
-                state.igpu_state.buffer1[i] | state.igpu_state.buffer2[i] for i in range(SCREEN_SIZE)
-            ]
+            instruction.handler = IGPUInstructionExecutor.execute_render
         elif 'IGCLEAR' in opcode:
-            for i in range(SCREEN_SIZE):
-                active_buffer[i] = 0
+            instruction.handler = IGPUInstructionExecutor.execute_clear
         elif 'IGSETF' in opcode:
-            state.igpu_state.status_flag = input_value  # TODO later have to fix if multiple flags
+            instruction.handler = IGPUInstructionExecutor.execute_set_flag
         elif 'IGDRAWP' in opcode:
-            active_buffer[input_args.x] = active_buffer[input_args.x] | (1 << input_args.y)
+            instruction.handler = IGPUInstructionExecutor.execute_draw_point
         elif 'IGDRAWR' in opcode:
-            for x in range(input_args.x, input_args.a + 1):
-                active_buffer[x] = active_buffer[x] | ((1 << (input_args.b + 1)) - (1 << input_args.y))
+            instruction.handler = IGPUInstructionExecutor.execute_draw_rectangle
         elif 'IGDRAWH' in opcode:
-            for x in range(input_args.x, input_args.x + input_args.b):
-                active_buffer[x] = active_buffer[x] | (1 << input_args.y)
+            instruction.handler = IGPUInstructionExecutor.execute_draw_horizontal
         elif 'IGDRAWV' in opcode:
-            active_buffer[input_args.x] = active_buffer[input_args.x] | (
-                    ((1 << (input_args.b + 1)) - 1) << input_args.y
-            )
+            instruction.handler = IGPUInstructionExecutor.execute_draw_vertical
         else:
-            raise Exception("Unknown igpu operation: " + opcode)
+            instruction.handler = IGPUInstructionExecutor.execute_unknown
 
+    @staticmethod
+    def execute_render(instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.igpu_state.screen_buffer = [
+            state.igpu_state.buffer1[i] | state.igpu_state.buffer2[i] for i in range(SCREEN_SIZE)
+        ]
+        state.program_counter += 1
+
+    @staticmethod
+    def execute_clear(instruction: DecodedInstruction, state: MicrocontrollerState):
+        active_buffer = IGPUInstructionExecutor.get_active_buffer(state)
+        for i in range(SCREEN_SIZE):
+            active_buffer[i] = 0
+        state.program_counter += 1
+
+    @staticmethod
+    def execute_set_flag(instruction: DecodedInstruction, state: MicrocontrollerState):
+        # TODO later have to fix if multiple flags
+        state.igpu_state.status_flag = IGPUInstructionExecutor.get_input_value(instruction, state)
+        state.program_counter += 1
+
+    @staticmethod
+    def execute_draw_point(instruction: DecodedInstruction, state: MicrocontrollerState):
+        active_buffer = IGPUInstructionExecutor.get_active_buffer(state)
+        input_args = IGPUInstructionExecutor.get_input_args(IGPUInstructionExecutor.get_input_value(instruction, state))
+        active_buffer[input_args.x] = active_buffer[input_args.x] | (1 << input_args.y)
+        state.program_counter += 1
+
+    @staticmethod
+    def execute_draw_rectangle(instruction: DecodedInstruction, state: MicrocontrollerState):
+        active_buffer = IGPUInstructionExecutor.get_active_buffer(state)
+        input_args = IGPUInstructionExecutor.get_input_args(IGPUInstructionExecutor.get_input_value(instruction, state))
+        for x in range(input_args.x, input_args.a + 1):
+            active_buffer[x] = active_buffer[x] | ((1 << (input_args.b + 1)) - (1 << input_args.y))
         state.program_counter += 1
 
+    @staticmethod
+    def execute_draw_horizontal(instruction: DecodedInstruction, state: MicrocontrollerState):
+        active_buffer = IGPUInstructionExecutor.get_active_buffer(state)
+        input_args = IGPUInstructionExecutor.get_input_args(IGPUInstructionExecutor.get_input_value(instruction, state))
+        for x in range(input_args.x, input_args.x + input_args.b):
+            active_buffer[x] = active_buffer[x] | (1 << input_args.y)
+        state.program_counter += 1
+
+    @staticmethod
+    def execute_draw_vertical(instruction: DecodedInstruction, state: MicrocontrollerState):
+        active_buffer = IGPUInstructionExecutor.get_active_buffer(state)
+        input_args = IGPUInstructionExecutor.get_input_args(IGPUInstructionExecutor.get_input_value(instruction, state))
+        active_buffer[input_args.x] = active_buffer[input_args.x] | (
+                ((1 << (input_args.b + 1)) - 1) << input_args.y
+        )
+        state.program_counter += 1
+
+    @staticmethod
+    def execute_unknown(instruction: DecodedInstruction, state: MicrocontrollerState):
+        raise Exception("Unknown igpu operation: " + instruction.opcode)
+
+    @staticmethod
+    def get_active_buffer(state: MicrocontrollerState):
+        return state.igpu_state.buffer1 if state.igpu_state.status_flag % 2 == 0 else state.igpu_state.buffer2
+
+    @staticmethod
+    def get_input_value(instruction: DecodedInstruction, state: MicrocontrollerState):
+        return state.read_f_memory(instruction.literal) if instruction.load == 'F' else instruction.literal
+
     @staticmethod
     def get_input_args(literal):
         return InputArgs(
@@ -1,54 +1,91 @@
+import hashlib
 from pathlib import Path
 
-from simulator.constants import SCREEN_SIZE
-from simulator.igpu_state import IGPUState
+import numpy as np
 from PIL import Image
-import imageio
 
-IMAGES_FOLDER = Path(__file__).parent / "screen_images"
+from simulator.constants import SCREEN_HEIGHT, INSTRUCTION_DURATION
+
+SCREEN_COLUMN_MASK = (1 << SCREEN_HEIGHT) - 1
+# top row of the image is the highest bit of a column
+ROW_SHIFTS = np.arange(SCREEN_HEIGHT - 1, -1, -1, dtype=np.uint64)[:, np.newaxis]
+FRAME_BATCH_SIZE = 64
+PIXEL_SIZE = 4
 
 
 class IGPUSim:
-    def __init__(self):
-        self.igpu_states: list[IGPUState] = []
+    def __init__(self, gif_file_name="screen.gif"):
+        self.gif_file_name = gif_file_name
 
-    def add_state(self, state: IGPUState):
-        self.igpu_states.append(state)
+        # the last frame is held back until the next one arrives, that is when its duration is known
+        self.last_frame: tuple[int, list[int]] | None = None
+        # only the screen buffers are kept, the images are rendered per batch while the gif is saved
+        self.screen_buffers: list[list[int]] = []
+        self.frame_durations: list[int] = []
 
-    def run(self):
-        total_states = len(self.igpu_states)
-        print("\nCreating gif ...")
-        size = 4
+    def add_frame(self, cycle, screen_buffer):
+        if self.last_frame is not None:
+            last_cycle, last_screen_buffer = self.last_frame
+            if last_screen_buffer == screen_buffer:
+                return
+            if last_cycle != cycle:
+                self.add_screen_buffer(last_screen_buffer, cycle - last_cycle)
 
-        with imageio.get_writer("screen.gif", mode='I', duration=15) as writer:
-            for i, state in enumerate(self.igpu_states):
-                # TODO make a input arg?
-                if i % 10 != 0 and i != len(self.igpu_states) - 1:
-                    continue
+        self.last_frame = (cycle, list(screen_buffer))
 
-                if i % 1000 == 0:
-                    print("Processed: " + str(i) + "/" + str(total_states))
-                image = self.get_image_from_buffer(state.screen_buffer)
-                writer.append_data(image.convert('P').resize((size*SCREEN_SIZE, size*32)))
+    def add_screen_buffer(self, screen_buffer, cycles):
+        # gif frame durations are in milliseconds
+        self.frame_durations.append(max(round(cycles * INSTRUCTION_DURATION * 1000), 1))
+        self.screen_buffers.append(screen_buffer)
 
-        image = self.get_image_from_buffer(state.screen_buffer)
-        image.save(IMAGES_FOLDER / "screen_end.png")
+    def get_images(self):
+        for start in range(0, len(self.screen_buffers), FRAME_BATCH_SIZE):
+            frames = self.get_binary_frames(self.screen_buffers[start:start + FRAME_BATCH_SIZE]).astype(np.uint8) * 255
+            frames = frames.repeat(PIXEL_SIZE, axis=1).repeat(PIXEL_SIZE, axis=2)
+            for frame in frames:
+                yield Image.fromarray(frame)
+            print("Processed: " + str(min(start + FRAME_BATCH_SIZE, len(self.screen_buffers))) + "/" +
+                  str(len(self.screen_buffers)) + " frames")
+
+    def run(self, end_cycle):
+        if self.last_frame is None:
+            return
+
+        last_cycle, last_screen_buffer = self.last_frame
+        self.add_screen_buffer(last_screen_buffer, end_cycle - last_cycle)
+
+        print("\nCreating gif ...")
+        images = self.get_images()
+        next(images).save(self.gif_file_name, save_all=True, append_images=images, duration=self.frame_durations,
+                          loop=0)
+
+        # the last screen is saved next to the gif
+        image = self.get_image_from_buffer(last_screen_buffer)
+        image.save(Path(self.gif_file_name).parent / "screen_end.png")
 
         print("Done")
 
-    def get_binary_array_from_buffer(self, buffer):
-        binary_array = [[0 for _ in range(SCREEN_SIZE)] for _ in range(32)]
-        for x, value in enumerate(buffer):
-            binary_string = bin(value)[:1:-1]
-            for y, bit in enumerate(binary_string):
-                binary_array[y][x] = int(bit)
-        return binary_array
+    @staticmethod
+    def get_binary_frames(screen_buffers) -> np.ndarray:
+        columns = np.array([[value & SCREEN_COLUMN_MASK for value in screen_buffer]
+                            for screen_buffer in screen_buffers], dtype=np.uint64)
+        return ((columns[:, np.newaxis, :] >> ROW_SHIFTS) & 1).astype(bool)
 
     def get_image_from_buffer(self, buffer):
-        binary_array = self.get_binary_array_from_buffer(buffer)
+        return Image.fromarray(self.get_binary_frames([buffer])[0])
+
+
+class FrameHasher:
+    # keeps the same distinct frames as the igpu sim, but only as a running hash so batch runs can compare screens
+    def __init__(self):
+        self.hash = hashlib.sha1()
+        self.last_screen_buffer = None
 
-        image = Image.new("1", (SCREEN_SIZE, 32))
-        pixels = [1 if pixel == 1 else 0 for row in binary_array[::-1] for pixel in row]
+    def add_frame(self, cycle, screen_buffer):
+        if self.last_screen_buffer == screen_buffer:
+            return
+        self.last_screen_buffer = list(screen_buffer)
+        self.hash.update((str(cycle) + ":" + ",".join(str(value) for value in screen_buffer) + ";").encode())
 
-        image.putdata(pixels)
-        return image
+    def hexdigest(self):
+        return self.hash.hexdigest()
@@ -1,17 +1,20 @@
-from dataclasses import dataclass
-
 from simulator.constants import SCREEN_SIZE
 
 
-@dataclass()
 class IGPUState:
-    buffer1: list
-    buffer2: list
-    screen_buffer: list
-    status_flag: int
+    __slots__ = ("buffer1", "buffer2", "screen_buffer", "status_flag")
 
     def __init__(self):
         self.buffer1 = [0 for _ in range(SCREEN_SIZE)]
         self.buffer2 = [0 for _ in range(SCREEN_SIZE)]
         self.screen_buffer = [0 for _ in range(SCREEN_SIZE)]
         self.status_flag = 0
+
+    def snapshot(self) -> tuple:
+        return self.buffer1[:], self.buffer2[:], self.screen_buffer[:], self.status_flag
+
+    def restore(self, snapshot: tuple):
+        buffer1, buffer2, screen_buffer, self.status_flag = snapshot
+        self.buffer1[:] = buffer1
+        self.buffer2[:] = buffer2
+        self.screen_buffer[:] = screen_buffer
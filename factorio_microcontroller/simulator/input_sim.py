@@ -1,4 +1,99 @@
+import json
+import os
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from simulator.instruction_executor import wrap_int32
+
+LINEAR_INPUT = "linear"
+RANDOM_INPUT = "random"
+EXPONENTIAL_INPUT = "exponential"
+STEP_INPUT = "step"
+TRACE_INPUT = "trace"
+
+INPUT_CHANNELS = ["1", "2"]
+DEFAULT_INPUT_CONFIG = {
+    "1": {"type": LINEAR_INPUT, "slope": 2, "initial": 0},
+    "2": {"type": LINEAR_INPUT, "slope": 0, "initial": 0},
+}
+
+SIGNAL_MIN = -(1 << 31)
+SIGNAL_MAX = (1 << 31) - 1
+
+
 class InputSim:
     @staticmethod
     def get_linear_input(cycle, slope, initial):
-        return slope * cycle + initial
+        return wrap_int32(slope * cycle + initial)
+
+    @staticmethod
+    def get_linear_config(slope, initial):
+        return {"type": LINEAR_INPUT, "slope": slope, "initial": initial}
+
+    @staticmethod
+    def load_config(file_name) -> dict:
+        with open(file_name) as f:
+            input_config = json.load(f)
+
+        # trace files are relative to the config file
+        for source in input_config.values():
+            if source["type"] == TRACE_INPUT:
+                source["file"] = str(Path(file_name).parent / source["file"])
+        return input_config
+
+    @staticmethod
+    def get_input_streams(input_config: dict, length) -> list[array]:
+        return [InputSim.get_input_stream(input_config.get(channel, DEFAULT_INPUT_CONFIG[channel]), length)
+                for channel in INPUT_CHANNELS]
+
+    @staticmethod
+    def get_input_stream(source: dict, length) -> array:
+        # the sim looks inputs up by cycle, an array of python ints avoids numpy scalars in the registers
+        input_stream = array('q', bytes(8 * length))
+        np.frombuffer(input_stream, dtype=np.int64)[:] = InputSim.get_input_values(source, length)
+        return input_stream
+
+    @staticmethod
+    def get_input_values(source: dict, length) -> np.ndarray:
+        cycles = np.arange(length, dtype=np.int64)
+        input_type = source["type"]
+
+        if input_type == LINEAR_INPUT:
+            # the input is a signal, it wraps to 32 bits like in the lockstep engine
+            return wrap_int32(source.get("slope", 0) * cycles + source.get("initial", 0))
+        elif input_type == RANDOM_INPUT:
+            generator = np.random.default_rng(source.get("seed", 0))
+            return generator.integers(source.get("min", 0), source.get("max", 100), size=length, endpoint=True)
+        elif input_type == EXPONENTIAL_INPUT:
+            # grows past any signal quickly, so it is clipped to the signal range
+            with np.errstate(over='ignore'):
+                values = source.get("initial", 1) * np.power(float(source.get("growth", 2)),
+                                                             cycles / source.get("period", 1))
+            return np.clip(np.round(values), SIGNAL_MIN, SIGNAL_MAX)
+        elif input_type == STEP_INPUT:
+            return wrap_int32(source.get("initial", 0) + source.get("height", 1) * (cycles // source.get("period", 1)))
+        elif input_type == TRACE_INPUT:
+            return InputSim.get_trace_values(source["file"], length)
+        else:
+            raise Exception("Unknown input type: " + str(input_type))
+
+    @staticmethod
+    def get_trace_values(file_name, length) -> np.ndarray:
+        # traces are memory mapped and only the cycles that can be simulated are read
+        if str(file_name).endswith(".npy"):
+            trace = np.load(file_name, mmap_mode='r')
+        elif os.path.getsize(file_name) > 0:
+            trace = np.memmap(file_name, dtype='<i4', mode='r')
+        else:
+            trace = []
+        if len(trace) == 0:
+            raise ValueError("Input trace has no values: " + str(file_name))
+
+        values = np.empty(length, dtype=np.int64)
+        count = min(length, len(trace))
+        values[:count] = trace[:count]
+        # the last recorded value is held after the trace ends
+        values[count:] = trace[count - 1]
+        return values
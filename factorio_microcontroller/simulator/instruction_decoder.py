@@ -1,11 +1,20 @@
 import json
+from functools import cache
 from pathlib import Path
 
+from simulator.decoded_instruction import DecodedInstruction
+from simulator.instruction_executor import InstructionExecutor
+
 RESOURCE_FOLDER = Path(__file__).parent.parent.parent / "resources"
 
+# an instruction word is a 24 bit literal followed by an 8 bit opcode
+OPCODE_BITS = 8
+OPCODE_MASK = (1 << OPCODE_BITS) - 1
+
 
 class InstructionDecoder:
     @staticmethod
+    @cache
     def load_opcode_map():
         with open(RESOURCE_FOLDER / "opcodes.json") as opcode_file:
             opcodes = json.loads(opcode_file.read())
@@ -23,15 +32,18 @@ class InstructionDecoder:
         return {v: k for k, v in opcodes_expanded.items()}
 
     @staticmethod
-    def decode_all_instructions(binary):
+    def decode_all_instructions(binary: list[int], instruction_executor: InstructionExecutor) -> list[DecodedInstruction]:
         opcode_map = InstructionDecoder.load_opcode_map()
 
+        # the handlers do not change decoded instructions, so repeated words share one
+        decoded_words: dict[int, DecodedInstruction] = dict()
         decoded_instructions = []
-        for instruction in binary:
-            literal_binary = instruction[:24]
-            opcode_binary = instruction[24:]
-
-            literal = int(literal_binary, 2)
-            opcode = opcode_map[int(opcode_binary, 2)]
-            decoded_instructions.append((opcode, literal))
+        for word in binary:
+            decoded_instruction = decoded_words.get(word)
+            if decoded_instruction is None:
+                literal = word >> OPCODE_BITS
+                opcode = opcode_map[word & OPCODE_MASK]
+                decoded_instruction = instruction_executor.decode(opcode, literal)
+                decoded_words[word] = decoded_instruction
+            decoded_instructions.append(decoded_instruction)
         return decoded_instructions
@@ -1,5 +1,7 @@
+import operator
 import re
 
+from simulator.decoded_instruction import DecodedInstruction
 from simulator.igpu_instruction_executor import IGPUInstructionExecutor
 from simulator.microcontroller_state import MicrocontrollerState
 
@@ -26,192 +28,263 @@ IGPU_OPERATIONS = [
 ]
 
 
+INT32_OFFSET = 1 << 31
+UINT32_MASK = (1 << 32) - 1
+
+
+def wrap_int32(values):
+    # the combinators calculate with signed 32 bit ints, works on ints and numpy arrays
+    return ((values + INT32_OFFSET) & UINT32_MASK) - INT32_OFFSET
+
+
+# dividing by zero gives 0 like the arithmetic combinators, in every engine
+def divide(input_a, input_b):
+    return int(input_a / input_b) if input_b else 0
+
+
+def modulo(input_a, input_b):
+    return int(input_a % input_b) if input_b else 0
+
+
+def increment(_, input_b):
+    return input_b + 1
+
+
+def decrement(_, input_b):
+    return input_b - 1
+
+
+def rotate_left_once(_, input_b):
+    return input_b << 1
+
+
+def rotate_right_once(_, input_b):
+    return input_b >> 1
+
+
 class InstructionExecutor:
-    def execute(self, opcode: str, literal: int, state: MicrocontrollerState):
+    def decode(self, opcode: str, literal: int) -> DecodedInstruction:
+        instruction = DecodedInstruction(opcode, literal)
+
         if opcode == 'HALT':
-            if literal == 1:
-                state.program_counter += 1
-                return False
-            else:
-                return True
+            instruction.handler = self.execute_halt
 
-        if any(alu_op in opcode for alu_op in ALU_OPERATIONS):
-            self.execute_alu_operation(opcode, literal, state)
+        elif any(alu_op in opcode for alu_op in ALU_OPERATIONS):
+            self.decode_alu_operation(instruction)
 
         elif any(branching_op in opcode for branching_op in BRANCHING_OPERATIONS):
-            self.execute_branching_operation(opcode, literal, state)
+            self.decode_branching_operation(instruction)
 
         elif any(other_op in opcode for other_op in OTHER_OPERATIONS):
-            self.execute_other_operation(opcode, literal, state)
+            instruction.handler = self.execute_other_operation
 
         elif 'MOV' in opcode or opcode == 'VAR':
-            self.execute_memory_operation(opcode, literal, state)
+            self.decode_memory_operation(instruction)
 
         elif 'WOUT' in opcode:
-            self.execute_output_operation(opcode, literal, state)
+            opcode_split = opcode.split(',')
+            instruction.io_index = int(opcode_split[1]) - 1
+            instruction.load = opcode_split[0][-1]
+            instruction.handler = self.execute_output_operation
 
         elif 'RIN' in opcode:
-            self.execute_input_operation(opcode, literal, state)
+            opcode_split = opcode.split(',')
+            instruction.io_index = int(opcode_split[1]) - 1
+            instruction.store = opcode_split[0][-1]
+            instruction.handler = self.execute_input_operation
 
         elif any(igpu_op in opcode for igpu_op in IGPU_OPERATIONS):
-            IGPUInstructionExecutor.execute_operation(opcode, literal, state)
+            IGPUInstructionExecutor.decode_operation(instruction)
 
         else:
             raise Exception("Unknown instruction: " + opcode)
 
-        return False
+        return instruction
 
-    def execute_other_operation(self, opcode: str, literal: int, state: MicrocontrollerState):
-        if opcode == 'NOP':
-            pass
-        elif opcode == 'PULSE':
-            pass
+    def execute(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        return bool(instruction.handler(instruction, state))
 
-        state.program_counter += 1
+    def execute_halt(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        if instruction.literal == 1:
+            state.program_counter += 1
+            return False
+        else:
+            return True
 
-    def execute_output_operation(self, opcode: str, literal: int, state: MicrocontrollerState):
-        opcode_split = opcode.split(',')
-        output_index = int(opcode_split[1]) - 1
-        load = opcode_split[0][-1]
+    def execute_other_operation(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.program_counter += 1
 
-        if load == 'L':
-            state.output_registers[output_index] = literal
-        elif load == 'W':
-            state.output_registers[output_index] = state.w_register
+    def execute_output_operation(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        if instruction.load == 'L':
+            state.output_registers[instruction.io_index] = instruction.literal
+        elif instruction.load == 'W':
+            state.output_registers[instruction.io_index] = state.w_register
         else:
-            state.output_registers[output_index] = state.read_f_memory(literal)
+            state.output_registers[instruction.io_index] = state.f_memory[state.frame_base + instruction.literal]
 
         state.program_counter += 1
 
-    def execute_input_operation(self, opcode: str, literal: int, state: MicrocontrollerState):
-        opcode_split = opcode.split(',')
-        input_index = int(opcode_split[1]) - 1
-        store = opcode_split[0][-1]
-        address = literal
-        value = state.input_values[input_index]
+    def execute_input_operation(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        value = state.input_values[instruction.io_index]
 
-        self.store_at_location(store, address, value, state)
+        if instruction.store == 'F':
+            state.f_memory[state.frame_base + instruction.literal] = value
+        else:
+            state.w_register = value
         state.program_counter += 1
 
-    def execute_branching_operation(self, opcode: str, literal: int, state: MicrocontrollerState):
+    def decode_branching_operation(self, instruction: DecodedInstruction):
+        opcode = instruction.opcode
         if any(conditional_op in opcode for conditional_op in ["GRT", "LESS", "EQ"]):
-            input_a = state.w_register
-
             opcode_split = re.split(r'(\d+)', opcode)
-            if opcode_split[0][-1] == 'F':
-                input_b = state.read_f_memory(literal)
-            else:
-                input_b = literal
+            instruction.load = 'F' if opcode_split[0][-1] == 'F' else 'L'
+            instruction.skip_count = int(opcode_split[1])
 
-            skip = False
             if 'GRT' in opcode:
-                if not (input_a > input_b):
-                    skip = True
+                instruction.operation = operator.gt
             elif 'LESS' in opcode:
-                if not (input_a < input_b):
-                    skip = True
+                instruction.operation = operator.lt
             elif 'EQ' in opcode:
-                if not (input_a == input_b):
-                    skip = True
+                instruction.operation = operator.eq
             else:
                 raise Exception("Unknown branching operation.")
-
-            if skip:
-                skip_count = int(opcode_split[1])
-                state.program_counter += skip_count + 2
-            else:
-                state.program_counter += 1
+            instruction.handler = self.execute_conditional_operation
 
         elif opcode == 'CALL':
-            state.function_call_stack.append(state.program_counter + 1)
-            state.variable_scope_stack.append(state.variable_scope_stack[-1] +
-                                              state.variable_offset)
-            state.program_counter = literal
+            instruction.handler = self.execute_call
 
         elif opcode == 'GOTO':
-            state.program_counter = literal
+            instruction.handler = self.execute_goto
 
         elif 'RET' in opcode:
             if opcode == 'RETLW':
-                state.w_register = literal
+                instruction.load = 'L'
             elif opcode == 'RETFW':
-                state.w_register = state.read_f_memory(literal)
+                instruction.load = 'F'
             elif opcode == 'RET':
-                pass
+                instruction.load = 'W'
             else:
                 raise Exception("Unknown return operation.")
+            instruction.handler = self.execute_return
 
-            state.program_counter = state.function_call_stack.pop()
-            state.variable_scope_stack.pop()
+    def execute_conditional_operation(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        if instruction.load == 'F':
+            input_b = state.f_memory[state.frame_base + instruction.literal]
+        else:
+            input_b = instruction.literal
 
-    def execute_memory_operation(self, opcode: str, literal: int, state: MicrocontrollerState):
-        if opcode == 'VAR':
-            state.variable_offset = literal
+        if instruction.operation(state.w_register, input_b):
             state.program_counter += 1
+        else:
+            state.program_counter += instruction.skip_count + 2
+
+    def execute_call(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.function_call_stack.append(state.program_counter + 1)
+        state.push_scope()
+        state.program_counter = instruction.literal
+
+    def execute_goto(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.program_counter = instruction.literal
+
+    def execute_return(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        if instruction.load == 'L':
+            state.w_register = instruction.literal
+        elif instruction.load == 'F':
+            state.w_register = state.f_memory[state.frame_base + instruction.literal]
+
+        state.program_counter = state.function_call_stack.pop()
+        state.pop_scope()
+
+    def decode_memory_operation(self, instruction: DecodedInstruction):
+        opcode = instruction.opcode
+        if opcode == 'VAR':
+            instruction.handler = self.execute_var
             return
 
-        elif opcode == 'MOVLW':
-            store = 'W'
-            address = 0
-            value = literal
+        if opcode == 'MOVLW':
+            instruction.handler = self.execute_move_literal_to_w
         elif opcode == 'MOVWF':
-            store = 'F'
-            address = literal
-            value = state.w_register
+            instruction.handler = self.execute_move_w_to_f
         elif opcode == 'MOVFW':
-            store = 'W'
-            address = literal
-            value = state.read_f_memory(address)
+            instruction.handler = self.execute_move_f_to_w
         elif opcode == 'MOVLF':
-            store = 'F'
-            address = state.w_register
-            value = literal
+            instruction.handler = self.execute_move_literal_to_f
         else:
             raise Exception("Unknown memory operation.")
 
-        self.store_at_location(store, address, value, state)
+        instruction.load = opcode[3]
+        instruction.store = opcode[4]
+
+    def execute_var(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.variable_offset = instruction.literal
         state.program_counter += 1
 
-    def execute_alu_operation(self, opcode: str, literal: int, state: MicrocontrollerState):
-        store, load = self.get_alu_load_and_store_location(opcode)
+    def execute_move_literal_to_w(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.w_register = instruction.literal
+        state.program_counter += 1
 
-        input_a = state.w_register
-        input_b = self.load_from_location(load, literal, state)
+    def execute_move_w_to_f(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.f_memory[state.frame_base + instruction.literal] = state.w_register
+        state.program_counter += 1
+
+    def execute_move_f_to_w(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.w_register = state.f_memory[state.frame_base + instruction.literal]
+        state.program_counter += 1
+
+    def execute_move_literal_to_f(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        state.f_memory[state.frame_base + state.w_register] = instruction.literal
+        state.program_counter += 1
+
+    def decode_alu_operation(self, instruction: DecodedInstruction):
+        opcode = instruction.opcode
+        store, load = self.get_alu_load_and_store_location(opcode)
 
         if 'ADD' in opcode:
-            result = input_a + input_b
+            operation = operator.add
         elif 'SUB' in opcode:
-            result = input_a - input_b
+            operation = operator.sub
         elif 'MUL' in opcode:
-            result = input_a * input_b
+            operation = operator.mul
         elif 'DIV' in opcode:
-            result = int(input_a / input_b)
+            operation = divide
         elif 'MOD' in opcode:
-            result = int(input_a % input_b)
+            operation = modulo
         elif 'INCR' in opcode:
-            result = state.read_f_memory(literal) + 1
+            operation = increment
+            load = 'F'
             store = 'F'
         elif 'DECR' in opcode:
-            result = state.read_f_memory(literal) - 1
+            operation = decrement
+            load = 'F'
             store = 'F'
         elif 'ROL' in opcode:
-            if load == 'F':
-                result = input_b << 1
-            else:
-                result = input_a << input_b
+            operation = rotate_left_once if load == 'F' else operator.lshift
         elif 'ROR' in opcode:
-            if load == 'F':
-                result = input_b >> 1
-            else:
-                result = input_a >> input_b
+            operation = rotate_right_once if load == 'F' else operator.rshift
         elif 'AND' in opcode:
-            result = input_a & input_b
+            operation = operator.and_
         elif 'OR' in opcode:
-            result = input_a | input_b
+            operation = operator.or_
         else:
             raise Exception("Unknown alu operation: " + opcode)
 
-        self.store_at_location(store, literal, result, state)
+        instruction.load = load
+        instruction.store = store
+        instruction.operation = operation
+        instruction.handler = self.execute_alu_operation
+
+    def execute_alu_operation(self, instruction: DecodedInstruction, state: MicrocontrollerState):
+        if instruction.load == 'F':
+            input_b = state.f_memory[state.frame_base + instruction.literal]
+        else:
+            input_b = instruction.literal
+
+        result = wrap_int32(instruction.operation(state.w_register, input_b))
+
+        if instruction.store == 'F':
+            state.f_memory[state.frame_base + instruction.literal] = result
+        else:
+            state.w_register = result
         state.program_counter += 1
 
     def get_alu_load_and_store_location(self, opcode):
@@ -223,22 +296,4 @@ class InstructionExecutor:
             store = 'W'
             load = 'L'
 
-        return store, load
-
-    def load_from_location(self, location, literal, state):
-        if location.upper() == 'F':
-            value = state.read_f_memory(literal)
-        elif location.upper() == 'L':
-            value = literal
-        else:
-            raise Exception("Invalid load location: " + location)
-
-        return value
-
-    def store_at_location(self, location, address, value, state):
-        if location.upper() == 'F':
-            state.write_f_memory(address, value)
-        elif location.upper() == 'W':
-            state.w_register = value
-        else:
-            raise Exception("Invalid store location: " + location)
+        return store.upper(), load.upper()
@@ -0,0 +1,260 @@
+import operator
+
+import numpy as np
+
+from simulator.constants import MEMORY_SIZE, SCREEN_SIZE
+from simulator.decoded_instruction import DecodedInstruction
+from simulator.instruction_executor import divide, modulo, wrap_int32, UINT32_MASK
+
+CALL_STACK_SIZE = 64
+
+SCREEN_COLUMNS = np.arange(SCREEN_SIZE)
+
+
+def divide_vector(input_a, input_b):
+    # truncates towards zero like int(a / b), dividing by zero gives 0 like the game
+    divisor = np.where(input_b == 0, 1, input_b)
+    quotient = np.abs(input_a) // np.abs(divisor)
+    return np.where(input_b == 0, 0, np.sign(input_a) * np.sign(divisor) * quotient)
+
+
+def modulo_vector(input_a, input_b):
+    divisor = np.where(input_b == 0, 1, input_b)
+    return np.where(input_b == 0, 0, np.mod(input_a, divisor))
+
+
+def shift_left_vector(input_a, input_b):
+    return np.left_shift(input_a, np.clip(input_b, 0, 63))
+
+
+def shift_right_vector(input_a, input_b):
+    return np.right_shift(input_a, np.clip(input_b, 0, 63))
+
+
+# the other alu operations from the instruction executor already work on arrays
+VECTOR_OPERATIONS = {
+    divide: divide_vector,
+    modulo: modulo_vector,
+    operator.lshift: shift_left_vector,
+    operator.rshift: shift_right_vector,
+}
+
+
+class LockstepSim:
+    def __init__(self, decoded_instructions: list[DecodedInstruction], input_slopes, input_initials=0):
+        self.decoded_instructions = decoded_instructions
+        self.input_slopes = np.asarray(input_slopes, dtype=np.int64)
+        self.input_initials = np.broadcast_to(np.asarray(input_initials, dtype=np.int64), self.input_slopes.shape)
+        instances = len(self.input_slopes)
+
+        self.instance_ids = np.arange(instances)
+        self.w_register = np.zeros(instances, dtype=np.int64)
+        # address major, so one address of every instance is contiguous, f_memory is the (N, MEMORY_SIZE) view
+        self.memory = np.zeros((MEMORY_SIZE, instances), dtype=np.int64)
+        self.f_memory = self.memory.T
+        self.program_counter = np.ones(instances, dtype=np.int64)
+        self.function_call_stack = np.zeros((instances, CALL_STACK_SIZE), dtype=np.int64)
+        self.variable_scope_stack = np.zeros((instances, CALL_STACK_SIZE + 1), dtype=np.int64)
+        self.stack_depth = np.zeros(instances, dtype=np.int64)
+        self.frame_base = np.zeros(instances, dtype=np.int64)
+        # most programs call the same functions in every instance, then memory is addressed with one frame base
+        self.uniform_frame_base = True
+        self.variable_offset = np.zeros(instances, dtype=np.int64)
+        self.output_registers = np.zeros((instances, 2), dtype=np.int64)
+        self.input_values = np.zeros((instances, 2), dtype=np.int64)
+
+        self.igpu_buffers = np.zeros((instances, 2, SCREEN_SIZE), dtype=np.int64)
+        self.screen_buffer = np.zeros((instances, SCREEN_SIZE), dtype=np.int64)
+        self.status_flag = np.zeros(instances, dtype=np.int64)
+
+        self.halted = np.zeros(instances, dtype=bool)
+        self.active_changed = False
+        self.cycle_count = np.zeros(instances, dtype=np.int64)
+
+        self.step_functions = [getattr(self, "step_" + instruction.handler.__name__[len("execute_"):])
+                               for instruction in decoded_instructions]
+
+    def run(self, max_cycles):
+        active_rows = np.flatnonzero(~self.halted)
+        cycle = 0
+        while active_rows.size and cycle < max_cycles:
+            # a slice instead of an index array when every instance is active, basic indexing is much faster
+            if active_rows.size == self.instance_ids.size:
+                rows = slice(None)
+                program_counters = self.program_counter
+            else:
+                rows = active_rows
+                program_counters = self.program_counter[rows]
+
+            # instances on the same instruction execute together, usually that is all of them
+            first_program_counter = program_counters[0]
+            if (program_counters == first_program_counter).all():
+                groups = [(first_program_counter, rows)]
+            else:
+                groups = [(program_counter, active_rows[program_counters == program_counter])
+                          for program_counter in np.unique(program_counters)]
+
+            self.active_changed = False
+            for program_counter, group in groups:
+                self.step_functions[program_counter - 1](self.decoded_instructions[program_counter - 1], group, cycle)
+
+            cycle += 1
+            if self.active_changed:
+                active_rows = active_rows[~self.halted[active_rows]]
+
+        self.cycle_count[active_rows] = cycle
+        return self
+
+    def read_memory(self, rows, address):
+        if self.uniform_frame_base:
+            return self.memory[self.frame_base[0] + address][rows]
+        return self.memory[self.frame_base[rows] + address, self.instance_ids[rows]]
+
+    def write_memory(self, rows, address, values):
+        if self.uniform_frame_base:
+            self.memory[self.frame_base[0] + address][rows] = values
+        else:
+            self.memory[self.frame_base[rows] + address, self.instance_ids[rows]] = values
+
+    def load(self, instruction: DecodedInstruction, rows):
+        if instruction.load == 'F':
+            return self.read_memory(rows, instruction.literal)
+        elif instruction.load == 'W':
+            return self.w_register[rows]
+        return instruction.literal
+
+    def store(self, instruction: DecodedInstruction, rows, values):
+        if instruction.store == 'F':
+            self.write_memory(rows, instruction.literal, values)
+        else:
+            self.w_register[rows] = values
+
+    def step_halt(self, instruction: DecodedInstruction, rows, cycle):
+        if instruction.literal == 1:
+            self.program_counter[rows] += 1
+        else:
+            self.halted[rows] = True
+            self.cycle_count[rows] = cycle + 1
+            self.active_changed = True
+
+    def step_other_operation(self, instruction: DecodedInstruction, rows, cycle):
+        self.program_counter[rows] += 1
+
+    def step_output_operation(self, instruction: DecodedInstruction, rows, cycle):
+        self.output_registers[rows, instruction.io_index] = self.load(instruction, rows)
+        self.program_counter[rows] += 1
+
+    def step_input_operation(self, instruction: DecodedInstruction, rows, cycle):
+        self.input_values[rows, 0] = wrap_int32(self.input_slopes[rows] * cycle + self.input_initials[rows])
+        self.store(instruction, rows, self.input_values[rows, instruction.io_index])
+        self.program_counter[rows] += 1
+
+    def step_conditional_operation(self, instruction: DecodedInstruction, rows, cycle):
+        condition = instruction.operation(self.w_register[rows], self.load(instruction, rows))
+        self.program_counter[rows] += np.where(condition, 1, instruction.skip_count + 2)
+
+    def step_call(self, instruction: DecodedInstruction, rows, cycle):
+        depth = self.stack_depth[rows]
+        if (depth >= CALL_STACK_SIZE).any():
+            raise Exception("Call stack overflow, the lockstep engine supports " + str(CALL_STACK_SIZE) + " calls.")
+
+        instance_ids = self.instance_ids[rows]
+        self.function_call_stack[instance_ids, depth] = self.program_counter[rows] + 1
+        self.frame_base[rows] += self.variable_offset[rows]
+        self.variable_scope_stack[instance_ids, depth + 1] = self.frame_base[rows]
+        self.stack_depth[rows] = depth + 1
+        self.program_counter[rows] = instruction.literal
+        self.update_uniform_frame_base()
+
+    def step_goto(self, instruction: DecodedInstruction, rows, cycle):
+        self.program_counter[rows] = instruction.literal
+
+    def step_return(self, instruction: DecodedInstruction, rows, cycle):
+        if instruction.load != 'W':
+            self.w_register[rows] = self.load(instruction, rows)
+
+        depth = self.stack_depth[rows] - 1
+        if (depth < 0).any():
+            raise IndexError("Return with an empty call stack.")
+        instance_ids = self.instance_ids[rows]
+        self.program_counter[rows] = self.function_call_stack[instance_ids, depth]
+        self.frame_base[rows] = self.variable_scope_stack[instance_ids, depth]
+        self.stack_depth[rows] = depth
+        self.update_uniform_frame_base()
+
+    def update_uniform_frame_base(self):
+        self.uniform_frame_base = bool((self.frame_base == self.frame_base[0]).all())
+
+    def step_var(self, instruction: DecodedInstruction, rows, cycle):
+        self.variable_offset[rows] = instruction.literal
+        self.program_counter[rows] += 1
+
+    def step_move_literal_to_w(self, instruction: DecodedInstruction, rows, cycle):
+        self.w_register[rows] = instruction.literal
+        self.program_counter[rows] += 1
+
+    def step_move_w_to_f(self, instruction: DecodedInstruction, rows, cycle):
+        self.write_memory(rows, instruction.literal, self.w_register[rows])
+        self.program_counter[rows] += 1
+
+    def step_move_f_to_w(self, instruction: DecodedInstruction, rows, cycle):
+        self.w_register[rows] = self.read_memory(rows, instruction.literal)
+        self.program_counter[rows] += 1
+
+    def step_move_literal_to_f(self, instruction: DecodedInstruction, rows, cycle):
+        # the address depends on W, so it is never uniform
+        self.memory[self.frame_base[rows] + self.w_register[rows], self.instance_ids[rows]] = instruction.literal
+        self.program_counter[rows] += 1
+
+    def step_alu_operation(self, instruction: DecodedInstruction, rows, cycle):
+        operation = VECTOR_OPERATIONS.get(instruction.operation, instruction.operation)
+        result = operation(self.w_register[rows], self.load(instruction, rows))
+        self.store(instruction, rows, wrap_int32(result))
+        self.program_counter[rows] += 1
+
+    def step_render(self, instruction: DecodedInstruction, rows, cycle):
+        self.screen_buffer[rows] = self.igpu_buffers[rows, 0] | self.igpu_buffers[rows, 1]
+        self.program_counter[rows] += 1
+
+    def step_clear(self, instruction: DecodedInstruction, rows, cycle):
+        self.igpu_buffers[self.instance_ids[rows], self.status_flag[rows] % 2] = 0
+        self.program_counter[rows] += 1
+
+    def step_set_flag(self, instruction: DecodedInstruction, rows, cycle):
+        self.status_flag[rows] = self.load(instruction, rows)
+        self.program_counter[rows] += 1
+
+    def step_draw_point(self, instruction: DecodedInstruction, rows, cycle):
+        x, y, a, b = self.get_input_args(instruction, rows)
+        self.draw(rows, SCREEN_COLUMNS == x[:, np.newaxis], 1 << y)
+
+    def step_draw_rectangle(self, instruction: DecodedInstruction, rows, cycle):
+        x, y, a, b = self.get_input_args(instruction, rows)
+        columns = (SCREEN_COLUMNS >= x[:, np.newaxis]) & (SCREEN_COLUMNS <= a[:, np.newaxis])
+        self.draw(rows, columns, (1 << np.minimum(b + 1, 63)) - (1 << y))
+
+    def step_draw_horizontal(self, instruction: DecodedInstruction, rows, cycle):
+        x, y, a, b = self.get_input_args(instruction, rows)
+        columns = (SCREEN_COLUMNS >= x[:, np.newaxis]) & (SCREEN_COLUMNS < (x + b)[:, np.newaxis])
+        self.draw(rows, columns, 1 << y)
+
+    def step_draw_vertical(self, instruction: DecodedInstruction, rows, cycle):
+        x, y, a, b = self.get_input_args(instruction, rows)
+        self.draw(rows, SCREEN_COLUMNS == x[:, np.newaxis], ((1 << np.minimum(b + 1, 63)) - 1) << y)
+
+    def step_unknown(self, instruction: DecodedInstruction, rows, cycle):
+        raise Exception("Unknown igpu operation: " + instruction.opcode)
+
+    def get_input_args(self, instruction: DecodedInstruction, rows):
+        value = np.broadcast_to(np.asarray(self.load(instruction, rows), dtype=np.int64), self.instance_ids[rows].shape)
+        return (value >> 6) % 64, (value >> 0) % 64, (value >> 18) % 64, (value >> 12) % 64
+
+    def draw(self, rows, columns, bits):
+        # the screen signals are 32 bits, higher bits are dropped
+        pixels = np.where(columns, (bits & UINT32_MASK)[:, np.newaxis], 0)
+        active_buffers = self.status_flag[rows] % 2
+        if isinstance(rows, slice) and (active_buffers == active_buffers[0]).all():
+            self.igpu_buffers[:, active_buffers[0]] |= pixels
+        else:
+            self.igpu_buffers[self.instance_ids[rows], active_buffers] |= pixels
+        self.program_counter[rows] += 1
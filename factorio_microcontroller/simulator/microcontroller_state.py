@@ -1,37 +1,60 @@
-from dataclasses import dataclass
+from array import array
 
 from simulator.constants import MEMORY_SIZE
 from simulator.context_state import ContextState
 from simulator.igpu_state import IGPUState
 
 
-@dataclass()
 class MicrocontrollerState:
-    w_register: int
-    f_memory: list
-    program_counter: int
-    function_call_stack: list
-    variable_scope_stack: list
-    variable_offset: int
-    output_registers: list
-    input_values: list
-    igpu_state: IGPUState
-
-    context_state: ContextState | None = None
+    __slots__ = (
+        "w_register", "f_memory", "program_counter", "function_call_stack", "variable_scope_stack", "frame_base",
+        "variable_offset", "output_registers", "input_values", "igpu_state", "context_state",
+    )
 
     def __init__(self):
         self.w_register = 0
-        self.f_memory = [0 for _ in range(MEMORY_SIZE)]
+        self.f_memory = array('q', bytes(8 * MEMORY_SIZE))
         self.program_counter = 1
         self.function_call_stack = []
         self.variable_scope_stack = [0]
+        # top of the variable scope stack, only changes on CALL and RET
+        self.frame_base = 0
         self.variable_offset = 0
         self.output_registers = [0, 0]
         self.input_values = [0, 0]
         self.igpu_state = IGPUState()
 
+        self.context_state: ContextState | None = None
+
     def read_f_memory(self, address):
-        return self.f_memory[address + self.variable_scope_stack[-1]]
+        return self.f_memory[address + self.frame_base]
 
     def write_f_memory(self, address, value):
-        self.f_memory[address + self.variable_scope_stack[-1]] = value
+        self.f_memory[address + self.frame_base] = value
+
+    def push_scope(self):
+        self.frame_base += self.variable_offset
+        self.variable_scope_stack.append(self.frame_base)
+
+    def pop_scope(self):
+        self.variable_scope_stack.pop()
+        self.frame_base = self.variable_scope_stack[-1]
+
+    def snapshot(self) -> tuple:
+        return (
+            self.w_register, self.program_counter, self.frame_base, self.variable_offset, self.f_memory[:],
+            tuple(self.function_call_stack), tuple(self.variable_scope_stack),
+            tuple(self.output_registers), tuple(self.input_values), self.igpu_state.snapshot(),
+        )
+
+    def restore(self, snapshot: tuple):
+        (self.w_register, self.program_counter, self.frame_base, self.variable_offset, f_memory,
+         function_call_stack, variable_scope_stack, output_registers, input_values, igpu_snapshot) = snapshot
+
+        # restore in place, the executors keep references to these buffers
+        self.f_memory[:] = f_memory
+        self.function_call_stack[:] = function_call_stack
+        self.variable_scope_stack[:] = variable_scope_stack
+        self.output_registers[:] = output_registers
+        self.input_values[:] = input_values
+        self.igpu_state.restore(igpu_snapshot)
@@ -0,0 +1,53 @@
+from compiler.assembly_compiler import DisassemblerInfo
+from compiler.assembly_line import AssemblyLine
+from compiler.reserved_identifiers import MAIN_FUNCTION_NAME
+from simulator.context_state import ContextState
+from simulator.microcontroller_state import MicrocontrollerState
+
+EMPTY_ASSEMBLY_LINE = AssemblyLine("", -1, "", None)
+
+
+class SourceIndex:
+    def __init__(self, disassembler_info: DisassemblerInfo):
+        self.variable_addresses = disassembler_info.variable_addresses
+
+        program_size = max(disassembler_info.function_addresses[function_name] + len(assembly_lines)
+                           for function_name, assembly_lines in disassembler_info.function_scopes.items())
+
+        # indexed by rom address, the halt between the main program and the functions has no source line
+        self.assembly_lines: list[AssemblyLine] = [EMPTY_ASSEMBLY_LINE] * program_size
+        self.functions: list[str] = [MAIN_FUNCTION_NAME] * program_size
+        for function_name, assembly_lines in disassembler_info.function_scopes.items():
+            function_address = disassembler_info.function_addresses[function_name]
+            for offset, assembly_line in enumerate(assembly_lines):
+                self.assembly_lines[function_address + offset] = assembly_line
+                self.functions[function_address + offset] = function_name
+
+    def get_assembly_line(self, address) -> AssemblyLine:
+        if 0 <= address < len(self.assembly_lines):
+            return self.assembly_lines[address]
+        return EMPTY_ASSEMBLY_LINE
+
+    def get_function(self, address) -> str:
+        if 0 <= address < len(self.functions):
+            return self.functions[address]
+        return MAIN_FUNCTION_NAME
+
+    def get_scopes(self, microcontroller_state: MicrocontrollerState, address) -> list[str]:
+        # every return address directly follows the CALL in the calling function
+        scopes = [self.get_function(return_address - 1) for return_address in microcontroller_state.function_call_stack]
+        scopes.append(self.get_function(address))
+        return scopes
+
+    def get_variables(self, microcontroller_state: MicrocontrollerState, scope) -> dict[str, int]:
+        variables = dict()
+        for variable_name, address in self.variable_addresses[scope].items():
+            variables[variable_name] = microcontroller_state.read_f_memory(address)
+        return variables
+
+    def get_context_state(self, microcontroller_state: MicrocontrollerState, address, scopes) -> ContextState:
+        return ContextState(
+            assembly_line=self.get_assembly_line(address),
+            scope='->'.join(scopes),
+            variables=self.get_variables(microcontroller_state, scopes[-1]),
+        )
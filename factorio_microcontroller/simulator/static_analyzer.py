@@ -0,0 +1,342 @@
+import json
+import re
+from dataclasses import dataclass, asdict
+
+import click
+
+from compiler.assembly_compiler import AssemblyCompiler, DisassemblerInfo
+from compiler.control_flow_optimizer import ControlFlowOptimizer
+from compiler.function_inliner import DEFAULT_INLINE_SIZE
+from compiler.peephole_optimizer import PeepholeOptimizer, SKIP_PATTERN
+from compiler.reserved_identifiers import ReservedIdentifier, MAIN_FUNCTION_NAME
+from compiler.variable_allocator import VariableAllocator, RETURN_OPERATIONS
+from simulator.constants import MEMORY_SIZE, INSTRUCTION_DURATION
+
+# a loop is bounded with a comment on its label, the instructions after the label run at most that many times
+# for every time the loop is entered: LABEL loop // bound 10
+BOUND_PATTERN = re.compile(r"//\s*bound\s+([1-9]\d*)")
+INLINE_LABEL_PATTERN = re.compile(r"(\w+)_INLINE_\d+_(\w+)")
+
+
+@dataclass()
+class FunctionAnalysis:
+    name: str
+    calls: list[str]
+    recursive: bool
+    # the highest address the function reads or writes in its own frame
+    frame_size: int
+    # None when the function is recursive or calls a recursive function
+    call_depth: int | None
+    peak_address: int | None
+    # None when a loop has no bound or the function does not return
+    worst_case_cycles: int | None
+
+
+@dataclass()
+class ProgramAnalysis:
+    call_depth: int | None
+    peak_address: int | None
+    memory_size: int
+    fits_memory: bool | None
+    recursive_functions: list[str]
+    functions: list[FunctionAnalysis]
+
+
+class StaticAnalyzer:
+    def __init__(self, disassembler_info: DisassemblerInfo, loop_bounds: dict[str, dict[str, int]]):
+        self.function_scopes = disassembler_info.function_scopes
+        self.variable_addresses = disassembler_info.variable_addresses
+        self.goto_map = disassembler_info.goto_map
+        self.loop_bounds = loop_bounds
+
+    @staticmethod
+    def get_loop_bounds(raw_assembly_lines: list[str]) -> dict[str, dict[str, int]]:
+        function_keyword = ReservedIdentifier.FUNCTION.value
+        function_end_keyword = ReservedIdentifier.FUNCTION_END.value
+        label_keyword = ReservedIdentifier.GOTO_LABEL.value
+
+        loop_bounds = {MAIN_FUNCTION_NAME: dict()}
+        function_name = MAIN_FUNCTION_NAME
+        for raw_line in raw_assembly_lines:
+            words = raw_line.split('//', 1)[0].split()
+            if len(words) < 1:
+                continue
+            if words[0] == function_keyword and len(words) > 1:
+                function_name = words[1]
+                loop_bounds.setdefault(function_name, dict())
+            elif words[0] == function_end_keyword:
+                function_name = MAIN_FUNCTION_NAME
+            elif words[0] == label_keyword and len(words) > 1:
+                bound_match = BOUND_PATTERN.search(raw_line)
+                if bound_match:
+                    loop_bounds[function_name][words[1]] = int(bound_match.group(1))
+        return loop_bounds
+
+    def analyze(self) -> ProgramAnalysis:
+        function_calls = {function_name: self.get_calls(function_name) for function_name in self.function_scopes}
+        # the variable offset of a CALL that is not known is at most the largest one in the program
+        max_variable_offset = 0
+        for function_name, assembly_lines in self.function_scopes.items():
+            for assembly_line in assembly_lines:
+                if assembly_line.assembly_token.keyword == "VAR":
+                    argument = assembly_line.assembly_token.arguments[0]
+                    variable_offset = self.variable_addresses[function_name].get(
+                        argument, PeepholeOptimizer.get_number(argument))
+                    max_variable_offset = max(max_variable_offset, variable_offset or 0)
+
+        # the callees come before the functions that call them
+        components = StaticAnalyzer.get_components(
+            self.function_scopes, lambda function_name: [callee for callee, _, _ in function_calls[function_name]])
+        recursive_functions = set()
+        for component in components:
+            callees = {callee for callee, _, _ in function_calls[component[0]]}
+            if len(component) > 1 or component[0] in callees:
+                recursive_functions.update(component)
+
+        analyses = dict()
+        for component in components:
+            for function_name in component:
+                analyses[function_name] = self.analyze_function(function_name, function_calls[function_name],
+                                                                function_name in recursive_functions, analyses,
+                                                                max_variable_offset)
+
+        main_analysis = analyses[MAIN_FUNCTION_NAME]
+        peak_address = main_analysis.peak_address
+        return ProgramAnalysis(
+            call_depth=main_analysis.call_depth,
+            peak_address=peak_address,
+            memory_size=MEMORY_SIZE,
+            fits_memory=None if peak_address is None else peak_address < MEMORY_SIZE,
+            recursive_functions=sorted(recursive_functions),
+            functions=[analyses[function_name] for function_name in self.function_scopes],
+        )
+
+    def get_calls(self, function_name) -> list[tuple[str, int, bool]]:
+        # the callee, line index and if the return address is pushed, a GOTO to a function is a tail call
+        calls = []
+        for line_index, assembly_line in enumerate(self.function_scopes[function_name]):
+            token = assembly_line.assembly_token
+            if token.keyword == "CALL" or (token.keyword == "GOTO" and token.arguments[0] in self.function_scopes and
+                                           token.arguments[0] not in self.goto_map[function_name]):
+                calls.append((token.arguments[0], line_index, token.keyword == "CALL"))
+        return calls
+
+    def analyze_function(self, function_name, calls: list[tuple[str, int, bool]], recursive,
+                         analyses: dict[str, FunctionAnalysis], max_variable_offset) -> FunctionAnalysis:
+        assembly_lines = self.function_scopes[function_name]
+        variables = self.variable_addresses[function_name]
+        successors = VariableAllocator.get_successors(assembly_lines, self.goto_map[function_name])
+        for line_index, assembly_line in enumerate(assembly_lines):
+            if assembly_line.assembly_token.keyword == "HALT":
+                successors[line_index] = []
+        variable_offsets = VariableAllocator.get_variable_offsets(function_name, assembly_lines, successors, variables)
+
+        # MOVLF writes to the address in W, only the addresses in the instructions are counted
+        frame_size = 0
+        for assembly_line in assembly_lines:
+            token = assembly_line.assembly_token
+            if token.arguments and ControlFlowOptimizer.is_f_operation(token.keyword):
+                address = variables.get(token.arguments[0], PeepholeOptimizer.get_number(token.arguments[0]))
+                frame_size = max(frame_size, address or 0)
+
+        call_depth = None
+        peak_address = None
+        if not recursive and all(analyses[callee].call_depth is not None for callee, _, _ in calls):
+            call_depth = 0
+            peak_address = frame_size
+            for callee, line_index, is_call in calls:
+                # the frame of the callee starts at the variable offset of the CALL, the last VAR that ran
+                variable_offset = variable_offsets[line_index]
+                if not isinstance(variable_offset, int):
+                    variable_offset = max_variable_offset
+                call_depth = max(call_depth, analyses[callee].call_depth + (1 if is_call else 0))
+                peak_address = max(peak_address,
+                                   analyses[callee].peak_address + (variable_offset if is_call else 0))
+
+        worst_case_cycles = None
+        if not recursive:
+            worst_case_cycles = self.get_worst_case_cycles(function_name, successors, calls, analyses)
+
+        return FunctionAnalysis(
+            name=function_name,
+            calls=sorted({callee for callee, _, _ in calls}),
+            recursive=recursive,
+            frame_size=frame_size,
+            call_depth=call_depth,
+            peak_address=peak_address,
+            worst_case_cycles=worst_case_cycles,
+        )
+
+    def get_worst_case_cycles(self, function_name, successors: list[list[int]], calls: list[tuple[str, int, bool]],
+                              analyses: dict[str, FunctionAnalysis]) -> int | None:
+        assembly_lines = self.function_scopes[function_name]
+        if not assembly_lines:
+            # main runs into the halt between the main program and the functions
+            return 1 if function_name == MAIN_FUNCTION_NAME else None
+
+        # every instruction takes one cycle, a call also takes the cycles of the callee up to its return
+        costs = [1] * len(assembly_lines)
+        for callee, line_index, _ in calls:
+            if analyses[callee].worst_case_cycles is None:
+                return None
+            costs[line_index] += analyses[callee].worst_case_cycles
+
+        longest_cycles = StaticAnalyzer.get_longest_cycles(0, lambda line_index: successors[line_index], costs,
+                                                           self.get_label_bounds(function_name))
+        if longest_cycles is None:
+            return None
+
+        worst_case_cycles = None
+        for line_index, cycles in longest_cycles.items():
+            exit_cycles = self.get_exit_cycles(function_name, line_index)
+            if exit_cycles is False:
+                continue
+            if exit_cycles is None:
+                return None
+            worst_case_cycles = max(worst_case_cycles or 0, cycles + exit_cycles)
+        return worst_case_cycles
+
+    def get_label_bounds(self, function_name) -> dict[int, int]:
+        # the loop bounds by the index of the first instruction of the loop, inlined labels keep the bound
+        label_bounds = dict()
+        for label, line_index in self.goto_map[function_name].items():
+            bound = self.loop_bounds.get(function_name, dict()).get(label)
+            inline_match = INLINE_LABEL_PATTERN.fullmatch(label)
+            if bound is None and inline_match:
+                bound = self.loop_bounds.get(inline_match.group(1), dict()).get(inline_match.group(2))
+            if bound is not None:
+                label_bounds[line_index] = min(bound, label_bounds.get(line_index, bound))
+        return label_bounds
+
+    def get_exit_cycles(self, function_name, line_index) -> int | bool | None:
+        # the cycles after the instruction when it leaves the function, False when it does not
+        # None when it runs into the next function
+        assembly_lines = self.function_scopes[function_name]
+        token = assembly_lines[line_index].assembly_token
+        if token.keyword in RETURN_OPERATIONS or token.keyword == "HALT":
+            return 0
+        if token.keyword == "GOTO":
+            return False if token.arguments[0] in self.goto_map[function_name] else 0
+
+        skip_match = SKIP_PATTERN.fullmatch(token.keyword)
+        last_index = line_index + int(skip_match.group(2)) + 1 if skip_match else line_index
+        if last_index < len(assembly_lines) - 1:
+            return False
+        return 1 if function_name == MAIN_FUNCTION_NAME else None
+
+    @staticmethod
+    def get_longest_cycles(entry, get_next, costs: list[int], label_bounds: dict[int, int]) -> dict[int, int] | None:
+        # the most cycles from the entry up to and including each instruction, None for a loop without a bound
+        # a loop runs its longest iteration as many times as its bound, the last time up to where it leaves
+        arrival_cycles = {entry: 0}
+        longest_cycles = dict()
+        for component in reversed(StaticAnalyzer.get_components([entry], get_next)):
+            members = set(component)
+            if len(component) == 1 and component[0] not in get_next(component[0]):
+                longest_cycles[component[0]] = arrival_cycles[component[0]] + costs[component[0]]
+            else:
+                headers = [line_index for line_index in component if line_index in arrival_cycles]
+                if len(headers) != 1 or headers[0] not in label_bounds:
+                    return None
+                header = headers[0]
+                iteration_cycles = StaticAnalyzer.get_longest_cycles(
+                    header, lambda line_index: [next_index for next_index in get_next(line_index)
+                                                if next_index in members and next_index != header],
+                    costs, label_bounds)
+                if iteration_cycles is None:
+                    return None
+                loop_cycles = max(iteration_cycles[line_index] for line_index in component
+                                  if header in get_next(line_index))
+                for line_index in component:
+                    longest_cycles[line_index] = (arrival_cycles[header] + (label_bounds[header] - 1) * loop_cycles +
+                                                  iteration_cycles[line_index])
+
+            for line_index in component:
+                for next_index in get_next(line_index):
+                    if next_index not in members:
+                        arrival_cycles[next_index] = max(arrival_cycles.get(next_index, 0), longest_cycles[line_index])
+        return longest_cycles
+
+    @staticmethod
+    def get_components(nodes, get_next) -> list[list]:
+        # the strongly connected components with tarjan, a component comes after the components it leads to
+        indexes = dict()
+        low_links = dict()
+        node_stack = []
+        stacked_nodes = set()
+        components = []
+        for root in nodes:
+            if root in indexes:
+                continue
+            indexes[root] = low_links[root] = len(indexes)
+            node_stack.append(root)
+            stacked_nodes.add(root)
+            work_stack = [(root, iter(get_next(root)))]
+            while work_stack:
+                node, next_nodes = work_stack[-1]
+                for next_node in next_nodes:
+                    if next_node not in indexes:
+                        indexes[next_node] = low_links[next_node] = len(indexes)
+                        node_stack.append(next_node)
+                        stacked_nodes.add(next_node)
+                        work_stack.append((next_node, iter(get_next(next_node))))
+                        break
+                    if next_node in stacked_nodes:
+                        low_links[node] = min(low_links[node], indexes[next_node])
+                else:
+                    work_stack.pop()
+                    if work_stack:
+                        parent = work_stack[-1][0]
+                        low_links[parent] = min(low_links[parent], low_links[node])
+                    if low_links[node] == indexes[node]:
+                        component_start = node_stack.index(node)
+                        components.append(node_stack[component_start:])
+                        stacked_nodes.difference_update(node_stack[component_start:])
+                        del node_stack[component_start:]
+        return components
+
+    @staticmethod
+    def print_report(program_analysis: ProgramAnalysis):
+        print("Call depth: " + StaticAnalyzer.get_bound_text(program_analysis.call_depth))
+        print("Peak memory address: " + StaticAnalyzer.get_bound_text(program_analysis.peak_address) + " of " +
+              str(program_analysis.memory_size))
+        if program_analysis.fits_memory is False:
+            print("The frames do not fit in memory.")
+        if program_analysis.recursive_functions:
+            print("Recursive functions: " + ", ".join(program_analysis.recursive_functions))
+
+        print("\nFunction: worst case cycles, call depth, peak memory address, frame size, calls")
+        for analysis in program_analysis.functions:
+            cycles = analysis.worst_case_cycles
+            cycles_text = "unknown" if cycles is None else (
+                    str(cycles) + " (" + str(round(cycles * INSTRUCTION_DURATION, 1)) + " seconds)")
+            print(analysis.name + ": " + cycles_text + ", " +
+                  StaticAnalyzer.get_bound_text(analysis.call_depth) + ", " +
+                  StaticAnalyzer.get_bound_text(analysis.peak_address) + ", " +
+                  str(analysis.frame_size) + ", " + (", ".join(analysis.calls) or "-"))
+
+    @staticmethod
+    def get_bound_text(value):
+        return "unbounded" if value is None else str(value)
+
+
+@click.command()
+@click.option('--assembly-file', '-a', help='Assembly file')
+@click.option('--json', 'json_file', help='Also write the analysis as json to this file')
+@click.option('--optimize', '-O', is_flag=True, help='Analyze the program after the optimizer passes')
+@click.option('--inline-size', type=int, show_default=True, default=DEFAULT_INLINE_SIZE,
+              help='Inline the leaf functions up to this many instructions when optimizing')
+def main(assembly_file, json_file, optimize, inline_size):
+    _, disassembler_info = AssemblyCompiler(optimize=optimize, inline_size=inline_size).compile(assembly_file)
+    with open(assembly_file) as f:
+        loop_bounds = StaticAnalyzer.get_loop_bounds(f.read().splitlines())
+
+    program_analysis = StaticAnalyzer(disassembler_info, loop_bounds).analyze()
+    StaticAnalyzer.print_report(program_analysis)
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(asdict(program_analysis), f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
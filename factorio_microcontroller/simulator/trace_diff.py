@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+
+import click
+import numpy as np
+
+from simulator.instruction_decoder import InstructionDecoder
+from simulator.trace_recorder import TraceRecorder, TraceSettings, TRACE_DTYPE
+
+COMPARE_CHUNK_SIZE = 1 << 16
+
+
+@dataclass()
+class TraceDivergence:
+    cycle: int
+    fields: list[str]
+    record_a: np.void | None
+    record_b: np.void | None
+
+
+class TraceDiff:
+    @staticmethod
+    def find_first_divergence(trace_a: np.ndarray, trace_b: np.ndarray, settings_a: TraceSettings = None,
+                              settings_b: TraceSettings = None) -> TraceDivergence | None:
+        settings_a = settings_a or TraceSettings()
+        settings_b = settings_b or TraceSettings()
+
+        # the traces are lined up by cycle, so traces with different sampling can still be compared
+        cycles, indexes_a, indexes_b = np.intersect1d(trace_a["cycle"], trace_b["cycle"],
+                                                      assume_unique=True, return_indices=True)
+
+        for start in range(0, len(cycles), COMPARE_CHUNK_SIZE):
+            chunk_a = trace_a[indexes_a[start:start + COMPARE_CHUNK_SIZE]]
+            chunk_b = trace_b[indexes_b[start:start + COMPARE_CHUNK_SIZE]]
+            different = np.flatnonzero(chunk_a != chunk_b)
+            if different.size:
+                record_a = chunk_a[different[0]]
+                record_b = chunk_b[different[0]]
+                fields = [field for field in TRACE_DTYPE.names if record_a[field] != record_b[field]]
+                return TraceDivergence(int(record_a["cycle"]), fields, record_a, record_b)
+
+        # all shared cycles match, one trace can still have run longer than the cycles the other one samples
+        last_cycle = cycles[-1] if len(cycles) else -1
+        extra_a = trace_a[(trace_a["cycle"] > last_cycle) & settings_b.get_sampled(trace_a["cycle"])]
+        extra_b = trace_b[(trace_b["cycle"] > last_cycle) & settings_a.get_sampled(trace_b["cycle"])]
+        if len(extra_a) or len(extra_b):
+            record_a = extra_a[0] if len(extra_a) else None
+            record_b = extra_b[0] if len(extra_b) else None
+            cycle = min(int(record["cycle"]) for record in [record_a, record_b] if record is not None)
+            return TraceDivergence(cycle, ["cycle"], record_a, record_b)
+        return None
+
+    @staticmethod
+    def format_record(record, opcode_map) -> str:
+        if record is None:
+            return "trace ended"
+
+        text = ("pc: " + str(record["program_counter"]) + ", " + opcode_map.get(int(record["opcode_id"]), "?") +
+                " " + str(record["literal"]) + ", W: " + str(record["w_register"]) +
+                ", outputs: [" + str(record["output_1"]) + ", " + str(record["output_2"]) + "]")
+        if record["memory_address"] >= 0:
+            text += ", memory[" + str(record["memory_address"]) + "] = " + str(record["memory_value"])
+        return text
+
+
+@click.command()
+@click.argument('trace_a')
+@click.argument('trace_b')
+def main(trace_a, trace_b):
+    records_a = TraceRecorder.load(trace_a)
+    records_b = TraceRecorder.load(trace_b)
+    divergence = TraceDiff.find_first_divergence(records_a, records_b, TraceRecorder.load_settings(trace_a),
+                                                 TraceRecorder.load_settings(trace_b))
+    if divergence is None:
+        print("Traces match, " + str(len(records_a)) + " records.")
+        return
+
+    opcode_map = InstructionDecoder.load_opcode_map()
+    print("First divergence at cycle " + str(divergence.cycle) + " in: " + ", ".join(divergence.fields))
+    print("A: " + TraceDiff.format_record(divergence.record_a, opcode_map))
+    print("B: " + TraceDiff.format_record(divergence.record_b, opcode_map))
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import os
+import struct
+from dataclasses import dataclass, replace
+from functools import wraps
+
+import numpy as np
+
+from simulator.decoded_instruction import DecodedInstruction
+from simulator.instruction_decoder import InstructionDecoder
+
+TRACE_MAGIC = b"FMCTRACE"
+TRACE_VERSION = 1
+# magic, version and the trace settings, an end cycle of -1 is no end
+HEADER_STRUCT = struct.Struct("<8sIiiq")
+
+# fixed width little endian records, no memory write is stored as address -1
+RECORD_STRUCT = struct.Struct("<iiHiqqqiq")
+TRACE_DTYPE = np.dtype([
+    ("cycle", "<i4"),
+    ("program_counter", "<i4"),
+    ("opcode_id", "<u2"),
+    ("literal", "<i4"),
+    ("w_register", "<i8"),
+    ("output_1", "<i8"),
+    ("output_2", "<i8"),
+    ("memory_address", "<i4"),
+    ("memory_value", "<i8"),
+])
+BUFFER_RECORDS = 4096
+
+
+@dataclass()
+class TraceSettings:
+    sample_interval: int = 1
+    start_cycle: int = 0
+    end_cycle: int | None = None
+
+    def get_sampled(self, cycles: np.ndarray) -> np.ndarray:
+        sampled = (cycles >= self.start_cycle) & ((cycles - self.start_cycle) % self.sample_interval == 0)
+        if self.end_cycle is not None:
+            sampled &= cycles < self.end_cycle
+        return sampled
+
+
+class TraceRecorder:
+    def __init__(self, file_name, sample_interval=1, start_cycle=0, end_cycle=None):
+        self.file_name = file_name
+        self.settings = TraceSettings(sample_interval, start_cycle, end_cycle)
+        # plain attributes for the per cycle check
+        self.sample_interval = sample_interval
+        self.start_cycle = start_cycle
+        self.end_cycle = end_cycle if end_cycle is not None else float('inf')
+
+        self.file = None
+        self.buffer = bytearray(RECORD_STRUCT.size * BUFFER_RECORDS)
+        self.buffer_offset = 0
+        self.cycle = 0
+        self.record_count = 0
+
+    def wrap_instructions(self, decoded_instructions: list[DecodedInstruction]) -> list[DecodedInstruction]:
+        opcode_ids = {opcode: opcode_id for opcode_id, opcode in InstructionDecoder.load_opcode_map().items()}
+        return [replace(instruction, handler=self.get_recorded_handler(instruction, address, opcode_ids[instruction.opcode]))
+                for address, instruction in enumerate(decoded_instructions, start=1)]
+
+    def get_recorded_handler(self, instruction: DecodedInstruction, address, opcode_id):
+        handler = instruction.handler
+        record = self.record
+        writes_memory = instruction.store == 'F'
+        # MOVLF is the only instruction that writes to the address in W
+        writes_indirect = handler.__name__ == "execute_move_literal_to_f"
+
+        @wraps(handler)
+        def recorded_handler(instruction: DecodedInstruction, state):
+            if writes_memory:
+                memory_address = state.frame_base + (state.w_register if writes_indirect else instruction.literal)
+            else:
+                memory_address = -1
+            is_halt = handler(instruction, state)
+            record(address, opcode_id, instruction.literal, state, memory_address)
+            return is_halt
+
+        return recorded_handler
+
+    def open(self):
+        self.file = open(self.file_name, 'wb')
+        end_cycle = self.settings.end_cycle if self.settings.end_cycle is not None else -1
+        self.file.write(HEADER_STRUCT.pack(TRACE_MAGIC, TRACE_VERSION, self.settings.sample_interval,
+                                           self.settings.start_cycle, end_cycle))
+
+    def record(self, address, opcode_id, literal, state, memory_address):
+        cycle = self.cycle
+        self.cycle += 1
+        if cycle < self.start_cycle or cycle >= self.end_cycle or (cycle - self.start_cycle) % self.sample_interval:
+            return
+
+        memory_value = state.f_memory[memory_address] if memory_address >= 0 else 0
+        RECORD_STRUCT.pack_into(self.buffer, self.buffer_offset, cycle, address, opcode_id, literal, state.w_register,
+                                state.output_registers[0], state.output_registers[1], memory_address, memory_value)
+        self.buffer_offset += RECORD_STRUCT.size
+        self.record_count += 1
+        if self.buffer_offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(memoryview(self.buffer)[:self.buffer_offset])
+        self.buffer_offset = 0
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+    @staticmethod
+    def load_settings(file_name) -> TraceSettings:
+        with open(file_name, 'rb') as f:
+            header = f.read(HEADER_STRUCT.size)
+        if len(header) != HEADER_STRUCT.size:
+            raise Exception("Not a trace file: " + str(file_name))
+
+        magic, version, sample_interval, start_cycle, end_cycle = HEADER_STRUCT.unpack(header)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise Exception("Not a trace file: " + str(file_name))
+        return TraceSettings(sample_interval, start_cycle, end_cycle if end_cycle >= 0 else None)
+
+    @staticmethod
+    def load(file_name) -> np.ndarray:
+        TraceRecorder.load_settings(file_name)
+        if os.path.getsize(file_name) == HEADER_STRUCT.size:
+            return np.empty(0, dtype=TRACE_DTYPE)
+        # memory mapped, so long traces are not read into memory
+        return np.memmap(file_name, dtype=TRACE_DTYPE, mode='r', offset=HEADER_STRUCT.size)
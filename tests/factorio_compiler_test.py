@@ -1,9 +1,25 @@
 import unittest
+import math
 import filecmp
+import json
 import os
+import shutil
+import tempfile
+import zlib
+from base64 import b64decode
 from pathlib import Path
 
 from compiler.assembly_compiler import AssemblyCompiler
+from compiler.compile_cache import CompileCache
+from compiler.control_flow_optimizer import ControlFlowOptimizer
+from compiler.function_inliner import FunctionInliner
+from compiler.peephole_optimizer import PeepholeOptimizer
+from compiler.preprocessor import Preprocessor
+from compiler.rom_image import RomImage
+from program_builder import ProgramBuilder
+from scripts.blueprint_codec import BlueprintCodec
+from scripts.program_to_rom_blueprint import (Program2ROM, EXTENDED_SIGNAL_MAP_FILE, MAX_CONSTANT_COMB_SIGNALS,
+                                              CPU_BLUEPRINT_FILE)
 
 TEST_RESOURCE_FOLDER = Path(__file__).parent.parent / "tests/resources"
 
@@ -15,12 +31,280 @@ class FactorioCompilerTest(unittest.TestCase):
     # TODO could split test assembly bins into folders for each opcode ops like memory, i/o, alu...
     def test_compile_to_bin(self):
         assembly_file = TEST_RESOURCE_FOLDER / "test_assembly.txt"
-        binary_file, _ = self.fc.compile(str(assembly_file))
+        rom_file, _ = self.fc.compile(str(assembly_file))
+        binary_file = TEST_RESOURCE_FOLDER / "test_assembly.bin"
         expected_binary_file = TEST_RESOURCE_FOLDER / "test_bin_expected.bin"
 
         self.assertTrue(filecmp.cmp(expected_binary_file, binary_file))
+        self.assertEqual(RomImage.load_instructions(expected_binary_file), RomImage.read(rom_file))
+        self.assertEqual(RomImage.read(rom_file), RomImage.memmap(rom_file).tolist())
 
         os.remove(binary_file)
+        os.remove(rom_file)
+
+    def test_compile_cache(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "test_assembly.txt"
+            shutil.copy(TEST_RESOURCE_FOLDER / "test_assembly.txt", assembly_file)
+            rom_file, disassembler_info = self.fc.compile(str(assembly_file))
+
+            compile_cache = CompileCache(Path(temp_folder) / "cache")
+            cached_compiler = AssemblyCompiler(compile_cache)
+            cached_compiler.compile(str(assembly_file))
+            cached_rom_file, cached_disassembler_info = cached_compiler.compile(str(assembly_file))
+            self.assertEqual(RomImage.read(rom_file), RomImage.read(cached_rom_file))
+            self.assertEqual(disassembler_info, cached_disassembler_info)
+
+            # the comment changes the first part of main and moves the other functions, foo is changed
+            with open(assembly_file) as f:
+                assembly = f.read()
+            assembly = "// moved\n" + assembly.replace("ROLF,f a\nRET", "RORF,f a\nRET")
+            with open(assembly_file, 'w') as f:
+                f.write(assembly)
+
+            compile_cache.hits, compile_cache.misses = 0, 0
+            cached_rom_file, cached_disassembler_info = cached_compiler.compile(str(assembly_file))
+            self.assertEqual(compile_cache.misses, 4)
+            rom_file, disassembler_info = self.fc.compile(str(assembly_file))
+            self.assertEqual(RomImage.read(rom_file), RomImage.read(cached_rom_file))
+            self.assertEqual(disassembler_info, cached_disassembler_info)
+
+    def test_preprocessor(self):
+        assembly_lines = self.fc.get_assembly_lines([
+            "#define A 3",
+            "#define AB 5",
+            "#define HALF EVPY(A / 2)",
+            "MOVLW EVPY(AB + A * (2 < 3) - ~1)",
+            "MOVLW AB",
+            "MOVLW HALF",
+        ])
+        Preprocessor.preprocess(assembly_lines)
+
+        self.assertEqual([["10"], ["5"], ["1"]], [line.assembly_token.arguments for line in assembly_lines])
+        with self.assertRaises(ValueError):
+            Preprocessor.eval_py_literal("EVPY((1, 2))")
+
+    def test_peephole_optimizer(self):
+        assembly_lines = self.fc.get_assembly_lines([
+            "VAR a",
+            "MOVLW 2",
+            "ADDWL,w 3",
+            "MOVLW 5",
+            "MOVWF a",
+            "NOP",
+            "MOVFW a",
+            "MOVLW 4",
+            "ADDWF,w a",
+            "GOTO NEXT",
+            "LABEL NEXT",
+            "EQWL,0 9",
+            "NOP",
+            "MOVWF a",
+        ])
+        function_scopes = {"__main__": assembly_lines}
+
+        self.assertEqual(6, PeepholeOptimizer.optimize(function_scopes))
+        self.assertEqual(["VAR a", "MOVLW 5", "MOVWF a", "ADDWL,w 4", "LABEL NEXT", "EQWL,0 9", "NOP", "MOVWF a"],
+                         [line.line for line in assembly_lines])
+        # the lines that are left keep their source line
+        self.assertEqual([1, 3, 5, 9, 11, 12, 13, 14], [line.line_number for line in assembly_lines])
+
+    def test_control_flow_optimizer(self):
+        function_scopes = {
+            "__main__": self.fc.get_assembly_lines([
+                "LABEL START",
+                "GOTO A",
+                "NOP",
+                "LABEL A",
+                "GOTO B",
+                "LABEL B",
+                "EQWL,0 1",
+                "GOTO START",
+                "CALL foo",
+            ]),
+            "foo": self.fc.get_assembly_lines(["EQWL,1 0", "CALL baz", "RET", "CALL bar", "RET"]),
+            "bar": self.fc.get_assembly_lines(["IGDRAWPL 5", "RET"]),
+            "baz": self.fc.get_assembly_lines(["VAR a", "MOVWF a", "RET"]),
+        }
+
+        self.assertEqual(5, ControlFlowOptimizer.optimize(function_scopes))
+        self.assertEqual(["GOTO B", "LABEL B", "EQWL,0 1", "GOTO B", "CALL foo"],
+                         [line.line for line in function_scopes["__main__"]])
+        # bar does not use the frame so the GOTO can return for foo, baz needs its own frame
+        self.assertEqual(["EQWL,1 0", "CALL baz", "RET", "GOTO bar"], [line.line for line in function_scopes["foo"]])
+
+    def test_function_inliner(self):
+        function_scopes = {
+            "__main__": self.fc.get_assembly_lines(["VAR a", "MOVLW 3", "MOVWF 2", "CALL add_one", "WOUTW,1"]),
+            "add_one": self.fc.get_assembly_lines(["VAR x", "MOVFW x", "ADDWL,w 1", "RET"]),
+        }
+
+        self.assertEqual(1, FunctionInliner.inline(function_scopes))
+        # x is the argument in address 2, the VAR keeps the variable offset of the CALL
+        self.assertEqual(["VAR a", "MOVLW 3", "MOVWF 2", "VAR 1", "MOVFW 2", "ADDWL,w 1", "WOUTW,1"],
+                         [line.line for line in function_scopes["__main__"]])
+        self.assertNotIn("add_one", function_scopes)
+
+        function_scopes = {
+            "__main__": self.fc.get_assembly_lines(["CALL add_one"]),
+            "add_one": self.fc.get_assembly_lines(["VAR x", "MOVFW x", "ADDWL,w 1", "RET"]),
+        }
+        self.assertEqual(0, FunctionInliner.inline(function_scopes, inline_size=3))
+
+    def test_variable_allocator(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "fibonacci.txt"
+            shutil.copy(TEST_RESOURCE_FOLDER.parent.parent / "programs/fibonacci.txt", assembly_file)
+            _, disassembler_info = AssemblyCompiler(optimize=True).compile(str(assembly_file))
+
+        # n and n_minus_1 are not live at the same time, the frame of each recursive CALL is 2 instead of 4
+        self.assertEqual({"n": 1, "n_minus_1": 1, "n_minus_2": 2, "ret_1": 1, "ret_2": 2},
+                         disassembler_info.variable_addresses["fibonacci"])
+        fibonacci_lines = [line.line for line in disassembler_info.function_scopes["fibonacci"]]
+        self.assertEqual({"VAR 2"}, {line for line in fibonacci_lines if line.startswith("VAR")})
+        # the argument is written to the frame of the recursive CALL
+        self.assertEqual(2, fibonacci_lines.count("MOVWF 3"))
+
+    def test_program_builder(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            for program in ["counter.txt", "fibonacci.txt"]:
+                shutil.copy(TEST_RESOURCE_FOLDER.parent.parent / "programs" / program, Path(temp_folder) / program)
+
+            program_builder = ProgramBuilder(max_workers=2)
+            results = program_builder.build(temp_folder)
+            self.assertEqual([False, False], [result.skipped for result in results])
+            self.assertTrue(all(os.path.exists(result.blueprint_file) for result in results))
+            self.assertTrue(os.path.exists(Path(temp_folder) / "fibonacci.rom"))
+
+            # only the changed program is built again, also when it is listed in a manifest
+            with open(Path(temp_folder) / "counter.txt", 'a') as f:
+                f.write("\nMOVLW 1\n")
+            manifest_file = Path(temp_folder) / "manifest.json"
+            with open(manifest_file, 'w') as f:
+                f.write('["counter.txt", "fibonacci.txt"]')
+            results = program_builder.build(manifest_file)
+            self.assertEqual([False, True], [result.skipped for result in results])
+            self.assertTrue(all(result.error is None for result in results))
+
+            # a failed program is built again after it is reverted, its old outputs may be stale
+            with open(Path(temp_folder) / "counter.txt") as f:
+                counter_source = f.read()
+            with open(Path(temp_folder) / "counter.txt", 'a') as f:
+                f.write("UNKNOWN 1\n")
+            self.assertIsNotNone(program_builder.build(manifest_file)[0].error)
+            with open(Path(temp_folder) / "counter.txt", 'w') as f:
+                f.write(counter_source)
+            results = program_builder.build(manifest_file)
+            self.assertEqual([False, True], [result.skipped for result in results])
+
+    def test_rom_blueprint(self):
+        program_to_rom = Program2ROM()
+        program = list(range(-100, 200))
+        rom_blueprint = BlueprintCodec.decode(program_to_rom.get_rom_blueprint(program))
+        entities = rom_blueprint["blueprint"]["entities"]
+
+        # every block of 137 instructions is a copy of the rom template, one to the left of the last one
+        template_size = len(program_to_rom.rom_entity_templates)
+        self.assertEqual(3 * template_size, len(entities))
+        self.assertEqual(list(range(1, 3 * template_size + 1)), [entity["entity_number"] for entity in entities])
+        self.assertEqual(-1.5, entities[2 * template_size]["position"]["x"])
+        self.assertEqual(template_size + 2, entities[template_size]["connections"]["1"]["green"][0]["entity_id"])
+        signals = [signal["count"] for entity in entities for signal in entity["control_behavior"]["filters"]
+                   if signal["signal"]["name"] != "signal-info"]
+        self.assertEqual(sorted(program), sorted(signals))
+        # the template is not changed by a blueprint
+        self.assertEqual([], program_to_rom.rom_entity_templates[0]["control_behavior"]["filters"])
+
+    def test_rom_delta_blueprint(self):
+        program_to_rom = Program2ROM()
+        template_size = len(program_to_rom.rom_entity_templates)
+        program = list(range(400))
+        rom_manifest = program_to_rom.get_rom_manifest(program)
+        self.assertIsNone(program_to_rom.get_rom_delta_blueprint(program, rom_manifest))
+
+        # only the second block changed, it stays at its offset in the rom
+        program[200] = -1
+        rom_blueprint = BlueprintCodec.decode(program_to_rom.get_rom_delta_blueprint(program, rom_manifest))
+        entities = rom_blueprint["blueprint"]["entities"]
+        self.assertEqual("ROM blocks 1", rom_blueprint["blueprint"]["label"])
+        self.assertEqual(list(range(1, template_size + 1)), [entity["entity_number"] for entity in entities])
+        self.assertEqual(-0.5, entities[0]["position"]["x"])
+        self.assertIn(-1, [signal["count"] for entity in entities for signal in entity["control_behavior"]["filters"]])
+
+        # the blocks after a shorter program are cleared
+        rom_blueprint = BlueprintCodec.decode(program_to_rom.get_rom_delta_blueprint(program[:100], rom_manifest))
+        self.assertEqual("ROM blocks 0, 1, 2", rom_blueprint["blueprint"]["label"])
+        self.assertEqual([], rom_blueprint["blueprint"]["entities"][2 * template_size]["control_behavior"]["filters"])
+        self.assertEqual(3 * template_size,
+                         len(BlueprintCodec.decode(program_to_rom.get_rom_delta_blueprint(program, dict()))
+                             ["blueprint"]["entities"]))
+
+    def test_rom_extended_signal_map(self):
+        program_to_rom = Program2ROM(signal_map_file=EXTENDED_SIGNAL_MAP_FILE)
+        block_size = program_to_rom.signal_map_max
+        self.assertGreater(block_size, Program2ROM().signal_map_max)
+        # the added signals are not used by any combinator of the cpu
+        with open(CPU_BLUEPRINT_FILE) as f:
+            cpu_blueprint = BlueprintCodec.decode(f.read())
+        cpu_signal_names = json.dumps(cpu_blueprint)
+        for signal in program_to_rom.signal_map[Program2ROM().signal_map_max:]:
+            self.assertNotIn('"' + signal["name"] + '"', cpu_signal_names)
+
+        # the wider blocks have more constant combinators in one chain, with the info combinator at the end
+        program = list(range(2 * block_size))
+        entities = BlueprintCodec.decode(program_to_rom.get_rom_blueprint(program))["blueprint"]["entities"]
+        template_size = len(program_to_rom.rom_entity_templates)
+        self.assertEqual(math.ceil(block_size / MAX_CONSTANT_COMB_SIGNALS) + 1, template_size)
+        self.assertEqual([template_size - 1], [connection["entity_id"] for connection in
+                                               entities[template_size - 1]["connections"]["1"]["green"]])
+        self.assertEqual([template_size - 2, template_size], [connection["entity_id"] for connection in
+                                                              entities[template_size - 2]["connections"]["1"]["green"]])
+        self.assertEqual(len(program), sum(len(entity["control_behavior"]["filters"]) for entity in entities) - 2)
+
+        # the cpu blueprint decodes the wider blocks, the default signal map gives the shipped blueprint
+        self.assertEqual(cpu_blueprint, BlueprintCodec.decode(Program2ROM().create_cpu_blueprint()))
+        cpu_entities = BlueprintCodec.decode(program_to_rom.create_cpu_blueprint())["blueprint"]["entities"]
+        self.assertEqual(len(cpu_blueprint["blueprint"]["entities"]) + 1, len(cpu_entities))
+        self.assertEqual(2, sum(entity.get("control_behavior", {}).get("arithmetic_conditions", {})
+                                .get("second_constant") == block_size for entity in cpu_entities))
+        rom_map = Program2ROM.get_cpu_rom_map_entities(cpu_entities)
+        self.assertEqual({"x": 5.5, "y": 22.5}, rom_map[-1]["position"])
+        self.assertEqual([(i + 1, signal["name"]) for i, signal in enumerate(program_to_rom.signal_map)],
+                         [(signal["count"], signal["signal"]["name"]) for entity in rom_map
+                          for signal in entity["control_behavior"]["filters"]])
+
+    def test_blueprint_codec(self):
+        blueprint = {"blueprint": {"entities": [{"entity_number": i, "position": {"x": 0.5, "y": i}} for i in range(100)],
+                                   "tiles": [], "label": "ROM"}}
+        blueprint_string = BlueprintCodec.encode(blueprint)
+        self.assertEqual('0', blueprint_string[0])
+        self.assertEqual(blueprint, BlueprintCodec.decode(blueprint_string))
+        self.assertEqual(blueprint, BlueprintCodec.decode(BlueprintCodec.encode(blueprint, 0) + "\n"))
+        # the json has no spaces between the items
+        self.assertEqual(b'{"blueprint":{"entities":[{"entity_number":0,',
+                         zlib.decompress(b64decode(blueprint_string[1:]))[:45])
+
+    def test_compile_numeric_var(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "numeric_var.txt"
+            with open(assembly_file, 'w') as f:
+                f.write('\n'.join(["VAR a", "VAR 5", "VAR b", "MOVWF 5", "MOVWF b"]))
+            rom_file, disassembler_info = self.fc.compile(str(assembly_file))
+            instructions = RomImage.read(rom_file)
+
+        # a VAR with a number sets the variable offset to that number, it does not name a variable
+        self.assertEqual({"a": 1, "b": 2}, disassembler_info.variable_addresses["__main__"])
+        # the literal is the upper 24 bits of an instruction
+        self.assertEqual([1, 5, 2, 5, 2], [instruction >> 8 for instruction in instructions[:5]])
+
+    def test_compile_literal_out_of_range(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "literal.txt"
+            with open(assembly_file, 'w') as f:
+                f.write("MOVLW 0xFFFFFF\nMOVLW 0x1000000\n")
+
+            with self.assertRaisesRegex(Exception, "Literal does not fit in 24 bits: 0x1000000. Line number: 2"):
+                self.fc.compile(str(assembly_file))
 
 
 if __name__ == '__main__':
@@ -1,9 +1,33 @@
+from array import array
 from pathlib import Path
+import os
+import tempfile
 import unittest
 
-from simulator.factorio_microcontroller_sim import FactorioMicrocontrollerSim
+import numpy as np
+from PIL import Image, ImageSequence
+
+from compiler.assembly_compiler import AssemblyCompiler
+from simulator.factorio_microcontroller_sim import (FactorioMicrocontrollerSim, BLOCK_ENGINE, CYCLE_TIMEOUT,
+                                                    BatchSim, BatchJob)
+from simulator.igpu_sim import IGPUSim
+from simulator.input_sim import InputSim
+from simulator.instruction_decoder import InstructionDecoder
+from simulator.instruction_executor import InstructionExecutor
+from simulator.lockstep_sim import LockstepSim, wrap_int32
+from simulator.microcontroller_state import MicrocontrollerState
+from simulator.source_index import SourceIndex
+from simulator.static_analyzer import StaticAnalyzer
+from simulator.trace_diff import TraceDiff
+from simulator.trace_recorder import TraceRecorder
 
 TEST_RESOURCE_FOLDER = Path(__file__).parent.parent / "tests/resources"
+PROGRAMS_FOLDER = Path(__file__).parent.parent / "programs"
+
+
+def remove_compiler_output(rom_file):
+    os.remove(rom_file)
+    os.remove(rom_file[:-4] + '.bin')
 
 
 class FactorioMicrocontrollerSimTest(unittest.TestCase):
@@ -17,6 +41,299 @@ class FactorioMicrocontrollerSimTest(unittest.TestCase):
         self.assertEqual(0, state.output_registers[0])
         self.assertEqual(5, state.output_registers[1])
 
+    def test_simulate_fibonacci_block_engine(self):
+        state = self.simulator.run(verbose=False, enable_igpu_sim=False, engine=BLOCK_ENGINE)
+
+        self.assertEqual(0, state.output_registers[0])
+        self.assertEqual(5, state.output_registers[1])
+
+    def test_batch_sim(self):
+        fib_binary_file = str(TEST_RESOURCE_FOLDER / "fibonacci_binary.txt")
+        jobs = [BatchJob(fib_binary_file, slope) for slope in [1, 2]]
+        results = BatchSim(engine=BLOCK_ENGINE, enable_frame_hash=True, max_workers=2).run(jobs)
+
+        self.assertEqual([1, 2], [result.job.input_slope for result in results])
+        for result in results:
+            self.assertTrue(result.halted)
+            self.assertEqual([0, 5], result.output_registers)
+            self.assertEqual(results[0].frame_hash, result.frame_hash)
+
+    def test_lockstep_sim(self):
+        assembly_file = TEST_RESOURCE_FOLDER / "input_fibonacci.txt"
+        binary_file, _ = AssemblyCompiler().compile(str(assembly_file))
+        decoded_instructions = InstructionDecoder.decode_all_instructions(
+            FactorioMicrocontrollerSim.load_binary(binary_file), InstructionExecutor())
+        remove_compiler_output(binary_file)
+
+        # the input at cycle 0 is the initial value, so the instances take different paths through the recursion
+        lockstep_sim = LockstepSim(decoded_instructions, [1] * 8, list(range(8))).run(CYCLE_TIMEOUT)
+        self.assertTrue(lockstep_sim.halted.all())
+        self.assertEqual([0, 1, 2, 3, 5, 8, 13, 21], lockstep_sim.output_registers[:, 1].tolist())
+
+        simulator = FactorioMicrocontrollerSim(None, input_config={"1": InputSim.get_linear_config(1, 7)})
+        simulator.quiet = True
+        state = simulator.simulate(decoded_instructions, False, False)
+        self.assertEqual(simulator.cycle_count, lockstep_sim.cycle_count[7])
+        self.assertEqual(list(state.f_memory), lockstep_sim.f_memory[7].tolist())
+
+        self.assertEqual(-2 ** 31, wrap_int32(2 ** 31))
+
+    def test_alu_wraps_int32(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "overflow.txt"
+            with open(assembly_file, 'w') as f:
+                f.write('\n'.join(["VAR x", "VAR a", "VAR b", "VAR y", "VAR c", "MOVLW 65537", "MOVWF x"] +
+                                  ["MULWF,f x"] * 4 +
+                                  ["MOVLW 3", "ROLWL,w 30", "MOVWF a", "RORWL,w 4", "MOVWF b",
+                                   "MOVLW 12", "MOVWF y", "MOVLW 10", "ANDWF,f y", "ORWF,w y", "MOVWF c",
+                                   "MOVLW 1", "ROLWL,w 31", "ROLF,f y", "RORF,f y", "ORWF,f y"]))
+            binary_file, _ = AssemblyCompiler().compile(str(assembly_file))
+
+            # the results past 32 bits are wrapped like the combinators do, instead of overflowing the memory
+            for engine in ["interpreter", BLOCK_ENGINE]:
+                state = FactorioMicrocontrollerSim(binary_file).run(verbose=False, enable_igpu_sim=False, engine=engine)
+                self.assertEqual([wrap_int32(65537 ** 5), -2 ** 30, -2 ** 26, -2 ** 31 + 8, 10],
+                                 list(state.f_memory[1:6]))
+                self.assertEqual(-2 ** 31, state.w_register)
+
+    def test_engines_divide_by_zero_and_wrap_input(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "divide.txt"
+            with open(assembly_file, 'w') as f:
+                f.write('\n'.join(["VAR x", "MOVLW 0", "MOVWF x", "MOVLW 7", "DIVWF,w x", "WOUTW,1", "MOVLW 7",
+                                   "MODWF,f x", "RINW,1", "WOUTW,2"]))
+            binary_file, _ = AssemblyCompiler().compile(str(assembly_file))
+            binary = FactorioMicrocontrollerSim.load_binary(binary_file)
+
+        # dividing by zero gives 0 like the game, and a large linear input wraps to 32 bits, in every engine
+        slope, initial = 3 ** 30, 2 ** 31 - 1
+        outputs = []
+        for engine in ["interpreter", BLOCK_ENGINE]:
+            simulator = FactorioMicrocontrollerSim(None, input_config={"1": InputSim.get_linear_config(slope, initial)})
+            simulator.binary = binary
+            state = simulator.run(verbose=False, enable_igpu_sim=False, engine=engine)
+            outputs.append(list(state.output_registers))
+        decoded_instructions = InstructionDecoder.decode_all_instructions(binary, InstructionExecutor())
+        lockstep_sim = LockstepSim(decoded_instructions, [slope], [initial]).run(CYCLE_TIMEOUT)
+        outputs.append(lockstep_sim.output_registers[0].tolist())
+
+        self.assertEqual([[0, wrap_int32(slope * 8 + initial)]] * 3, outputs)
+
+    def test_block_engine_matches_interpreter(self):
+        binary_file, _ = AssemblyCompiler().compile(str(PROGRAMS_FOLDER / "pong.txt"))
+        simulators = [FactorioMicrocontrollerSim(binary_file), FactorioMicrocontrollerSim(binary_file)]
+        remove_compiler_output(binary_file)
+        states = []
+        for engine, simulator in zip(["interpreter", BLOCK_ENGINE], simulators):
+            simulator.quiet = True
+            state = simulator.run(verbose=False, enable_igpu_sim=False, engine=engine)
+            states.append((simulator.cycle_count, state.w_register, list(state.f_memory), state.output_registers,
+                           list(state.igpu_state.screen_buffer)))
+        self.assertEqual(states[0], states[1])
+
+    def test_optimized_programs(self):
+        for program in ["fibonacci.txt", "pong.txt"]:
+            results = []
+            for optimize in [False, True]:
+                binary_file, _ = AssemblyCompiler(optimize=optimize).compile(str(PROGRAMS_FOLDER / program))
+                simulator = FactorioMicrocontrollerSim(binary_file)
+                remove_compiler_output(binary_file)
+                simulator.quiet = True
+                state = simulator.run(verbose=False, enable_igpu_sim=False)
+                results.append((len(simulator.binary), simulator.cycle_count, list(state.output_registers),
+                                list(state.igpu_state.screen_buffer)))
+
+            # the optimized program is smaller and faster, the variable addresses may differ but not the outputs
+            plain, optimized = results
+            self.assertLess(optimized[0], plain[0], program)
+            self.assertLess(optimized[1], plain[1], program)
+            self.assertEqual(plain[2:], optimized[2:], program)
+
+    def test_block_engine_timeout(self):
+        binary_file, _ = AssemblyCompiler().compile(str(PROGRAMS_FOLDER / "input_rate.txt"))
+        input_config = InputSim.load_config(PROGRAMS_FOLDER / "input_rate_inputs.json")
+        simulators = [FactorioMicrocontrollerSim(binary_file, input_config=input_config) for _ in range(2)]
+        remove_compiler_output(binary_file)
+
+        # the block engine interprets the last cycles, so it stops at the timeout like the interpreter
+        states = []
+        for engine, simulator in zip(["interpreter", BLOCK_ENGINE], simulators):
+            with self.assertRaises(TimeoutError):
+                simulator.run(verbose=False, enable_igpu_sim=False, engine=engine)
+            state = simulator.microcontroller_state
+            states.append((simulator.cycle_count, state.program_counter, state.w_register, list(state.f_memory)))
+        self.assertEqual(CYCLE_TIMEOUT, states[1][0])
+        self.assertEqual(states[0], states[1])
+
+    def test_input_streams(self):
+        input_config = {
+            "1": {"type": "step", "initial": 1, "height": 2, "period": 3},
+            "2": {"type": "random", "seed": 4, "min": 5, "max": 6},
+        }
+        input_1, input_2 = InputSim.get_input_streams(input_config, 7)
+        self.assertEqual([1, 1, 1, 3, 3, 3, 5], list(input_1))
+        self.assertTrue(all(5 <= value <= 6 for value in input_2))
+        self.assertEqual(input_2, InputSim.get_input_streams(input_config, 7)[1])
+
+        with tempfile.TemporaryDirectory() as trace_folder:
+            trace_file = Path(trace_folder) / "trace.bin"
+            trace_file.write_bytes(array('i', [7, -8, 9]).tobytes())
+            # the last value of the trace is held
+            self.assertEqual([7, -8, 9, 9], list(InputSim.get_input_stream({"type": "trace", "file": trace_file}, 4)))
+
+            trace_file.write_bytes(b'')
+            with self.assertRaisesRegex(ValueError, "trace.bin"):
+                InputSim.get_input_stream({"type": "trace", "file": trace_file}, 4)
+
+    def test_cycle_profiler(self):
+        assembly_file = TEST_RESOURCE_FOLDER / "input_fibonacci.txt"
+        binary_file, disassembler_info = AssemblyCompiler().compile(str(assembly_file))
+        simulator = FactorioMicrocontrollerSim(binary_file, disassembler_info, {"1": InputSim.get_linear_config(0, 5)})
+        remove_compiler_output(binary_file)
+        simulator.run(verbose=False, enable_igpu_sim=False, profile=True)
+
+        profiler = simulator.cycle_profiler
+        self.assertEqual(simulator.cycle_count, profiler.get_total_cycles())
+        function_profiles = {profile.name: profile for profile in profiler.get_function_profiles()}
+        self.assertEqual(simulator.cycle_count, function_profiles['__main__'].inclusive_cycles)
+        self.assertEqual(15, function_profiles['fibonacci'].call_count)
+        self.assertEqual(simulator.cycle_count, sum(profile.exclusive_cycles for profile in function_profiles.values()))
+
+        collapsed_stacks = profiler.get_collapsed_stacks()
+        self.assertTrue(any(stack.startswith("__main__;fibonacci;fibonacci ") for stack in collapsed_stacks))
+        self.assertEqual(simulator.cycle_count, sum(int(stack.split(' ')[-1]) for stack in collapsed_stacks))
+
+    def test_static_analyzer(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            assembly_file = Path(temp_folder) / "loop.txt"
+            raw_assembly_lines = ["VAR i", "MOVLW 0", "MOVWF i", "LABEL loop // bound 5", "INCRF i", "MOVLW 5",
+                                  "GRTWF,0 i", "GOTO loop", "MOVFW i", "MOVWF 2", "CALL add_one", "WOUTW,1",
+                                  "FN add_one", "VAR x", "ADDWL,w 1", "MOVWF x", "RETFW x", "END"]
+            with open(assembly_file, 'w') as f:
+                f.write('\n'.join(raw_assembly_lines))
+            binary_file, disassembler_info = AssemblyCompiler().compile(str(assembly_file))
+            program_analysis = StaticAnalyzer(disassembler_info,
+                                              StaticAnalyzer.get_loop_bounds(raw_assembly_lines)).analyze()
+            simulator = FactorioMicrocontrollerSim(binary_file)
+            simulator.run(verbose=False, enable_igpu_sim=False)
+
+        # the loop runs as often as its bound, so the worst case is the cycles it takes
+        main_analysis = program_analysis.functions[0]
+        self.assertEqual(simulator.cycle_count, main_analysis.worst_case_cycles)
+        self.assertEqual(1, program_analysis.call_depth)
+        self.assertEqual(2, program_analysis.peak_address)
+        self.assertTrue(program_analysis.fits_memory)
+
+        binary_file, disassembler_info = AssemblyCompiler().compile(str(TEST_RESOURCE_FOLDER / "input_fibonacci.txt"))
+        remove_compiler_output(binary_file)
+        program_analysis = StaticAnalyzer(disassembler_info, dict()).analyze()
+        self.assertEqual(["fibonacci"], program_analysis.recursive_functions)
+        self.assertIsNone(program_analysis.call_depth)
+        self.assertIsNone(program_analysis.functions[0].worst_case_cycles)
+
+    def test_trace_recorder_and_diff(self):
+        with tempfile.TemporaryDirectory() as trace_folder:
+            trace_files = [Path(trace_folder) / "a.trace", Path(trace_folder) / "b.trace", Path(trace_folder) / "c.trace"]
+            for trace_file, sample_interval in zip(trace_files, [1, 2, 1]):
+                simulator = FactorioMicrocontrollerSim(TEST_RESOURCE_FOLDER / "fibonacci_binary.txt")
+                simulator.trace_recorder = TraceRecorder(trace_file, sample_interval)
+                simulator.run(verbose=False, enable_igpu_sim=False)
+
+            traces = [TraceRecorder.load(trace_file) for trace_file in trace_files]
+            self.assertEqual(214, len(traces[0]))
+            self.assertEqual(list(range(214)), traces[0]["cycle"].tolist())
+            self.assertEqual(5, traces[0]["output_2"][-1])
+            memory_writes = traces[0][traces[0]["memory_address"] >= 0]
+            self.assertEqual(5, memory_writes["memory_value"][0])
+
+            # the sampled trace lines up with the full one, until it is cut short
+            settings = [TraceRecorder.load_settings(trace_file) for trace_file in trace_files]
+            self.assertEqual(2, settings[1].sample_interval)
+            self.assertIsNone(TraceDiff.find_first_divergence(traces[0], traces[1], settings[0], settings[1]))
+            self.assertEqual(100, TraceDiff.find_first_divergence(traces[0], traces[1][:50], settings[0], settings[1]).cycle)
+
+            changed_trace = np.array(traces[2])
+            changed_trace["w_register"][100] += 1
+            divergence = TraceDiff.find_first_divergence(traces[0], changed_trace)
+            self.assertEqual(100, divergence.cycle)
+            self.assertEqual(["w_register"], divergence.fields)
+            del traces
+
+    def test_decode_instructions(self):
+        decoded_instructions = InstructionDecoder.decode_all_instructions(self.simulator.binary, InstructionExecutor())
+
+        self.assertEqual(len(self.simulator.binary), len(decoded_instructions))
+        for instruction in decoded_instructions:
+            self.assertIsNotNone(instruction.handler)
+
+        conditional = next(instruction for instruction in decoded_instructions if instruction.opcode == 'GRTWF0')
+        self.assertEqual('F', conditional.load)
+        self.assertEqual(0, conditional.skip_count)
+
+        output = next(instruction for instruction in decoded_instructions if instruction.opcode == 'WOUTF,2')
+        self.assertEqual('F', output.load)
+        self.assertEqual(1, output.io_index)
+
+    def test_state_snapshot_restore(self):
+        state = MicrocontrollerState()
+        state.write_f_memory(3, 42)
+        state.variable_offset = 5
+        state.push_scope()
+        snapshot = state.snapshot()
+
+        state.write_f_memory(3, 7)
+        state.pop_scope()
+        state.igpu_state.buffer1[0] = 1
+        state.restore(snapshot)
+
+        self.assertEqual(5, state.frame_base)
+        self.assertEqual([0, 5], state.variable_scope_stack)
+        self.assertEqual(0, state.read_f_memory(3))
+        self.assertEqual(42, state.f_memory[3])
+        self.assertEqual(0, state.igpu_state.buffer1[0])
+
+    def test_igpu_sim_binary_frames(self):
+        screen_buffer = [0] * 36
+        screen_buffer[0] = 1
+        screen_buffer[35] = 0xFFFFFFFF
+        frames = IGPUSim.get_binary_frames([[0] * 36, screen_buffer])
+
+        self.assertEqual((2, 32, 36), frames.shape)
+        self.assertFalse(frames[0].any())
+        self.assertTrue(frames[1][31][0])
+        self.assertFalse(frames[1][30][0])
+        self.assertTrue(frames[1][:, 35].all())
+
+    def test_igpu_sim_gif(self):
+        with tempfile.TemporaryDirectory() as temp_folder:
+            gif_file = Path(temp_folder) / "screen.gif"
+            igpu_sim = IGPUSim(str(gif_file))
+            for column in range(3):
+                screen_buffer = [0] * 36
+                screen_buffer[column] = 1
+                igpu_sim.add_frame(column * 100, screen_buffer)
+            igpu_sim.run(400)
+
+            # every frame is written with its own duration, the last one lasts until the end cycle
+            with Image.open(gif_file) as gif:
+                durations = [frame.info["duration"] for frame in ImageSequence.Iterator(gif)]
+            self.assertEqual(3, len(durations))
+            self.assertEqual(2 * durations[0], durations[2])
+            self.assertTrue((Path(temp_folder) / "screen_end.png").exists())
+
+    def test_source_index(self):
+        assembly_file = TEST_RESOURCE_FOLDER / "test_assembly.txt"
+        binary_file, disassembler_info = AssemblyCompiler().compile(str(assembly_file))
+        remove_compiler_output(binary_file)
+        source_index = SourceIndex(disassembler_info)
+
+        function_address = disassembler_info.function_addresses['fib']
+        self.assertEqual('fib', source_index.get_function(function_address))
+        self.assertEqual(disassembler_info.function_scopes['fib'][0], source_index.get_assembly_line(function_address))
+
+        halt_address = len(disassembler_info.function_scopes['__main__']) + 1
+        self.assertEqual(-1, source_index.get_assembly_line(halt_address).line_number)
+
 
 if __name__ == '__main__':
     unittest.main()